@@ -1,25 +1,39 @@
-from fastapi import FastAPI, Query, Request, HTTPException
+from fastapi import FastAPI, Query, Request, HTTPException, Header, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import RedirectResponse
 from datetime import datetime
 import json
 import logging
 import os
 import asyncio
-from pydantic import BaseModel
-from supabase import create_client, Client
+from pydantic import BaseModel, Field, field_validator
 # from supabase_async import create_client as create_async_client, AsyncClient # 非同期クライアントのインポートをコメントアウト
 import googlemaps
 from config import settings
 from services.google_maps_service import GoogleMapsService
-from services.location_service import LocationService
+from services.location_service import LocationService, response_degraded
 from services.sentiment_analysis_service import SentimentAnalysisService
+from services.ranking import RANKINGS, DEFAULT_RANKING
+from services.llm_gateway import get_gateway, close_gateways
+from services.circuit_breaker import snapshot_breakers
+from services.data_access import get_pool, close_pools, CellVersionRepository
+from services.admission import AdmissionController, AdmissionRejected, Admission, PRIORITY_USER, PRIORITY_BACKGROUND
+from services.fast_json import FastJSONResponse, SerializedPayload
+from services.shared_cache import get_cache, close_caches
+from services.structured_logging import configure_logging, shutdown_logging, RequestIdMiddleware
+from services.executors import get_executor, snapshot_executors, shutdown_executors, GOOGLE_EXECUTOR, DB_EXECUTOR
+from services.http_cache import (
+    DataVersionRegistry, ETagIndex, strong_etag, etag_matches, normalize_keyword, snap_to_cell, cache_control
+)
 # from mangum import Mangum # Mangum のインポートを削除
 
-# ロギング設定
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# ロギング設定 (書き込みは別スレッドで行い、リクエストごとの相関 ID を付ける)
+configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_VERBOSE_SAMPLE_RATE)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# 検索結果はアプリ内で組み立てた信頼できるデータなので、jsonable_encoder を通さずに orjson で JSON 化する
+app = FastAPI(default_response_class=FastJSONResponse)
+app.add_middleware(RequestIdMiddleware)
 
 # CORSミドルウェア
 origins = [
@@ -36,47 +50,205 @@ app.add_middleware(
 )
 
 # サービスの初期化
-google_maps_service = GoogleMapsService(api_key=settings.GOOGLE_MAPS_API_KEY)
-sentiment_service = SentimentAnalysisService(api_key=settings.OPENAI_API_KEY)
+# 同期の呼び出しは用途ごとのスレッドプールで行い、遅い Google の呼び出しが DB・キャッシュの読み書きを待たせないようにする
+get_executor(GOOGLE_EXECUTOR, settings.EXECUTOR_GOOGLE_WORKERS)
+get_executor(DB_EXECUTOR, settings.EXECUTOR_DB_WORKERS)
+# ジオコーディング・Place Details・LLM・周辺検索の結果は、プロセス内の LRU・/tmp の SQLite と (REDIS_URL があれば) Redis で共有する
+shared_cache = get_cache(
+    settings.REDIS_URL,
+    local_max_entries=settings.CACHE_LOCAL_MAX_ENTRIES,
+    timeout=settings.CACHE_REMOTE_TIMEOUT_SECONDS,
+    disk_path=settings.CACHE_DISK_PATH or None,
+    disk_max_bytes=settings.CACHE_DISK_MAX_MB * 1024 * 1024,
+)
+# 上流の障害時は呼び出しを打ち切り、DBの情報だけで応答する (レスポンスの degraded が True になる)
+circuit_options = {
+    "failure_rate_threshold": settings.CIRCUIT_FAILURE_RATE_THRESHOLD,
+    "slow_call_seconds": settings.CIRCUIT_SLOW_CALL_SECONDS,
+    "slow_call_rate_threshold": settings.CIRCUIT_SLOW_CALL_RATE_THRESHOLD,
+    "open_seconds": settings.CIRCUIT_OPEN_SECONDS,
+}
+google_maps_service = GoogleMapsService(
+    api_key=settings.GOOGLE_MAPS_API_KEY,
+    breaker_options=circuit_options,
+    hedge_place_details=settings.PLACE_DETAILS_HEDGING,
+    hedge_options={"percentile": settings.HEDGE_PERCENTILE, "budget_ratio": settings.HEDGE_BUDGET_RATIO},
+    base_url=settings.GOOGLE_MAPS_BASE_URL,
+    cache=shared_cache,
+)
+# OpenAI への接続はプロセス内で1つのプールを共有する
+llm_gateway = get_gateway(
+    settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL,
+    timeout=settings.OPENAI_TIMEOUT_SECONDS,
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+    breaker_options=circuit_options,
+) if settings.OPENAI_API_KEY else None
+sentiment_service = SentimentAnalysisService(
+    api_key=settings.OPENAI_API_KEY,
+    gateway=llm_gateway,
+    cascade_models=settings.OPENAI_CASCADE_MODELS,
+    confidence_threshold=settings.CASCADE_CONFIDENCE_THRESHOLD,
+    summary_model=settings.OPENAI_SUMMARY_MODEL,
+    cache=shared_cache,
+)
 
-# Supabase 同期クライアントの初期化に戻す
+# Supabase (PostgREST) へは共有の HTTP/2 コネクションプール経由で非同期にアクセスする
 if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
     logger.error("Supabase URLまたはKeyが設定されていません。")
-    supabase_client = None
+    db_pool = None
 else:
-    # create_client を使用して同期クライアントを初期化
-    supabase_client: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    db_pool = get_pool(
+        settings.SUPABASE_URL,
+        settings.SUPABASE_KEY,
+        timeout=settings.SUPABASE_TIMEOUT_SECONDS,
+        max_connections=settings.SUPABASE_MAX_CONNECTIONS,
+        max_retries=settings.SUPABASE_MAX_RETRIES,
+    )
 
-# LocationServiceに同期クライアントを渡す
-if supabase_client:
-    location_service = LocationService(google_maps_service, sentiment_service, supabase_client)
+# GET の検索レスポンスの ETag と、店舗の書き込みで上がるセルごとのデータバージョン (DB の cell_versions を共有する)
+data_versions = DataVersionRegistry(
+    store=CellVersionRepository(db_pool) if db_pool else None,
+    ttl=settings.CELL_VERSION_TTL_SECONDS,
+)
+etag_index = ETagIndex(data_versions)
+
+if db_pool:
+    location_service = LocationService(google_maps_service, sentiment_service, db_pool, data_versions=data_versions, cache=shared_cache)
 else:
     logger.warning("Supabaseクライアントが初期化できなかったため、保存機能なしで LocationService をセットアップします。")
     location_service = None
 
+# Google / OpenAI へファンアウトする検索の同時実行数を制限し、超えた分は DB のみ、さらに超えたら 429 にする
+admission_controller = AdmissionController(
+    max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+    max_db_only_in_flight=settings.ADMISSION_MAX_DB_ONLY_IN_FLIGHT,
+    background_max_in_flight=settings.ADMISSION_BACKGROUND_MAX_IN_FLIGHT,
+)
+
+def _acquire_admission(x_request_priority: str | None, weight: int = 1) -> Admission:
+    priority = PRIORITY_BACKGROUND if x_request_priority == PRIORITY_BACKGROUND else PRIORITY_USER
+    try:
+        return admission_controller.acquire(priority, weight)
+    except AdmissionRejected as e:
+        logger.warning("Search rejected by admission control (%s): %s", priority, e)
+        raise HTTPException(
+            status_code=429,
+            detail="混雑しています。しばらくしてから再度お試しください。",
+            headers={"Retry-After": e.retry_after_header},
+        )
+
+async def admit_search(x_request_priority: str | None = Header(None)):
+    """検索の枠を確保する。バックグラウンド更新は X-Request-Priority: background を付けて呼ぶ"""
+    with _acquire_admission(x_request_priority) as admission:
+        yield admission
+
+def _cache_headers(etag: str) -> dict:
+    return {
+        "ETag": etag,
+        "Cache-Control": cache_control(settings.HTTP_CACHE_MAX_AGE, settings.HTTP_CACHE_S_MAXAGE, settings.HTTP_CACHE_STALE_WHILE_REVALIDATE),
+    }
+
+async def conditional_search(key: str, if_none_match: str | None, query_point: tuple | None, search):
+    """
+    正規化した検索キーで ETag を管理し、If-None-Match が一致すれば 304 を返す。
+    前回の ETag が依存するセルのデータが変わっていなければ、検索自体を行わずに 304 にする。
+    縮退モードの結果はキャッシュさせない。
+    """
+    etag = await etag_index.current_etag(key)
+    if etag and etag_matches(if_none_match, etag):
+        etag_index.count("not_modified_without_search")
+        return Response(status_code=304, headers=_cache_headers(etag))
+
+    results = await search()
+    payload = SerializedPayload({"results": results, "degraded": response_degraded()})
+    if payload.content["degraded"]:
+        return FastJSONResponse(payload, headers={"Cache-Control": "no-store"})
+
+    etag = strong_etag(payload.body)
+    points = [(result.get("lat"), result.get("lng")) for result in results]
+    if query_point:
+        points.append(query_point)
+    await etag_index.store(key, etag, points)
+    if etag_matches(if_none_match, etag):
+        etag_index.count("not_modified_after_search")
+        return Response(status_code=304, headers=_cache_headers(etag))
+    etag_index.count("full_responses")
+    return FastJSONResponse(payload, headers=_cache_headers(etag))
+
 # --- リクエストボディのモデル定義を追加 ---
-class SearchRequest(BaseModel):
+class Location(BaseModel):
     latitude: float
     longitude: float
+
+class SearchRequest(Location):
+    # 指定すると検索半径を密度に合わせて調整し、近い順にこの件数まで返す
+    target_count: int | None = Field(default=None, ge=1, le=20)
+    # 並び順 (services/ranking.py の RANKINGS のキー)
+    ranking: str = DEFAULT_RANKING
+    # 指定した喫煙状況 (禁煙/分煙/喫煙可) の店舗を優先する
+    smoking_preference: str | None = None
+    limit: int | None = Field(default=None, ge=1)
+
+    @field_validator("ranking")
+    @classmethod
+    def validate_ranking(cls, value: str) -> str:
+        if value not in RANKINGS:
+            raise ValueError(f"未知のランキングです: {value}")
+        return value
+
+class BatchSearchRequest(BaseModel):
+    locations: list[Location] = Field(default_factory=list)
+    keywords: list[str] = Field(default_factory=list)
 # -------------------------------------
 
+async def admit_batch_search(request: BatchSearchRequest, x_request_priority: str | None = Header(None)):
+    """バッチ検索の枠を、まとめて検索する地点・キーワードの数だけ確保する"""
+    with _acquire_admission(x_request_priority, len(request.locations) + len(request.keywords)) as admission:
+        yield admission
+
+@app.on_event("shutdown")
+async def shutdown():
+    # 共有している OpenAI / Supabase の接続プールを閉じる
+    await close_gateways()
+    await close_pools()
+    close_caches()
+    shutdown_executors()
+    shutdown_logging()
+
 @app.get("/")
 async def root():
     return {"message": "雀荘検索API", "version": "1.0"}
 
 @app.get("/api/search_by_keyword")
-async def api_search_by_keyword(keyword: str = Query(...)):
+async def api_search_by_keyword(
+    keyword: str = Query(...),
+    ranking: str | None = Query(None),
+    smoking_preference: str | None = Query(None),
+    limit: int | None = Query(None, ge=1),
+    if_none_match: str | None = Header(None),
+    admission: Admission = Depends(admit_search),
+):
     # LocationServiceが初期化されているかチェック
     if not location_service:
         logger.error("LocationServiceが初期化されていません（Supabase設定不備の可能性）。")
         raise HTTPException(status_code=500, detail="サーバー内部エラー: サービスが利用できません。")
+    if ranking is not None and ranking not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"未知のランキングです: {ranking}")
 
     logger.info(f"Keyword search request received: keyword={keyword}")
     try:
         # LocationService にキーワード検索メソッドを呼び出す (後で LocationService に実装)
-        results = await location_service.search_by_keyword(keyword)
-        logger.info(f"Keyword search completed. Found {len(results)} results.")
-        return {"results": results}
+        keyword = normalize_keyword(keyword)
+        key = f"keyword:{keyword}:{ranking}:{smoking_preference}:{limit}"
+        return await conditional_search(key, if_none_match, None, lambda: location_service.search_by_keyword(
+            keyword,
+            ranking=ranking,
+            smoking_preference=smoking_preference,
+            limit=limit,
+            allow_upstream=admission.allow_upstream
+        ))
     except googlemaps.exceptions.ApiError as e: # googlemaps をインポートする必要がある
         logger.error(f"Google Maps API error: {e}")
         raise HTTPException(status_code=500, detail="Google Maps API エラーが発生しました。")
@@ -87,8 +259,58 @@ async def api_search_by_keyword(keyword: str = Query(...)):
         logger.error(f"An unexpected error occurred during keyword search: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="予期せぬエラーが発生しました。")
 
+@app.get("/api/search")
+async def search_nearby_cacheable(
+    request: Request,
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    target_count: int | None = Query(None, ge=1, le=20),
+    ranking: str = Query(DEFAULT_RANKING),
+    smoking_preference: str | None = Query(None),
+    limit: int | None = Query(None, ge=1),
+    if_none_match: str | None = Header(None),
+    admission: Admission = Depends(admit_search),
+):
+    """
+    POST /api/search の GET 版。CDN でキャッシュできるよう、地点を約76m四方のセルの中心に丸めて検索し、
+    ETag と Cache-Control を付けて返す。
+    CDN は URL をそのままキーにするため、セルの中心以外の座標は丸めた座標の URL へ 308 でリダイレクトする
+    (同じセル内の検索が1つのキャッシュエントリにまとまる)。
+    """
+    if not location_service:
+        logger.error("LocationServiceが初期化されていません（Supabase設定不備の可能性）。")
+        raise HTTPException(status_code=500, detail="サーバー内部エラー: サービスが利用できません。")
+    if ranking not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"未知のランキングです: {ranking}")
+
+    snapped_latitude, snapped_longitude = snap_to_cell(latitude, longitude)
+    if (latitude, longitude) != (snapped_latitude, snapped_longitude):
+        url = request.url.include_query_params(latitude=snapped_latitude, longitude=snapped_longitude)
+        # 座標からセルへの対応は変わらないので、リダイレクト自体も CDN にキャッシュさせる
+        return RedirectResponse(str(url), status_code=308, headers={
+            "Cache-Control": cache_control(settings.HTTP_CACHE_MAX_AGE, settings.HTTP_CACHE_S_MAXAGE, settings.HTTP_CACHE_STALE_WHILE_REVALIDATE),
+        })
+    logger.info("Cacheable search request received: cell=(%s, %s)", latitude, longitude)
+    try:
+        key = f"nearby:{latitude}:{longitude}:{target_count}:{ranking}:{smoking_preference}:{limit}"
+        return await conditional_search(key, if_none_match, (latitude, longitude), lambda: location_service.search_nearby_jongso(
+            latitude=latitude,
+            longitude=longitude,
+            target_count=target_count,
+            ranking=ranking,
+            smoking_preference=smoking_preference,
+            limit=limit,
+            allow_upstream=admission.allow_upstream
+        ))
+    except googlemaps.exceptions.ApiError as e:
+        logger.error("Google Maps API error: %s", e)
+        raise HTTPException(status_code=500, detail="Google Maps API エラーが発生しました。")
+    except Exception as e:
+        logger.error("An unexpected error occurred: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="予期せぬエラーが発生しました。")
+
 @app.post("/api/search")
-async def search_nearby(request: SearchRequest):
+async def search_nearby(request: SearchRequest, admission: Admission = Depends(admit_search)):
     # LocationServiceが初期化されているかチェック
     if not location_service:
         logger.error("LocationServiceが初期化されていません（Supabase設定不備の可能性）。")
@@ -98,10 +320,15 @@ async def search_nearby(request: SearchRequest):
     try:
         results = await location_service.search_nearby_jongso(
             latitude=request.latitude,
-            longitude=request.longitude
+            longitude=request.longitude,
+            target_count=request.target_count,
+            ranking=request.ranking,
+            smoking_preference=request.smoking_preference,
+            limit=request.limit,
+            allow_upstream=admission.allow_upstream
         )
         logger.info(f"Search completed. Found {len(results)} results.")
-        return {"results": results}
+        return FastJSONResponse({"results": results, "degraded": response_degraded()})
     except googlemaps.exceptions.ApiError as e:
         logger.error(f"Google Maps API error: {e}")
         raise HTTPException(status_code=500, detail="Google Maps API エラーが発生しました。")
@@ -109,6 +336,65 @@ async def search_nearby(request: SearchRequest):
         logger.error(f"An unexpected error occurred: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="予期せぬエラーが発生しました。")
 
+@app.post("/api/search_batch")
+async def search_batch(request: BatchSearchRequest, admission: Admission = Depends(admit_batch_search)):
+    # LocationServiceが初期化されているかチェック
+    if not location_service:
+        logger.error("LocationServiceが初期化されていません（Supabase設定不備の可能性）。")
+        raise HTTPException(status_code=500, detail="サーバー内部エラー: サービスが利用できません。")
+
+    logger.info("Batch search request received: locations=%s, keywords=%s", len(request.locations), len(request.keywords))
+    try:
+        results = await location_service.search_batch(
+            locations=[(location.latitude, location.longitude) for location in request.locations],
+            keywords=request.keywords,
+            allow_upstream=admission.allow_upstream
+        )
+        logger.info("Batch search completed for %s inputs.", len(results))
+        return FastJSONResponse({"results": results, "degraded": response_degraded()})
+    except ValueError as e:
+        logger.warning("Batch search warning: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("An unexpected error occurred during batch search: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="予期せぬエラーが発生しました。")
+
+@app.get("/api/search_bbox")
+async def search_bbox(
+    south: float = Query(...),
+    west: float = Query(...),
+    north: float = Query(...),
+    east: float = Query(...),
+    zoom: int = Query(..., ge=0, le=21),
+):
+    # LocationServiceが初期化されているかチェック
+    if not location_service:
+        logger.error("LocationServiceが初期化されていません（Supabase設定不備の可能性）。")
+        raise HTTPException(status_code=500, detail="サーバー内部エラー: サービスが利用できません。")
+
+    try:
+        return FastJSONResponse(await location_service.search_in_bounds(south, west, north, east, zoom))
+    except ValueError as e:
+        logger.warning("BBox search warning: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("An unexpected error occurred during bbox search: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="予期せぬエラーが発生しました。")
+
+@app.get("/api/metrics")
+def metrics():
+    # 閾値やプールサイズの調整用に、各コンポーネントの実行統計を返す
+    return {
+        "llm_cascade": sentiment_service.cascade.metrics.snapshot(),
+        "circuit_breakers": snapshot_breakers(),
+        "db_queries": db_pool.metrics.snapshot() if db_pool else None,
+        "admission": admission_controller.snapshot(),
+        "http_cache": etag_index.snapshot(),
+        "shared_cache": shared_cache.snapshot(),
+        "executors": snapshot_executors(),
+        "place_details_hedging": google_maps_service.details_hedger.snapshot() if google_maps_service.details_hedger else None,
+    }
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
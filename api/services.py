@@ -8,7 +8,16 @@ from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 import os
 import datetime
-from supabase import create_client, Client
+from services.data_access import PostgrestPool, JongsoShopRepository
+from services.ranking import rank_results
+from services.review_preprocessor import prepare_reviews
+from services.llm_gateway import get_gateway
+from services.hedging import Hedger
+from services.executors import get_executor, GOOGLE_EXECUTOR
+from services.shop_record import ShopRecord
+from services.structured_logging import verbose_enabled
+
+REVIEW_TOKEN_BUDGET = 1200 # プロンプトに含めるレビューの合計最大トークン数
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +32,8 @@ class SentimentAnalysisService:
                 openai_api_key=settings.OPENAI_API_KEY,
                 temperature=0,
                 model=chat_model,
+                # 他の分析クラスと OpenAI の接続プールを共有する
+                http_async_client=get_gateway(settings.OPENAI_API_KEY).http_client,
             )
         self.sentiment_prompt = ChatPromptTemplate.from_template("""
 あなたは{genre}の専門家です。
@@ -68,60 +79,64 @@ class SentimentAnalysisService:
         if not reviews:
             return {"summary": "情報なし", "positive_score": None, "negative_score": None}
 
-        combined_reviews = "\n".join(reviews)
-        if len(combined_reviews) > 3000:
-            combined_reviews = combined_reviews[:3000]
+        combined_reviews = "\n".join(prepare_reviews(reviews, REVIEW_TOKEN_BUDGET))
 
-        logger.info(f"感情分析実行: レビュー数={len(reviews)}, 文字数={len(combined_reviews)}")
+        logger.info("感情分析実行: レビュー数=%s, 文字数=%s", len(reviews), len(combined_reviews))
         try:
             response = await self.llm.ainvoke(
                 self.sentiment_prompt.format(genre="雀荘", combined_reviews=combined_reviews)
             )
             content = response.content
-            logger.info(f"感情分析 応答: {content}")
+            logger.debug("感情分析 応答: %s", content)
 
             lines = content.splitlines()
             summary = "情報なし"
             positive_score = None
             negative_score = None
 
+            # 行ごとのログはサンプリングされたリクエストでだけ出す (判定はループの前に1回だけ行う)
+            verbose = verbose_enabled()
             logger.debug("感情分析レスポンスのパース開始")
             for line in lines:
-                logger.debug(f"パース中の行(感情): {line}")
+                if verbose:
+                    logger.debug("パース中の行(感情): %s", line)
                 if "要約:" in line:
                     summary = line.split("要約:")[-1].strip()
-                    logger.debug(f"  -> 要約抽出: {summary}")
+                    if verbose:
+                        logger.debug("  -> 要約抽出: %s", summary)
                 if "ポジティブ度:" in line:
                     try:
                         score_str = line.split("ポジティブ度:")[-1].replace("%", "").strip()
                         if score_str.isdigit():
                             positive_score = int(score_str)
-                            logger.debug(f"  -> ポジティブ度抽出: {positive_score}")
+                            if verbose:
+                                logger.debug("  -> ポジティブ度抽出: %s", positive_score)
                         else:
-                            logger.warning(f"ポジティブ度の値が数字ではありません: '{score_str}' (元行: {line})")
+                            logger.warning("ポジティブ度の値が数字ではありません: '%s' (元行: %s)", score_str, line)
                     except Exception as parse_e:
-                        logger.warning(f"ポジティブ度のパース中にエラー: {parse_e} (元行: {line})")
+                        logger.warning("ポジティブ度のパース中にエラー: %s (元行: %s)", parse_e, line)
                 if "ネガティブ度:" in line:
                     try:
                         score_str = line.split("ネガティブ度:")[-1].replace("%", "").strip()
                         if score_str.isdigit():
                             negative_score = int(score_str)
-                            logger.debug(f"  -> ネガティブ度抽出: {negative_score}")
+                            if verbose:
+                                logger.debug("  -> ネガティブ度抽出: %s", negative_score)
                         else:
-                            logger.warning(f"ネガティブ度の値が数字ではありません: '{score_str}' (元行: {line})")
+                            logger.warning("ネガティブ度の値が数字ではありません: '%s' (元行: %s)", score_str, line)
                     except Exception as parse_e:
-                        logger.warning(f"ネガティブ度のパース中にエラー: {parse_e} (元行: {line})")
+                        logger.warning("ネガティブ度のパース中にエラー: %s (元行: %s)", parse_e, line)
             logger.debug("感情分析レスポンスのパース完了")
 
             if not summary:
                 summary = "情報なし"
 
             result_data = {"summary": summary, "positive_score": positive_score, "negative_score": negative_score}
-            logger.info(f"感情分析結果: {result_data}")
+            logger.debug("感情分析結果: %s", result_data)
             return result_data
 
         except Exception as e:
-            logger.error(f"感情分析API呼び出しエラー: {e}", exc_info=True)
+            logger.error("感情分析API呼び出しエラー: %s", e, exc_info=True)
             return {"summary": "分析エラー", "positive_score": None, "negative_score": None}
 
     # --- 喫煙状況分析メソッドを追加 ---
@@ -133,43 +148,47 @@ class SentimentAnalysisService:
         if not reviews:
             return "情報なし" # レビューがない
 
-        combined_reviews = "\n".join(reviews)
-        if len(combined_reviews) > 3000:
-            combined_reviews = combined_reviews[:3000]
+        combined_reviews = "\n".join(prepare_reviews(reviews, REVIEW_TOKEN_BUDGET))
 
-        logger.info(f"喫煙状況分析実行: レビュー数={len(reviews)}, 文字数={len(combined_reviews)}")
+        logger.info("喫煙状況分析実行: レビュー数=%s, 文字数=%s", len(reviews), len(combined_reviews))
         try:
             response = await self.llm.ainvoke(
                 self.smoking_prompt.format(combined_reviews=combined_reviews) # 喫煙状況用プロンプトを使用
             )
             result_text = response.content.strip()
-            logger.info(f"喫煙状況分析 応答: {result_text}")
+            logger.debug("喫煙状況分析 応答: %s", result_text)
 
             # 応答が選択肢のいずれかに合致するか確認
             valid_statuses = ["禁煙", "分煙", "喫煙可", "情報なし"]
             if result_text in valid_statuses:
-                logger.info(f"喫煙状況分析結果: {result_text}")
+                logger.info("喫煙状況分析結果: %s", result_text)
                 return result_text
             else:
-                logger.warning(f"喫煙状況分析の応答が予期せぬ形式です: '{result_text}'. '情報なし'として扱います。")
+                logger.warning("喫煙状況分析の応答が予期せぬ形式です: '%s'. '情報なし'として扱います。", result_text)
                 return "情報なし" # 予期せぬ応答の場合はデフォルト
 
         except Exception as e:
-            logger.error(f"喫煙状況分析API呼び出しエラー: {e}", exc_info=True)
+            logger.error("喫煙状況分析API呼び出しエラー: %s", e, exc_info=True)
             return "情報なし" # エラー時もデフォルト
     # ----------------------------------\n
 
 class GoogleMapsService:
     def __init__(self, api_key: str):
         self.client = googlemaps.Client(key=api_key)
+        # 場所詳細は p95 を過ぎたら重複発行し、先に返った方を使う
+        self.details_hedger = Hedger(
+            "place_details",
+            percentile=settings.HEDGE_PERCENTILE,
+            budget_ratio=settings.HEDGE_BUDGET_RATIO,
+        ) if settings.PLACE_DETAILS_HEDGING else None
+        # googlemaps は同期クライアントなので、DB・キャッシュと分けた google のプールで呼ぶ (services/executors.py)
+        self.executor = get_executor(GOOGLE_EXECUTOR)
 
     async def search_nearby_places(self, latitude: float, longitude: float) -> Dict[str, Any]:
         """位置情報に基づいて近くの雀荘を検索する"""
-        logger.info(f"Google Maps API検索開始: lat={latitude}, lng={longitude}")
-        loop = asyncio.get_event_loop()
+        logger.info("Google Maps API検索開始: lat=%s, lng=%s", latitude, longitude)
         try:
-            result = await loop.run_in_executor(
-                None,
+            result = await self.executor.run(
                 partial(
                     self.client.places_nearby,
                     location=(latitude, longitude),
@@ -179,18 +198,16 @@ class GoogleMapsService:
                     language="ja"
                 )
             )
-            logger.info(f"Google Maps API検索完了. ステータス: {result.get('status')}, 結果件数: {len(result.get('results', []))}")
+            logger.info("Google Maps API検索完了. ステータス: %s, 結果件数: %s", result.get('status'), len(result.get('results', [])))
             # logger.debug(f"Google Maps API Raw Response: {result}") # 詳細デバッグ用
             return result
         except Exception as e:
-            logger.error(f"Google Maps API エラー: {e}", exc_info=True)
+            logger.error("Google Maps API エラー: %s", e, exc_info=True)
             raise
 
     async def search_by_keyword(self, keyword: str) -> dict:
         """キーワードで雀荘を検索する"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
+        return await self.executor.run(
             partial(
                 self.client.places,
                 query=f"{keyword} 麻雀",
@@ -200,22 +217,22 @@ class GoogleMapsService:
 
     async def get_place_details(self, place_id: str) -> Dict[str, Any]:
         """場所の詳細情報を取得する"""
-        logger.info(f"場所詳細取得開始: place_id={place_id}")
-        loop = asyncio.get_event_loop()
+        logger.info("場所詳細取得開始: place_id=%s", place_id)
+        fetch = partial(
+            self.client.place,
+            place_id=place_id,
+            fields=["name", "vicinity", "geometry", "rating", "user_ratings_total", "review"],
+            language="ja"
+        )
         try:
-            details = await loop.run_in_executor(
-                None,
-                partial(
-                    self.client.place,
-                    place_id=place_id,
-                    fields=["name", "vicinity", "geometry", "rating", "user_ratings_total", "review"],
-                    language="ja"
-                )
-            )
-            logger.info(f"場所詳細取得完了: place_id={place_id}, ステータス: {details.get('status')}")
+            if self.details_hedger is not None:
+                details = await self.details_hedger.acall(fetch)
+            else:
+                details = await self.executor.run(fetch)
+            logger.info("場所詳細取得完了: place_id=%s, ステータス: %s", place_id, details.get('status'))
             return details
         except Exception as e:
-            logger.error(f"場所詳細取得エラー: place_id={place_id}, {e}", exc_info=True)
+            logger.error("場所詳細取得エラー: place_id=%s, %s", place_id, e, exc_info=True)
             return {"result": {}, "status": "ERROR"}
 
     async def get_place_reviews(self, place_id: str) -> List[str]:
@@ -223,25 +240,25 @@ class GoogleMapsService:
         details = await self.get_place_details(place_id)
         reviews_data = details.get("result", {}).get("reviews", [])
         reviews_text = [r.get("text", "") for r in reviews_data[:5] if r.get("text")]
-        logger.info(f"口コミ取得: place_id={place_id}, 件数={len(reviews_text)}")
+        logger.info("口コミ取得: place_id=%s, 件数=%s", place_id, len(reviews_text))
         return reviews_text
 
 class LocationService:
-    def __init__(self, google_maps_service: GoogleMapsService, sentiment_service: SentimentAnalysisService, supabase_client: Client):
+    def __init__(self, google_maps_service: GoogleMapsService, sentiment_service: SentimentAnalysisService, db_pool: PostgrestPool):
         self.google_maps_service = google_maps_service
         self.sentiment_service = sentiment_service
-        self.supabase = supabase_client
+        self.shops = JongsoShopRepository(db_pool)
         # --- DB操作の同時実行数を制限するセマフォを追加 (例: 5) ---
         self.db_semaphore = asyncio.Semaphore(5)
         # --------------------------------------------------------
 
-    async def search_nearby_jongso(self, latitude: float, longitude: float) -> List[Dict[str, Any]]:
+    async def search_nearby_jongso(self, latitude: float, longitude: float) -> List[ShopRecord]:
         """位置情報に基づいて雀荘を検索し、DBに存在すればDBから、なければ新規取得・分析・保存する"""
         logger.info("LocationService: search_nearby_jongso 呼び出し")
         places_result = await self.google_maps_service.search_nearby_places(latitude, longitude)
 
         place_list = places_result.get("results", [])
-        logger.info(f"Google Mapsから {len(place_list)} 件の結果を取得")
+        logger.info("Google Mapsから %s 件の結果を取得", len(place_list))
 
         tasks = []
         for place in place_list:
@@ -257,40 +274,26 @@ class LocationService:
 
         for result_tuple in processed_results:
             if result_tuple:
-                shop_data, source = result_tuple
-                if shop_data:
-                    response_data = shop_data.copy()
-                    # DBから取得した場合、キーはDBのカラム名のはず
-                    # place_id が shop_data (DBから取得) にある前提
-                    current_place_id = shop_data.get('place_id')
-                    if current_place_id:
-                        response_data['id'] = current_place_id # レスポンス用IDを設定
-                        # DBデータには place_id しかないので削除は不要
-                        # response_data.pop('place_id', None) # もし残っていても削除
-                    else:
-                         logger.warning(f"shop_data に place_id が含まれていません: {shop_data}")
-                         continue
-
-                    valid_results_for_response.append(response_data)
-
-                    if source == 'db':
-                        # 更新は place_id で行う
-                        update_tasks.append(self._update_last_fetched_at(current_place_id))
-                    elif source == 'new':
-                        # 保存は place_id を含む元の shop_data で行う
-                        save_tasks.append(self._save_shop_if_not_exists(shop_data))
+                shop, source = result_tuple
+                # レスポンスの id は ShopRecord.to_dict() で place_id から付ける
+                valid_results_for_response.append(shop)
+
+                if source == 'db':
+                    update_tasks.append(self._update_last_fetched_at(shop.place_id))
+                elif source == 'new':
+                    save_tasks.append(self._save_shop_if_not_exists(shop))
 
         background_tasks = save_tasks + update_tasks
         if background_tasks:
             # タスクをバックグラウンドで実行 (セマフォによる制御は各メソッド内で行う)
             for task in background_tasks:
                 asyncio.create_task(task)
-            logger.info(f"{len(save_tasks)} 件の新規保存、{len(update_tasks)} 件の最終取得日時更新処理を開始しました（バックグラウンド実行）")
+            logger.info("%s 件の新規保存、%s 件の最終取得日時更新処理を開始しました（バックグラウンド実行）", len(save_tasks), len(update_tasks))
 
-        logger.info(f"最終的なAPI応答結果件数: {len(valid_results_for_response)}")
+        logger.info("最終的なAPI応答結果件数: %s", len(valid_results_for_response))
         return self._sort_results(valid_results_for_response)
 
-    async def _process_place(self, place: Dict[str, Any]) -> Optional[tuple[Dict[str, Any], str]]:
+    async def _process_place(self, place: Dict[str, Any]) -> Optional[tuple[ShopRecord, str]]:
         """個々の店舗情報を処理。DBにあればDBから返し、なければGoogle Maps/AI処理して返す"""
         place_id = place.get("place_id")
         name = place.get("name", "")
@@ -298,27 +301,17 @@ class LocationService:
              logger.warning("_process_place に place_id がないデータが渡されました。スキップします。")
              return None
 
-        logger.debug(f"店舗処理開始(DBチェック含む): {name} (place_id={place_id})" )
+        logger.debug("店舗処理開始(DBチェック含む): %s (place_id=%s)", name, place_id )
 
         try:
             # 1. Supabase DBに place_id が存在するか確認 (セマフォは使わない)
-            loop = asyncio.get_event_loop()
-            db_response = await loop.run_in_executor(
-                None,
-                lambda: self.supabase.table("jongso_shops")
-                .select("*, place_id") # place_id も含めて全カラム取得
-                .eq("place_id", place_id)
-                .maybe_single()
-                .execute()
-            )
-
-            if db_response.data:
-                logger.info(f"DBヒット: {name} (place_id={place_id}) の情報をDBから取得しました。")
-                shop_data_from_db = db_response.data
-                return shop_data_from_db, "db"
+            shop_data_from_db = await self.shops.get(place_id)
+            if shop_data_from_db:
+                logger.debug("DBヒット: %s (place_id=%s) の情報をDBから取得しました。", name, place_id)
+                return ShopRecord.from_db_row(shop_data_from_db), "db"
 
             # 2. DBに存在しない場合: Google Maps / AI 処理を実行 (セマフォは使わない)
-            logger.info(f"DBミス: {name} (place_id={place_id}) は新規情報。Google Maps/AI処理を実行します。")
+            logger.info("DBミス: %s (place_id=%s) は新規情報。Google Maps/AI処理を実行します。", name, place_id)
 
             reviews = await self.google_maps_service.get_place_reviews(place_id)
             sentiment_task = self.sentiment_service.analyze_reviews(reviews)
@@ -337,66 +330,48 @@ class LocationService:
             lat = location.get("lat")
             lng = location.get("lng")
 
-            # Supabase保存用データを作成 (place_id を含む)
-            shop_data_new = {
-                "place_id": place_id,
-                "name": name,
-                "address": address,
-                "lat": float(lat) if lat is not None else None,
-                "lng": float(lng) if lng is not None else None,
-                "rating": rating,
-                "user_ratings_total": user_ratings_total,
-                "positive_score": sentiment_result["positive_score"],
-                "negative_score": sentiment_result["negative_score"],
-                "summary": sentiment_result["summary"],
-                "smoking_status": smoking_status_result,
-                "last_fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
-            }
-            logger.info(f"店舗処理完了(新規): {name} - Sentiment: P{sentiment_result['positive_score']} N{sentiment_result['negative_score']}, Smoking: {smoking_status_result}")
-
-            return shop_data_new, "new"
+            shop = ShopRecord(
+                place_id=place_id,
+                name=name,
+                address=address,
+                lat=float(lat) if lat is not None else None,
+                lng=float(lng) if lng is not None else None,
+                rating=rating,
+                user_ratings_total=user_ratings_total,
+                positive_score=sentiment_result["positive_score"],
+                negative_score=sentiment_result["negative_score"],
+                summary=sentiment_result["summary"],
+                smoking_status=smoking_status_result,
+                last_fetched_at=datetime.datetime.now(datetime.timezone.utc).isoformat()
+            )
+            logger.info("店舗処理完了(新規): %s - Sentiment: P%s N%s, Smoking: %s", name, sentiment_result['positive_score'], sentiment_result['negative_score'], smoking_status_result)
+
+            return shop, "new"
 
         except Exception as e:
-            logger.error(f"店舗処理エラー: {name} (place_id={place_id}), {e}", exc_info=True)
+            logger.error("店舗処理エラー: %s (place_id=%s), %s", name, place_id, e, exc_info=True)
             return None
 
-    async def _save_shop_if_not_exists(self, shop_data: Dict[str, Any]):
+    async def _save_shop_if_not_exists(self, shop: ShopRecord):
         """place_id が存在しない場合、Supabaseに雀荘情報を保存する (同時実行数制限付き)"""
-        place_id = shop_data.get("place_id")
+        place_id = shop.place_id
         if not place_id:
             logger.warning("save: place_id がないためスキップします。")
             return
 
         async with self.db_semaphore: # セマフォを取得
-            logger.debug(f"save: セマフォ取得 (place_id={place_id})" )
+            logger.debug("save: セマフォ取得 (place_id=%s)", place_id )
             try:
-                logger.debug(f"Supabase 保存チェック開始: place_id={place_id}")
-                loop = asyncio.get_event_loop()
-                # 存在チェック
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.supabase.table("jongso_shops").select("place_id", count="exact").eq("place_id", place_id).execute()
-                )
-                existing_count = response.count
-                logger.debug(f"Supabase 保存チェック結果: place_id={place_id}, count={existing_count}")
-
-                if existing_count is not None and existing_count == 0:
-                    logger.info(f"新規店舗情報、Supabaseへ保存実行: place_id={place_id}, name={shop_data.get('name')}")
-                    # 挿入実行
-                    insert_response = await loop.run_in_executor(
-                        None,
-                        lambda: self.supabase.table("jongso_shops").insert({k: v for k, v in shop_data.items() if v is not None}).execute()
-                    )
-                    if hasattr(insert_response, 'data') and insert_response.data:
-                         logger.info(f"Supabaseへの保存成功: place_id={place_id}")
-                    else:
-                         logger.error(f"Supabaseへの保存に失敗または予期せぬ応答: place_id={place_id}, response={insert_response}")
-                # else: # 存在する場合は何もしない (ログも不要)
+                # 存在チェックと挿入を1回の upsert (既存行は変更しない) で行う
+                logger.info("新規店舗情報、Supabaseへ保存実行: place_id=%s, name=%s", place_id, shop.name)
+                row = shop.to_db_row(shop.last_fetched_at)
+                await self.shops.insert_if_absent([{k: v for k, v in row.items() if v is not None}])
+                logger.info("Supabaseへの保存成功: place_id=%s", place_id)
 
             except Exception as e:
-                logger.error(f"Supabase 保存操作中にエラーが発生しました (place_id={place_id}): {e}", exc_info=True)
+                logger.error("Supabase 保存操作中にエラーが発生しました (place_id=%s): %s", place_id, e, exc_info=True)
             finally:
-                 logger.debug(f"save: セマフォ解放 (place_id={place_id})" )
+                 logger.debug("save: セマフォ解放 (place_id=%s)", place_id )
                  # セマフォは async with ブロックを抜ける際に自動的に解放される
 
     async def _update_last_fetched_at(self, place_id: str):
@@ -406,34 +381,19 @@ class LocationService:
             return
 
         async with self.db_semaphore: # セマフォを取得
-            logger.debug(f"update: セマフォ取得 (place_id={place_id})" )
+            logger.debug("update: セマフォ取得 (place_id=%s)", place_id )
             try:
-                logger.debug(f"Supabase last_fetched_at 更新開始: place_id={place_id}")
-                loop = asyncio.get_event_loop()
-                # 更新実行
-                update_response = await loop.run_in_executor(
-                    None,
-                    lambda: self.supabase.table("jongso_shops")
-                    .update({"last_fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat()})
-                    .eq("place_id", place_id)
-                    .execute()
-                )
-
-                if hasattr(update_response, 'data') and update_response.data:
-                     logger.info(f"Supabase last_fetched_at 更新成功: place_id={place_id}")
-                else:
-                     logger.warning(f"Supabase last_fetched_at 更新結果が空でした (レコードが存在しない可能性?): place_id={place_id}, response={update_response}")
+                logger.debug("Supabase last_fetched_at 更新開始: place_id=%s", place_id)
+                await self.shops.set_last_fetched_at(place_id, datetime.datetime.now(datetime.timezone.utc).isoformat())
+                logger.info("Supabase last_fetched_at 更新成功: place_id=%s", place_id)
 
             except Exception as e:
-                # ConnectionTerminated もここで捕捉される
-                logger.error(f"Supabase last_fetched_at 更新中にエラーが発生しました (place_id={place_id}): {e}", exc_info=True)
+                # ConnectionTerminated は data_access で再試行した上で、なお失敗した場合だけここに来る
+                logger.error("Supabase last_fetched_at 更新中にエラーが発生しました (place_id=%s): %s", place_id, e, exc_info=True)
             finally:
-                logger.debug(f"update: セマフォ解放 (place_id={place_id})" )
+                logger.debug("update: セマフォ解放 (place_id=%s)", place_id )
                 # セマフォは async with ブロックを抜ける際に自動的に解放される
 
-    def _sort_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _sort_results(self, results: List[ShopRecord]) -> List[ShopRecord]:
         """評価とレビュー数でソートする (API応答データ用)"""
-        return sorted(
-            results,
-            key=lambda x: (-float(x.get("rating", 0) or 0), -int(x.get("user_ratings_total", 0) or 0))
-        )
\ No newline at end of file
+        return rank_results(results, "rating_reviews")
\ No newline at end of file
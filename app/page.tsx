@@ -26,11 +26,12 @@ const fetcher = async (url: string, body: { latitude: number; longitude: number
   console.log(`Fetcher calling: ${url}`);
   let res;
   try {
-    res = await fetch(url, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(body),
+    // GET で呼び、CDN のキャッシュを使う (座標はサーバーがセルの中心の URL へリダイレクトする)
+    const params = new URLSearchParams({
+      latitude: String(body.latitude),
+      longitude: String(body.longitude),
     });
+    res = await fetch(`${url}?${params}`);
 
     console.log(`Fetcher response status: ${res.status} for ${url}`);
 
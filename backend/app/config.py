@@ -9,5 +9,13 @@ class Settings:
     SERPER_API_KEY = os.getenv("SERPER_API_KEY")
     DATABASE_URL = os.getenv("DATABASE_URL")
     GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+    # 接続先の上書き (benchmarks/harness のローカルの代替サーバーなど)。未設定なら本番の API
+    GOOGLE_MAPS_BASE_URL = os.getenv("GOOGLE_MAPS_BASE_URL")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+    SERPER_BASE_URL = os.getenv("SERPER_BASE_URL", "https://google.serper.dev")
+    # ログ (app/utils/structured_logging.py)。LOG_FORMAT は json か text
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_VERBOSE_SAMPLE_RATE = float(os.getenv("LOG_VERBOSE_SAMPLE_RATE", "0.01"))
 
 settings = Settings()
\ No newline at end of file
@@ -4,8 +4,16 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers.jongso_router import jongso_router
 from app.dependencies import jongso_repository
+from app.utils.llm_gateway import close_gateways
+from app.utils.executors import shutdown_executors
+from app.utils.structured_logging import configure_logging, shutdown_logging, RequestIdMiddleware
+from app.config import settings
+
+# ロギング設定 (書き込みは別スレッドで行い、リクエストごとの相関 ID を付ける)
+configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_VERBOSE_SAMPLE_RATE)
 
 app = FastAPI()
+app.add_middleware(RequestIdMiddleware)
 
 # ルーターを登録
 app.include_router(jongso_router)
@@ -27,3 +35,6 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     await jongso_repository.disconnect()
+    await close_gateways()
+    shutdown_executors()
+    shutdown_logging()
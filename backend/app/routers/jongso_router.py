@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Query
 from app.dependencies import jongso_service
 from app.models.schemas import Location, SearchResponse
+from app.utils.fast_json import FastJSONResponse
 
 jongso_router = APIRouter()
 
 @jongso_router.get("/search_by_keyword")
 async def search_by_keyword(keyword: str = Query(...)):
     results = await jongso_service.search_shops_by_keyword(keyword)
-    return {"results": results}
+    return FastJSONResponse({"results": results})
 
 @jongso_router.post("/search", response_model=SearchResponse)
 async def search_jongso(location: Location):
@@ -15,4 +16,5 @@ async def search_jongso(location: Location):
         latitude=location.latitude,
         longitude=location.longitude
     )
-    return {"results": results}
+    # 結果は _format_shop_data で SearchResponse の形に整形済みなので、検証し直さずに返す (response_model はドキュメント用)
+    return FastJSONResponse({"results": results})
@@ -3,6 +3,7 @@ import aiohttp
 from typing import List, Dict, Any
 from ..config import settings
 from .text_analyzer import TextAnalyzer
+from ..utils.executors import get_executor, GOOGLE_EXECUTOR, CPU_EXECUTOR
 import requests
 from bs4 import BeautifulSoup
 import asyncio
@@ -11,13 +12,15 @@ import logging
 
 class GoogleMapsService:
     def __init__(self):
-        self.client = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+        client_options = {"base_url": settings.GOOGLE_MAPS_BASE_URL.rstrip('/')} if settings.GOOGLE_MAPS_BASE_URL else {}
+        self.client = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY, **client_options)
         self.text_analyzer = TextAnalyzer()
+        # googlemaps の呼び出しと HTML の解析は、それぞれ専用のスレッドプールで行う (app/utils/executors.py)
+        self.google_executor = get_executor(GOOGLE_EXECUTOR)
+        self.cpu_executor = get_executor(CPU_EXECUTOR)
 
     async def search_nearby_places(self, latitude: float, longitude: float) -> Dict[str, Any]:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
+        return await self.google_executor.run(
             partial(
                 self.client.places_nearby,
                 location=(latitude, longitude),
@@ -29,9 +32,7 @@ class GoogleMapsService:
         )
 
     async def search_nearby_places_by_keyword(self, keyword: str) -> dict:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
+        return await self.google_executor.run(
             partial(
                 self.client.places,
                 query=f"{keyword} 麻雀",
@@ -40,9 +41,7 @@ class GoogleMapsService:
         )
 
     async def get_place_reviews(self, place_id: str) -> List[str]:
-        loop = asyncio.get_event_loop()
-        details = await loop.run_in_executor(
-            None,
+        details = await self.google_executor.run(
             partial(
                 self.client.place,
                 place_id=place_id,
@@ -54,13 +53,11 @@ class GoogleMapsService:
 
     async def get_smoking_status(self, name: str, address: str) -> str:
         logger = logging.getLogger(__name__)
-        loop = asyncio.get_event_loop()
         all_texts = []
 
         try:
             # まずGoogle Mapsの口コミを取得
-            place_result = await loop.run_in_executor(
-                None,
+            place_result = await self.google_executor.run(
                 partial(
                     self.client.places,
                     query=f"{name} {address}",  # 「雀荘」を除去してより正確な検索に
@@ -121,7 +118,7 @@ class GoogleMapsService:
         return "情報なし"
 
     async def _search_google_places(self, query: str) -> List[str]:
-        url = "https://google.serper.dev/search"
+        url = f"{settings.SERPER_BASE_URL.rstrip('/')}/search"
         payload = {
             "q": query,
             "gl": "jp",
@@ -144,20 +141,26 @@ class GoogleMapsService:
             async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
                 if response.status == 200:
                     text = await response.text()
-                    soup = BeautifulSoup(text, 'html.parser')
-
-                    # 喫煙関連の情報を含む要素を優先的に抽出
-                    smoking_related_elements = []
-                    for element in soup.find_all(['p', 'div', 'span', 'td']):
-                        text = element.get_text(strip=True)
-                        if any(keyword in text for keyword in ['禁煙', '喫煙', 'タバコ', '煙草']):
-                            smoking_related_elements.append(text)
-
-                    # 喫煙関連の情報が見つからない場合は、最初の1000文字のみを使用
-                    if smoking_related_elements:
-                        return "\n".join(smoking_related_elements[:10])  # 最大10個の関連要素に制限
-                    return soup.get_text(separator="\n", strip=True)[:1000]  # 最初の1000文字に制限
+                    # HTML の解析は CPU を使うため、イベントループではなく cpu のプールで行う
+                    return await self.cpu_executor.run(_extract_smoking_text, text)
                 return ""
         except Exception as e:
             print(f"クロールエラー: {url}, {e}")
-            return ""
\ No newline at end of file
+            return ""
+
+
+def _extract_smoking_text(html: str) -> str:
+    """ページの HTML から喫煙に関するテキストを取り出す"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # 喫煙関連の情報を含む要素を優先的に抽出
+    smoking_related_elements = []
+    for element in soup.find_all(['p', 'div', 'span', 'td']):
+        text = element.get_text(strip=True)
+        if any(keyword in text for keyword in ['禁煙', '喫煙', 'タバコ', '煙草']):
+            smoking_related_elements.append(text)
+
+    # 喫煙関連の情報が見つからない場合は、最初の1000文字のみを使用
+    if smoking_related_elements:
+        return "\n".join(smoking_related_elements[:10])  # 最大10個の関連要素に制限
+    return soup.get_text(separator="\n", strip=True)[:1000]  # 最初の1000文字に制限
@@ -4,6 +4,7 @@ from ..models.schemas import JongsoShop
 from .google_maps_service import GoogleMapsService
 from .sentiment_service import SentimentService
 from ..repositories.jongso_repository import JongsoRepository
+from ..utils.ranking import rank_results
 from uuid import uuid4
 
 class JongsoService:
@@ -156,17 +157,5 @@ class JongsoService:
         }
 
     def _sort_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        return sorted(
-            results,
-            key=lambda x: (-self._calculate_adjusted_rating(x), -x["user_ratings_total"])
-        )
-
-    def _calculate_adjusted_rating(self, place: Dict[str, Any]) -> float:
-        base_rating = place["rating"]
-        if base_rating is None:
-            return 0.0
-
-        positive_score = place.get("positive_score")
-        if positive_score is not None:
-            return base_rating + (positive_score / 100)
-        return base_rating
\ No newline at end of file
+        # 評価 + ポジティブ度/100 → レビュー数の順
+        return rank_results(results, "adjusted_rating")
@@ -2,6 +2,27 @@ from typing import List, Dict, Any
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from ..config import settings
+from ..utils.llm_gateway import get_gateway
+
+def parse_analysis(content: str) -> Dict[str, Any]:
+    """「要約: / ポジティブ度: / ネガティブ度:」形式の応答を行ごとに読み取る"""
+    summary = ""
+    positive_score = None
+    negative_score = None
+
+    for line in content.splitlines():
+        if "要約" in line:
+            summary = line.split("要約:")[-1].strip()
+        if "ポジティブ度" in line:
+            positive_score = int(line.split("ポジティブ度:")[-1].replace("%", "").strip())
+        if "ネガティブ度" in line:
+            negative_score = int(line.split("ネガティブ度:")[-1].replace("%", "").strip())
+
+    return {
+        "summary": summary,
+        "positive_score": positive_score,
+        "negative_score": negative_score
+    }
 
 class SentimentService:
     def __init__(self):
@@ -9,6 +30,9 @@ class SentimentService:
             openai_api_key=settings.OPENAI_API_KEY,
             temperature=0,
             model=settings.CHAT_MODEL,
+            # TextAnalyzer と同じ接続プールを使う
+            http_async_client=get_gateway(settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL).http_client,
+            base_url=settings.OPENAI_BASE_URL,
         )
         self.prompt = ChatPromptTemplate.from_template("""
 あなたは{genre}の専門家です。
@@ -38,24 +62,7 @@ class SentimentService:
                 self.prompt.format(genre="雀荘", combined_reviews=combined_reviews)
             )
 
-            lines = response.content.splitlines()
-            summary = ""
-            positive_score = None
-            negative_score = None
-
-            for line in lines:
-                if "要約" in line:
-                    summary = line.split("要約:")[-1].strip()
-                if "ポジティブ度" in line:
-                    positive_score = int(line.split("ポジティブ度:")[-1].replace("%", "").strip())
-                if "ネガティブ度" in line:
-                    negative_score = int(line.split("ネガティブ度:")[-1].replace("%", "").strip())
-
-            return {
-                "summary": summary,
-                "positive_score": positive_score,
-                "negative_score": negative_score
-            }
+            return parse_analysis(response.content)
 
         except Exception as e:
             print(f"Sentiment analysis error: {e}")
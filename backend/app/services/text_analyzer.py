@@ -1,11 +1,10 @@
 from typing import List, Tuple
 import re
-import openai
 import logging
 from ..config import settings
+from ..utils.llm_gateway import get_gateway
 
-# ロガーの設定
-logging.basicConfig(level=logging.INFO)
+# ロガーの設定 (出力先・レベルはアプリ側の configure_logging で設定する)
 logger = logging.getLogger(__name__)
 
 class TextAnalyzer:
@@ -28,17 +27,18 @@ class TextAnalyzer:
             "禁煙徹底"
         ]
 
-        openai.api_key = settings.OPENAI_API_KEY
+        # openai>=1 では ChatCompletion.acreate が廃止されたため、共有の AsyncOpenAI クライアントを使う
+        self.gateway = get_gateway(settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
         self.model = settings.CHAT_MODEL or "gpt-3.5-turbo"  # デフォルトモデルを設定
-        logger.info(f"TextAnalyzer initialized with model: {self.model}")
+        logger.info("TextAnalyzer initialized with model: %s", self.model)
 
     async def analyze_smoking_info(self, text: str) -> str:
         try:
             logger.info("Starting smoking status analysis")
-            logger.info(f"Input text: {text[:200]}...")  # 最初の200文字のみ表示
+            logger.debug("Input text: %s...", text[:200])  # 最初の200文字のみ表示
 
             # GPTに喫煙状況の分析を依頼
-            response = await openai.ChatCompletion.acreate(
+            response = await self.gateway.chat(
                 model=self.model,
                 messages=[
                     {
@@ -68,14 +68,14 @@ class TextAnalyzer:
             )
 
             result = response.choices[0].message.content.strip()
-            logger.info(f"Analysis result: {result}")
+            logger.debug("Analysis result: %s", result)
 
             # 有効な回答のみを受け付ける
             valid_responses = ["禁煙", "喫煙可", "分煙", "情報なし"]
             final_result = result if result in valid_responses else "情報なし"
-            logger.info(f"Final result: {final_result}")
+            logger.info("Final result: %s", final_result)
             return final_result
 
         except Exception as e:
-            logger.error(f"禁煙判定エラー: {str(e)}")
+            logger.error("禁煙判定エラー: %s", str(e))
             return "情報なし"
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+検索結果のランキング (ルートの services/ranking.py と同じ定義を backend 用に置いたもの)。
+
+各ランキングは「比較キーの要素」のリストで定義する。要素はスコアラー名と重みの辞書で、
+店舗ごとに重み付き和を計算してタプルにまとめ、タプルの降順で並べる。
+キーはスコアラーごとに列としてまとめて1回だけ計算し、件数上限 (limit) がある場合はヒープで上位だけを選ぶ。
+"""
+import heapq
+import math
+from typing import Any, Callable
+
+# 店舗リストとランキング条件から、店舗ごとのスコア (大きいほど上位) のリストを返す関数
+Scorer = Callable[[list, "RankingContext"], list]
+
+_NUMERIC_TYPES = (float, int)
+
+
+class RankingContext:
+    """リクエストごとのランキング条件"""
+    __slots__ = ("smoking_preference",)
+
+    def __init__(self, smoking_preference: str | None = None):
+        self.smoking_preference = smoking_preference
+
+
+def _to_float(value: Any, default: float) -> float:
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _column(shops: list, field: str, default: float) -> list:
+    """フィールドを数値の列として取り出す。数値以外の値だけ変換する"""
+    return [
+        value if isinstance(value := shop.get(field), _NUMERIC_TYPES) else _to_float(value, default)
+        for shop in shops
+    ]
+
+
+def _rating(shops: list, context: RankingContext) -> list:
+    # 評価の無い店舗は 0 として扱う (Google の評価は 1〜5 なので最下位になる)
+    return _column(shops, "rating", 0.0)
+
+
+def _review_volume(shops: list, context: RankingContext) -> list:
+    # 件数差の影響を抑えるため対数を取る (順序は件数そのものと同じ)
+    log1p = math.log1p
+    return [log1p(value) if value > 0 else 0.0 for value in _column(shops, "user_ratings_total", 0.0)]
+
+
+def _sentiment(shops: list, context: RankingContext) -> list:
+    # positive_score は 0〜100
+    return [value / 100 for value in _column(shops, "positive_score", 0.0)]
+
+
+def _adjusted_rating(shops: list, context: RankingContext) -> list:
+    # 評価 + ポジティブ度/100。評価の無い店舗はポジティブ度によらず 0 にする
+    return [
+        0.0 if shop.get("rating") is None else rating + sentiment
+        for shop, rating, sentiment in zip(shops, _rating(shops, context), _sentiment(shops, context))
+    ]
+
+
+def _distance(shops: list, context: RankingContext) -> list:
+    return [-value for value in _column(shops, "distanceKm", math.inf)]
+
+
+def _walk_time(shops: list, context: RankingContext) -> list:
+    return [-value for value in _column(shops, "walkMinutes", math.inf)]
+
+
+def _smoking(shops: list, context: RankingContext) -> list:
+    preference = context.smoking_preference
+    if not preference:
+        return [0.0] * len(shops)
+    return [1.0 if shop.get("smoking_status") == preference else 0.0 for shop in shops]
+
+
+SCORERS: dict[str, Scorer] = {
+    "rating": _rating,
+    "review_volume": _review_volume,
+    "sentiment": _sentiment,
+    "adjusted_rating": _adjusted_rating,
+    "distance": _distance,
+    "walk_time": _walk_time,
+    "smoking": _smoking,
+}
+
+RANKINGS: dict[str, list[dict[str, float]]] = {
+    # 評価のみ (services/location_service.py の従来の並び順)
+    "rating": [{"rating": 1.0}],
+    # 評価 → レビュー数 (api/services.py の従来の並び順)
+    "rating_reviews": [{"rating": 1.0}, {"review_volume": 1.0}],
+    # 評価 + ポジティブ度/100 → レビュー数 (backend の従来の並び順)
+    "adjusted_rating": [{"adjusted_rating": 1.0}, {"review_volume": 1.0}],
+    "distance": [{"distance": 1.0}, {"rating": 1.0}],
+    "walk_time": [{"walk_time": 1.0}, {"rating": 1.0}],
+    "balanced": [{"rating": 1.0, "review_volume": 0.3, "sentiment": 1.0, "distance": 0.5}],
+}
+
+DEFAULT_RANKING = "rating"
+
+
+def register_ranking(name: str, components: list[dict[str, float]]) -> None:
+    """ランキングを追加・上書きする"""
+    for component in components:
+        for scorer_name in component:
+            if scorer_name not in SCORERS:
+                raise ValueError(f"未知のスコアラーです: {scorer_name}")
+    RANKINGS[name] = components
+
+
+def compute_keys(
+    results: list[dict],
+    ranking: str = DEFAULT_RANKING,
+    smoking_preference: str | None = None,
+) -> list:
+    """
+    店舗ごとの比較キーを一括で計算する。
+    スコアラーは列単位で1回ずつ評価し、比較キーの要素が1つならタプルを作らない。
+    """
+    components = RANKINGS.get(ranking)
+    if components is None:
+        raise ValueError(f"未知のランキングです: {ranking} (利用可能: {', '.join(sorted(RANKINGS))})")
+    if smoking_preference:
+        components = [{"smoking": 1.0}] + components
+
+    context = RankingContext(smoking_preference)
+    columns = {}
+    key_columns = []
+    for component in components:
+        weighted = []
+        for name, weight in component.items():
+            if name not in columns:
+                columns[name] = SCORERS[name](results, context)
+            weighted.append((columns[name], weight))
+
+        values, weight = weighted[0]
+        combined = values if weight == 1.0 else [weight * value for value in values]
+        for values, weight in weighted[1:]:
+            combined = [total + weight * value for total, value in zip(combined, values)]
+        key_columns.append(combined)
+
+    if len(key_columns) == 1:
+        return key_columns[0]
+    return list(zip(*key_columns))
+
+
+def rank_results(
+    results: list[dict],
+    ranking: str = DEFAULT_RANKING,
+    limit: int | None = None,
+    smoking_preference: str | None = None,
+) -> list[dict]:
+    """
+    検索結果をランキング順に並べる。limit 指定時は上位 limit 件だけをヒープで選ぶ。
+    同じキーの店舗は元の順序を保つ。
+    """
+    if limit is not None and limit <= 0:
+        return []
+    keys = compute_keys(results, ranking, smoking_preference)
+    if limit is None or limit >= len(results):
+        order = sorted(range(len(results)), key=keys.__getitem__, reverse=True)
+    else:
+        order = heapq.nlargest(limit, range(len(results)), key=keys.__getitem__)
+    return [results[i] for i in order]
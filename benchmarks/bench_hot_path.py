@@ -0,0 +1,368 @@
+"""
+店舗1件ごとに通る CPU 側の処理のマイクロベンチマーク。
+
+- place_details: LocationService._process_place_details の辞書組み立て (DB情報が新しくレビュー取得をしない経路)
+- rank_results / backend_sort_results: 検索結果の並べ替え (LocationService / backend の _sort_results)
+- parse_analysis: backend の analyze_reviews の応答を行ごとに読み取る処理
+- build_upsert_records: _save_results_to_db の last_fetched_at の fromisoformat と upsert レコードの組み立て
+- format_shop_data: backend の JongsoService._format_shop_data
+- result_dicts / shop_records: 検索結果1件を15キーの dict で組み立てる従来の形と ShopRecord の比較
+
+それぞれ 20 / 1,000 / 100,000 件で計測する。GC を止めて複数回実行した中央値と最小値、
+結果を保持したまま増えたメモリブロック数 (割り当て数の目安)、tracemalloc のピークを表示し、
+保存済みのベースラインから閾値を超えて遅く/大きくなった項目があれば終了コード 1 を返す。
+
+    python benchmarks/bench_hot_path.py [--sizes 20,1000,100000] [--only place_details,rank_results]
+        [--threshold 0.2] [--baseline benchmarks/baselines/hot_path.json] [--save-baseline]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.resolve()
+sys.path.append(str(project_root))
+sys.path.append(str(project_root / "backend"))
+
+DEFAULT_SIZES = (20, 1_000, 100_000)
+DEFAULT_BASELINE = project_root / "benchmarks" / "baselines" / "hot_path.json"
+DEFAULT_THRESHOLD = 0.20 # 中央値・ピークメモリがこの割合を超えて増えたら悪化とみなす
+TARGET_SECONDS = 0.5 # 1項目あたりの計測時間の目安 (繰り返し回数の決定に使う)
+MIN_REPEAT = 5
+MAX_REPEAT = 200
+
+STATUSES = ["禁煙", "分煙", "喫煙可", "不明"]
+
+
+def make_places(count: int, seed: int = 42) -> list[dict]:
+    """Google Places の検索結果の形をした店舗"""
+    rng = random.Random(seed)
+    return [
+        {
+            "place_id": f"place_{i}",
+            "name": f"雀荘{i}",
+            "vicinity": f"東京都千代田区{i % 100}-{i % 7}",
+            "geometry": {"location": {"lat": 35.68 + rng.uniform(-0.05, 0.05), "lng": 139.76 + rng.uniform(-0.05, 0.05)}},
+            "rating": round(rng.uniform(2.5, 5.0), 1),
+            "user_ratings_total": rng.randint(0, 2000),
+        }
+        for i in range(count)
+    ]
+
+
+def make_db_rows(count: int, seed: int = 42, with_timezone: bool = True) -> dict[str, dict]:
+    """_get_jongso_batch_from_db の結果の形をした DB 情報 (全件が最近取得済み)"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    rows = {}
+    for i in range(count):
+        fetched_at = now - timedelta(days=rng.randint(0, 60), seconds=rng.randint(0, 86400))
+        rows[f"place_{i}"] = {
+            "place_id": f"place_{i}",
+            "smoking_status": rng.choice(STATUSES),
+            "last_fetched_at": (fetched_at if with_timezone else fetched_at.replace(tzinfo=None)).isoformat(),
+            "positive_score": rng.randint(0, 100),
+            "negative_score": rng.randint(0, 100),
+            "summary": "接客が丁寧で清潔感のあるお店です。",
+        }
+    return rows
+
+
+def make_results(count: int, seed: int = 42) -> list[dict]:
+    """_process_place_details が返す形の検索結果"""
+    rng = random.Random(seed)
+    return [
+        {
+            "id": f"place_{i}",
+            "place_id": f"place_{i}",
+            "name": f"雀荘{i}",
+            "address": f"東京都千代田区{i % 100}-{i % 7}",
+            "lat": 35.68 + rng.uniform(-0.05, 0.05),
+            "lng": 139.76 + rng.uniform(-0.05, 0.05),
+            "rating": round(rng.uniform(2.5, 5.0), 1) if rng.random() > 0.05 else None,
+            "user_ratings_total": rng.randint(0, 2000),
+            "smoking_status": rng.choice(STATUSES),
+            "positive_score": rng.randint(0, 100),
+            "negative_score": rng.randint(0, 100),
+            "summary": "接客が丁寧で清潔感のあるお店です。",
+            "last_fetched_at": None,
+            "distanceKm": rng.uniform(0.05, 5.0),
+            "walkMinutes": rng.randint(1, 60),
+        }
+        for i in range(count)
+    ]
+
+
+def make_records(count: int, seed: int = 42) -> list:
+    """make_results と同じ内容の ShopRecord"""
+    from services.shop_record import ShopRecord
+
+    return [
+        ShopRecord(
+            place_id=result["place_id"], name=result["name"], address=result["address"],
+            lat=result["lat"], lng=result["lng"], rating=result["rating"],
+            user_ratings_total=result["user_ratings_total"], smoking_status=result["smoking_status"],
+            positive_score=result["positive_score"], negative_score=result["negative_score"],
+            summary=result["summary"], distance_km=result["distanceKm"], walk_minutes=result["walkMinutes"],
+        )
+        for result in make_results(count, seed)
+    ]
+
+
+def make_analysis_responses(count: int, seed: int = 42) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        f"要約: 接客が丁寧で清潔感のあるお店です。{i}\nポジティブ度: {rng.randint(0, 100)}%\nネガティブ度: {rng.randint(0, 100)}%"
+        for i in range(count)
+    ]
+
+
+def make_backend_rows(count: int, seed: int = 42) -> list[dict]:
+    """backend の jongso_shops の行 (数値カラムは Numeric なので Decimal)"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": f"place_{i}",
+            "name": f"雀荘{i}",
+            "address": f"東京都千代田区{i % 100}-{i % 7}",
+            "lat": Decimal(f"{35.68 + rng.uniform(-0.05, 0.05):.6f}"),
+            "lng": Decimal(f"{139.76 + rng.uniform(-0.05, 0.05):.6f}"),
+            "rating": Decimal(f"{rng.uniform(2.5, 5.0):.1f}") if rng.random() > 0.05 else None,
+            "user_ratings_total": rng.randint(0, 2000),
+            "summary": "接客が丁寧で清潔感のあるお店です。",
+            "positive_score": rng.randint(0, 100),
+            "negative_score": rng.randint(0, 100),
+            "smoking_status": rng.choice(STATUSES),
+            "last_fetched_at": now,
+        }
+        for i in range(count)
+    ]
+
+
+# --- 計測対象 ---
+# 各関数は size を受け取り、(計測する関数, その引数) を返す。入力の生成は計測に含めない
+
+def bench_place_details(size: int):
+    from services.location_service import LocationService
+
+    service = LocationService(None, None, None)
+    places = make_places(size)
+    prefetched = make_db_rows(size)
+    loop = asyncio.new_event_loop()
+
+    async def process_all(places):
+        return [await service._process_place_details(place, 1.2, 15, prefetched=prefetched) for place in places]
+
+    return lambda places: loop.run_until_complete(process_all(places)), places
+
+
+def bench_rank_results(size: int):
+    from services.ranking import rank_results, DEFAULT_RANKING
+
+    return lambda results: rank_results(results, DEFAULT_RANKING), make_results(size)
+
+
+def bench_backend_sort_results(size: int):
+    from app.services.jongso_service import JongsoService
+
+    service = JongsoService(google_maps_service=None, sentiment_service=None, jongso_repository=None)
+    return service._sort_results, make_results(size)
+
+
+def bench_parse_analysis(size: int):
+    from app.services.sentiment_service import parse_analysis
+
+    return lambda contents: [parse_analysis(content) for content in contents], make_analysis_responses(size)
+
+
+def bench_build_upsert_records(size: int):
+    from services.location_service import LocationService
+
+    service = LocationService(None, None, None)
+    results = make_records(size)
+    existing = {place_id: row["last_fetched_at"] for place_id, row in make_db_rows(size).items()}
+    return lambda results: service._build_upsert_records(results, existing), results
+
+
+def bench_format_shop_data(size: int):
+    from app.services.jongso_service import JongsoService
+
+    service = JongsoService(google_maps_service=None, sentiment_service=None, jongso_repository=None)
+    return lambda rows: [service._format_shop_data(row) for row in rows], make_backend_rows(size)
+
+
+def bench_result_dicts(size: int):
+    """ShopRecord 導入前の _process_place_details が組み立てていた dict (比較用)"""
+    def build(places):
+        return [
+            {
+                "id": place["place_id"],
+                "name": place.get('name'),
+                "address": place.get('formatted_address') or place.get('vicinity'),
+                "lat": place.get('geometry', {}).get('location', {}).get('lat'),
+                "lng": place.get('geometry', {}).get('location', {}).get('lng'),
+                "rating": place.get('rating'),
+                "user_ratings_total": place.get('user_ratings_total'),
+                "smoking_status": "禁煙",
+                "positive_score": 80,
+                "negative_score": 20,
+                "summary": "接客が丁寧で清潔感のあるお店です。",
+                "last_fetched_at": None,
+                "distanceKm": 1.2,
+                "walkMinutes": 15,
+                "place_id": place["place_id"],
+            }
+            for place in places
+        ]
+    return build, make_places(size)
+
+
+def bench_shop_records(size: int):
+    from services.shop_record import ShopRecord
+
+    def build(places):
+        return [
+            ShopRecord.from_place(
+                place, smoking_status="禁煙", positive_score=80, negative_score=20,
+                summary="接客が丁寧で清潔感のあるお店です。", distance_km=1.2, walk_minutes=15,
+            )
+            for place in places
+        ]
+    return build, make_places(size)
+
+
+BENCHMARKS = {
+    "place_details": bench_place_details,
+    "rank_results": bench_rank_results,
+    "backend_sort_results": bench_backend_sort_results,
+    "parse_analysis": bench_parse_analysis,
+    "build_upsert_records": bench_build_upsert_records,
+    "format_shop_data": bench_format_shop_data,
+    "result_dicts": bench_result_dicts,
+    "shop_records": bench_shop_records,
+}
+
+
+def measure(func, data, size: int) -> dict:
+    """GC を止めて繰り返し実行し、時間とメモリの統計を返す"""
+    func(data) # ウォームアップ
+    started = time.perf_counter()
+    func(data)
+    once = time.perf_counter() - started
+    repeat = max(MIN_REPEAT, min(MAX_REPEAT, int(TARGET_SECONDS / max(once, 1e-6))))
+
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func(data)
+            timings.append(time.perf_counter() - started)
+
+        # 結果を保持したまま増えたブロック数 = 結果を作るために残った割り当ての数
+        blocks_before = sys.getallocatedblocks()
+        result = func(data)
+        allocated_blocks = sys.getallocatedblocks() - blocks_before
+        del result
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        func(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        "size": size,
+        "repeat": repeat,
+        "median_ms": round(median * 1000, 4),
+        "min_ms": round(min(timings) * 1000, 4),
+        "per_item_us": round(median * 1e6 / size, 4),
+        "allocated_blocks": allocated_blocks,
+        "blocks_per_item": round(allocated_blocks / size, 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """中央値 (最小値も悪化している場合のみ) とピークメモリの悪化を列挙する"""
+    regressions = []
+    for key, stats in current.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if (stats["median_ms"] > previous["median_ms"] * (1 + threshold)
+                and stats["min_ms"] > previous["min_ms"] * (1 + threshold)):
+            regressions.append(f"{key}: median {previous['median_ms']}ms -> {stats['median_ms']}ms")
+        if stats["peak_kib"] > previous["peak_kib"] * (1 + threshold) and stats["peak_kib"] - previous["peak_kib"] > 16:
+            regressions.append(f"{key}: peak {previous['peak_kib']}KiB -> {stats['peak_kib']}KiB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--only", help=f"計測する項目 (カンマ区切り): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存する")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知の項目です: {', '.join(unknown)}")
+
+    results = {}
+    print(f"{'benchmark':<22}{'size':>8}{'median ms':>12}{'min ms':>12}{'us/item':>10}{'blocks/item':>13}{'peak KiB':>11}")
+    for name in names:
+        for size in sizes:
+            try:
+                func, data = BENCHMARKS[name](size)
+            except ImportError as e:
+                print(f"{name:<22}{size:>8}  skipped ({e})")
+                continue
+            stats = measure(func, data, size)
+            results[f"{name}@{size}"] = stats
+            print(f"{name:<22}{size:>8}{stats['median_ms']:>12.3f}{stats['min_ms']:>12.3f}{stats['per_item_us']:>10.2f}"
+                  f"{stats['blocks_per_item']:>13.2f}{stats['peak_kib']:>11.1f}")
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    if args.save_baseline:
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("ベースラインはありません (--save-baseline で保存できます)。")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"ベースラインより {args.threshold:.0%} を超えて悪化しています:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("ベースラインからの悪化はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+ランキングのベンチマーク。
+
+従来の3種類の _sort_results (全件 sorted) と services/ranking.py の rank_results を
+10,000件の候補で比較する。
+
+    python benchmarks/bench_ranking.py [--candidates 10000] [--limit 20] [--repeat 20]
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.resolve()
+sys.path.append(str(project_root))
+
+from services.ranking import rank_results  # noqa: E402
+
+
+def make_candidates(count: int, seed: int = 42) -> list[dict]:
+    """ランダムな店舗候補を作る (一部の値は None や文字列にする)"""
+    rng = random.Random(seed)
+    statuses = ["禁煙", "分煙", "喫煙可", "不明"]
+    candidates = []
+    for i in range(count):
+        rating = round(rng.uniform(2.5, 5.0), 1) if rng.random() > 0.05 else None
+        candidates.append({
+            "id": f"place_{i}",
+            "name": f"雀荘{i}",
+            "rating": str(rating) if rating is not None and rng.random() < 0.1 else rating,
+            "user_ratings_total": rng.randint(0, 2000) if rng.random() > 0.05 else None,
+            "positive_score": rng.randint(0, 100) if rng.random() > 0.2 else None,
+            "distanceKm": rng.uniform(0.05, 5.0),
+            "walkMinutes": rng.randint(1, 60),
+            "smoking_status": rng.choice(statuses),
+        })
+    return candidates
+
+
+# --- 従来実装 (比較用) ---
+def legacy_location_service(results):
+    return sorted(results, key=lambda x: x.get('rating', -1) if x.get('rating') is not None else -1, reverse=True)
+
+
+def legacy_api_services(results):
+    return sorted(results, key=lambda x: (-float(x.get("rating", 0) or 0), -int(x.get("user_ratings_total", 0) or 0)))
+
+
+def legacy_backend(results):
+    def adjusted(place):
+        base_rating = place["rating"]
+        if base_rating is None:
+            return 0.0
+        positive_score = place.get("positive_score")
+        if positive_score is not None:
+            return float(base_rating) + (positive_score / 100)
+        return float(base_rating)
+    return sorted(results, key=lambda x: (-adjusted(x), -(x["user_ratings_total"] or 0)))
+
+
+def bench(label: str, func, repeat: int) -> None:
+    timings = timeit.repeat(func, number=1, repeat=repeat)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(f"{label:<45} median={median * 1000:8.3f} ms  min={timings[0] * 1000:8.3f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    candidates = make_candidates(args.candidates)
+    print(f"candidates={args.candidates}, limit={args.limit}, repeat={args.repeat}")
+
+    # 文字列の rating を含むと従来の location_service 版は比較できないため数値化したものを使う
+    numeric = [dict(c, rating=float(c["rating"]) if c["rating"] is not None else None) for c in candidates]
+    bench("legacy services/location_service (full sort)", lambda: legacy_location_service(numeric)[:args.limit], args.repeat)
+    bench("rank_results rating (top-k)", lambda: rank_results(numeric, "rating", limit=args.limit), args.repeat)
+
+    bench("legacy api/services (full sort)", lambda: legacy_api_services(candidates)[:args.limit], args.repeat)
+    bench("rank_results rating_reviews (top-k)", lambda: rank_results(candidates, "rating_reviews", limit=args.limit), args.repeat)
+
+    bench("legacy backend (full sort)", lambda: legacy_backend(candidates)[:args.limit], args.repeat)
+    bench("rank_results adjusted_rating (top-k)", lambda: rank_results(candidates, "adjusted_rating", limit=args.limit), args.repeat)
+
+    bench("rank_results balanced (top-k)", lambda: rank_results(candidates, "balanced", limit=args.limit), args.repeat)
+    bench("rank_results distance + smoking (top-k)",
+          lambda: rank_results(candidates, "distance", limit=args.limit, smoking_preference="禁煙"), args.repeat)
+    bench("rank_results rating_reviews (full sort)", lambda: rank_results(candidates, "rating_reviews"), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
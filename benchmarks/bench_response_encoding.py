@@ -0,0 +1,81 @@
+"""
+検索レスポンスの JSON 化のベンチマーク。
+
+20件・500件の店舗について、次の経路を比較する。
+- FastAPI の既定 (jsonable_encoder + JSONResponse)
+- backend の response_model=SearchResponse (Pydantic で検証してから JSON 化)
+- services/fast_json.py の FastJSONResponse (orjson、検証なし)
+- キャッシュ済みの SerializedPayload (JSON 化済みのバイト列をそのまま返す)
+
+    python benchmarks/bench_response_encoding.py [--sizes 20,500] [--repeat 200]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.resolve()
+sys.path.append(str(project_root))
+sys.path.append(str(project_root / "backend"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from bench_hot_path import make_backend_rows, make_results  # noqa: E402
+from services.fast_json import FastJSONResponse, SerializedPayload, orjson  # noqa: E402
+
+
+def bench(label: str, func, repeat: int) -> float:
+    timings = timeit.repeat(func, number=1, repeat=repeat)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(f"{label:<45} median={median * 1000:8.3f} ms  min={timings[0] * 1000:8.3f} ms")
+    return median
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="20,500")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    from app.models.schemas import SearchResponse
+    from app.services.jongso_service import JongsoService
+
+    backend = JongsoService(google_maps_service=None, sentiment_service=None, jongso_repository=None)
+    print(f"encoder={'orjson' if orjson is not None else 'json (orjson 未インストール)'}, repeat={args.repeat}")
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        print(f"\n--- {size} shops ---")
+        content = {"results": make_results(size), "degraded": False}
+        backend_content = {"results": [backend._format_shop_data(row) for row in make_backend_rows(size)]}
+
+        def default_path():
+            return JSONResponse(jsonable_encoder(content)).body
+
+        def response_model_path():
+            validated = SearchResponse.model_validate(backend_content).model_dump(mode="json")
+            return JSONResponse(jsonable_encoder(validated)).body
+
+        def fast_path():
+            return FastJSONResponse(content).body
+
+        def fast_backend_path():
+            return FastJSONResponse(backend_content).body
+
+        payload = SerializedPayload(content)
+        payload.body
+
+        def cached_path():
+            return FastJSONResponse(payload).body
+
+        baseline = bench("api: jsonable_encoder + JSONResponse", default_path, args.repeat)
+        fast = bench("api: FastJSONResponse", fast_path, args.repeat)
+        cached = bench("api: cached SerializedPayload", cached_path, args.repeat)
+        backend_baseline = bench("backend: response_model=SearchResponse", response_model_path, args.repeat)
+        backend_fast = bench("backend: FastJSONResponse", fast_backend_path, args.repeat)
+        print(f"speedup: api x{baseline / fast:.1f} (cached x{baseline / cached:.0f}), backend x{backend_baseline / backend_fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+上流 API (Google Maps / OpenAI / Supabase) の記録・再生ハーネス。
+
+ローカルの代替サーバーがカセットに記録した応答 (無ければ合成応答) を返し、
+遅延の分布と障害注入を設定できる。fixtures.py でアプリをこのサーバーに向けて組み立てる。
+共有キャッシュの Redis の代わりには redis_server.py の FakeRedisServer を使う (REDIS_URL に url を設定する)。
+"""
+from .cassette import Cassette
+from .fixtures import make_api_app, make_backend_app, start_fake_upstreams
+from .postgrest import InMemoryPostgrest
+from .profiles import ErrorProfile, LatencyProfile
+from .redis_server import FakeRedisServer
+from .servers import FakeUpstreams, FakeUpstreamServer
+
+__all__ = [
+    "Cassette",
+    "ErrorProfile",
+    "FakeRedisServer",
+    "FakeUpstreamServer",
+    "FakeUpstreams",
+    "InMemoryPostgrest",
+    "LatencyProfile",
+    "make_api_app",
+    "make_backend_app",
+    "start_fake_upstreams",
+]
@@ -0,0 +1,91 @@
+"""
+上流 API とのやり取りを記録したカセット。
+
+1件のやり取りは次の形の JSON で保存する (API キーなどの秘匿情報は保存しない)。
+
+    {"service": "google", "method": "GET", "path": "/maps/api/place/details/json",
+     "query": {"place_id": "...", "language": "ja"}, "body": null,
+     "status": 200, "response": {...}, "latency_ms": 183.2}
+
+再生時は service・メソッド・パス・クエリ (秘匿パラメータを除く)・リクエスト本文が一致するものを返す。
+同じリクエストが複数記録されている場合は記録順に循環して返す。
+"""
+import json
+import threading
+from pathlib import Path
+
+# 照合・保存の対象から外すクエリパラメータ
+SECRET_PARAMS = ("key", "apikey", "client", "signature", "sessiontoken")
+
+
+def normalize_query(query: dict) -> dict:
+    return {name: value for name, value in sorted(query.items()) if name not in SECRET_PARAMS}
+
+
+def request_key(service: str, method: str, path: str, query: dict, body) -> str:
+    return json.dumps(
+        [service, method.upper(), path, normalize_query(query), body],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+
+
+class Cassette:
+    """記録済みのやり取りの集合"""
+
+    def __init__(self, interactions: list[dict] | None = None, path: str | Path | None = None):
+        self.path = Path(path) if path else None
+        self.interactions: list[dict] = []
+        self._index: dict[str, list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        for interaction in interactions or []:
+            self._add(interaction)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "Cassette":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("interactions", []), path=path)
+
+    def save(self, path: str | Path | None = None) -> None:
+        target = Path(path or self.path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "w", encoding="utf-8") as f:
+            json.dump({"interactions": self.interactions}, f, ensure_ascii=False, indent=1)
+
+    def _add(self, interaction: dict) -> None:
+        key = request_key(interaction["service"], interaction["method"], interaction["path"],
+                          interaction.get("query") or {}, interaction.get("body"))
+        self.interactions.append(interaction)
+        self._index.setdefault(key, []).append(interaction)
+
+    def record(self, service: str, method: str, path: str, query: dict, body, status: int, response,
+               latency_ms: float) -> None:
+        with self._lock:
+            self._add({
+                "service": service,
+                "method": method.upper(),
+                "path": path,
+                "query": normalize_query(query),
+                "body": body,
+                "status": status,
+                "response": response,
+                "latency_ms": round(latency_ms, 1),
+            })
+
+    def match(self, service: str, method: str, path: str, query: dict, body) -> dict | None:
+        key = request_key(service, method, path, query, body)
+        with self._lock:
+            candidates = self._index.get(key)
+            if not candidates:
+                return None
+            cursor = self._cursor.get(key, 0)
+            self._cursor[key] = cursor + 1
+            return candidates[cursor % len(candidates)]
+
+    def latencies_ms(self, service: str | None = None) -> list[float]:
+        """記録されたレイテンシ (LatencyProfile.empirical の入力に使う)"""
+        return [
+            interaction["latency_ms"] for interaction in self.interactions
+            if interaction.get("latency_ms") is not None and (service is None or interaction["service"] == service)
+        ]
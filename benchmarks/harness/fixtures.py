@@ -0,0 +1,105 @@
+"""
+代替サーバーに向けたアプリ (api/index.py・backend/app/main.py) を組み立てるフィクスチャ。
+
+設定は import 時に環境変数から読まれるため、環境変数を差し替えてから
+関連モジュールを sys.modules から外して import し直す。
+
+    with start_fake_upstreams(latency=LatencyProfile.lognormal(150, 1200, seed=1)) as upstreams:
+        app = make_api_app(upstreams)
+        with TestClient(app) as client:
+            client.post("/api/search", json={"latitude": 35.68, "longitude": 139.76})
+        print(upstreams.call_counts())
+
+pytest がある環境では fake_upstreams・api_app・backend_app をフィクスチャとしても使える
+(conftest.py で `from benchmarks.harness.fixtures import *` する)。
+"""
+import importlib
+import os
+import sys
+from pathlib import Path
+
+from .cassette import Cassette
+from .postgrest import InMemoryPostgrest
+from .servers import FakeUpstreams
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+BACKEND_ROOT = REPO_ROOT / "backend"
+
+# 再 import するモジュール (接頭辞)
+_API_MODULES = ("config", "api", "services")
+_BACKEND_MODULES = ("app",)
+
+
+def start_fake_upstreams(cassette: Cassette | str | Path | None = None, latency=None, errors=None,
+                         database: InMemoryPostgrest | None = None) -> FakeUpstreams:
+    """代替サーバーを起動する (cassette にはファイルパスも渡せる)"""
+    if isinstance(cassette, (str, Path)):
+        cassette = Cassette.load(cassette)
+    return FakeUpstreams(cassette=cassette, latency=latency, errors=errors, database=database).start()
+
+
+def _purge_modules(prefixes: tuple[str, ...]) -> None:
+    for name in list(sys.modules):
+        if any(name == prefix or name.startswith(f"{prefix}.") for prefix in prefixes):
+            del sys.modules[name]
+
+
+def make_api_app(upstreams: FakeUpstreams, **environment):
+    """代替サーバーを向いた api/index.py の FastAPI アプリを返す (environment で設定を追加・上書きできる)"""
+    os.environ.update(upstreams.environment())
+    os.environ.update({name: str(value) for name, value in environment.items()})
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    _purge_modules(_API_MODULES)
+    return importlib.import_module("api.index").app
+
+
+def make_backend_app(upstreams: FakeUpstreams, database_path: str | Path, **environment):
+    """
+    代替サーバーを向いた backend/app/main.py の FastAPI アプリを返す。
+    DB は database_path の SQLite を使い、テーブルが無ければ作る。
+    """
+    os.environ.update(upstreams.environment())
+    os.environ["DATABASE_URL"] = f"sqlite:///{Path(database_path).resolve()}"
+    # backend の設定には既定のモデルが無いため、未設定なら記録・再生で使うモデルを入れる
+    os.environ.setdefault("CHAT_MODEL", "gpt-4o-mini")
+    os.environ.update({name: str(value) for name, value in environment.items()})
+    if str(BACKEND_ROOT) not in sys.path:
+        sys.path.insert(0, str(BACKEND_ROOT))
+    _purge_modules(_BACKEND_MODULES)
+    main = importlib.import_module("app.main")
+
+    from sqlalchemy import create_engine
+
+    repository = importlib.import_module("app.dependencies").jongso_repository
+    engine = create_engine(os.environ["DATABASE_URL"])
+    try:
+        repository.metadata.create_all(engine)
+    finally:
+        engine.dispose()
+    return main.app
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+
+    @pytest.fixture
+    def fake_upstreams():
+        upstreams = start_fake_upstreams()
+        try:
+            yield upstreams
+        finally:
+            upstreams.stop()
+
+    @pytest.fixture
+    def api_app(fake_upstreams, tmp_path):
+        # ディスク上のキャッシュは既定で /tmp に残るため、テストごとに分ける
+        return make_api_app(fake_upstreams, CACHE_DISK_PATH=tmp_path / "cache.sqlite3")
+
+    @pytest.fixture
+    def backend_app(fake_upstreams, tmp_path):
+        return make_backend_app(fake_upstreams, tmp_path / "jongso.sqlite3")
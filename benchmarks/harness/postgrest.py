@@ -0,0 +1,173 @@
+"""
+PostgREST のメモリ上の代替実装。
+
+services/data_access.py が使う範囲 (select の eq/in/gte/lte/gt/lt/ilike/or フィルタ・order・limit・offset、
+upsert、PATCH) だけを扱う。未実装の RPC には 404 を返すため、呼び出し側はアプリ側の代替処理に切り替わる。
+"""
+import fnmatch
+import re
+import threading
+
+# on_conflict 未指定時に使う主キー
+PRIMARY_KEYS = {
+    "jongso_shops": ("place_id",),
+    "jongso_reviews": ("place_id", "review_hash"),
+    "stations": ("name",),
+}
+
+_IN_VALUE = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,]+)')
+
+
+def _parse_in(values: str) -> list[str]:
+    inner = values[1:-1] if values.startswith("(") and values.endswith(")") else values
+    values = []
+    for match in _IN_VALUE.finditer(inner):
+        quoted = match.group(1)
+        values.append(quoted.replace('\\"', '"').replace('\\\\', '\\') if quoted is not None else match.group(2).strip())
+    return values
+
+
+def _coerce(value: str, sample):
+    """フィルタの文字列値を行の値の型に合わせる"""
+    if isinstance(sample, bool):
+        return value == "true"
+    if isinstance(sample, (int, float)):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _compare(row_value, operator: str, raw: str) -> bool:
+    if operator == "is":
+        return row_value is None if raw == "null" else False
+    if row_value is None:
+        return False
+    if operator == "in":
+        return any(row_value == _coerce(value, row_value) for value in _parse_in(raw))
+    if operator in ("ilike", "like"):
+        pattern = raw.replace("%", "*")
+        text = str(row_value)
+        return fnmatch.fnmatchcase(text.lower(), pattern.lower()) if operator == "ilike" else fnmatch.fnmatchcase(text, pattern)
+    value = _coerce(raw, row_value)
+    try:
+        return {
+            "eq": row_value == value, "neq": row_value != value,
+            "gt": row_value > value, "gte": row_value >= value,
+            "lt": row_value < value, "lte": row_value <= value,
+        }[operator]
+    except (KeyError, TypeError):
+        return False
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    if column == "or":
+        # or=(name.ilike.*x*,address.ilike.*x*)
+        terms = expression[1:-1].split(",")
+        for term in terms:
+            term_column, operator, raw = term.split(".", 2)
+            if _compare(row.get(term_column), operator, raw):
+                return True
+        return False
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    operator, _, raw = expression.partition(".")
+    result = _compare(row.get(column), operator, raw)
+    return not result if negate else result
+
+
+class InMemoryPostgrest:
+    """テーブル名 -> 主キー -> 行 を保持する"""
+
+    def __init__(self, tables: dict[str, list[dict]] | None = None):
+        self._lock = threading.Lock()
+        self.tables: dict[str, dict[tuple, dict]] = {}
+        for table, rows in (tables or {}).items():
+            self.seed(table, rows)
+
+    def seed(self, table: str, rows: list[dict], on_conflict: str | None = None) -> None:
+        self._upsert(table, rows, on_conflict, ignore_duplicates=False)
+
+    def rows(self, table: str) -> list[dict]:
+        with self._lock:
+            return [dict(row) for row in self.tables.get(table, {}).values()]
+
+    def _key(self, table: str, row: dict, on_conflict: str | None) -> tuple:
+        columns = tuple(on_conflict.split(",")) if on_conflict else PRIMARY_KEYS.get(table, ("id",))
+        return tuple(row.get(column) for column in columns)
+
+    def _upsert(self, table: str, rows: list[dict], on_conflict: str | None, ignore_duplicates: bool) -> None:
+        with self._lock:
+            stored = self.tables.setdefault(table, {})
+            for row in rows:
+                key = self._key(table, row, on_conflict)
+                if key in stored:
+                    if not ignore_duplicates:
+                        stored[key].update(row)
+                else:
+                    stored[key] = dict(row)
+
+    def handle(self, method: str, path: str, params: list[tuple[str, str]], body, prefer: str = "") -> tuple[int, object]:
+        """REST リクエストを処理し、(ステータス, JSON 応答) を返す"""
+        name = path.rsplit("/rest/v1/", 1)[-1].strip("/")
+        if name.startswith("rpc/"):
+            return 404, {"code": "PGRST202", "message": f"Could not find the function {name[4:]}"}
+
+        if method == "GET":
+            return 200, self._select(name, params)
+        if method == "POST":
+            options = dict(params)
+            rows = body if isinstance(body, list) else [body]
+            self._upsert(name, rows, options.get("on_conflict"), "ignore-duplicates" in prefer)
+            return 201, None
+        if method == "PATCH":
+            filters = [(column, expression) for column, expression in params]
+            with self._lock:
+                for row in self.tables.get(name, {}).values():
+                    if all(_matches(row, column, expression) for column, expression in filters):
+                        row.update(body)
+            return 204, None
+        return 405, {"message": f"Method {method} not supported"}
+
+    def _select(self, table: str, params: list[tuple[str, str]]) -> list[dict]:
+        columns = None
+        order = None
+        limit = None
+        offset = 0
+        filters = []
+        for name, value in params:
+            if name == "select":
+                columns = None if value == "*" else [column.strip() for column in value.split(",")]
+            elif name == "order":
+                order = value
+            elif name == "limit":
+                limit = int(value)
+            elif name == "offset":
+                offset = int(value)
+            else:
+                filters.append((name, value))
+
+        with self._lock:
+            rows = [
+                dict(row) for row in self.tables.get(table, {}).values()
+                if all(_matches(row, column, expression) for column, expression in filters)
+            ]
+
+        if order:
+            # 後ろの条件から順に安定ソートを重ねる
+            for term in reversed(order.split(",")):
+                parts = term.split(".")
+                column = parts[0]
+                descending = "desc" in parts[1:]
+                nulls_last = "nullslast" in parts[1:] or ("nullsfirst" not in parts[1:] and not descending)
+                present = [row for row in rows if row.get(column) is not None]
+                missing = [row for row in rows if row.get(column) is None]
+                present.sort(key=lambda row: row[column], reverse=descending)
+                rows = present + missing if nulls_last else missing + present
+
+        rows = rows[offset:offset + limit if limit is not None else None]
+        if columns is not None:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return rows
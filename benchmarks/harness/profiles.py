@@ -0,0 +1,90 @@
+"""
+代替サーバーの応答遅延と障害注入の設定。
+"""
+import math
+import random
+import threading
+
+
+class LatencyProfile:
+    """応答までの遅延 (秒) の分布"""
+
+    def __init__(self, kind: str = "constant", seed: int | None = None, **params):
+        if kind not in ("none", "constant", "uniform", "lognormal", "empirical"):
+            raise ValueError(f"未知の遅延分布です: {kind}")
+        self.kind = kind
+        self.params = params
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def none(cls) -> "LatencyProfile":
+        return cls("none")
+
+    @classmethod
+    def constant(cls, ms: float) -> "LatencyProfile":
+        return cls("constant", ms=ms)
+
+    @classmethod
+    def uniform(cls, low_ms: float, high_ms: float, seed: int | None = None) -> "LatencyProfile":
+        return cls("uniform", seed=seed, low_ms=low_ms, high_ms=high_ms)
+
+    @classmethod
+    def lognormal(cls, median_ms: float, p99_ms: float, seed: int | None = None) -> "LatencyProfile":
+        """中央値と p99 から対数正規分布を決める (テールの長い外部 API の近似)"""
+        sigma = math.log(max(p99_ms, median_ms) / median_ms) / 2.326 if median_ms > 0 else 0.0
+        return cls("lognormal", seed=seed, mu=math.log(max(median_ms, 1e-3)), sigma=sigma)
+
+    @classmethod
+    def empirical(cls, samples_ms: list[float], seed: int | None = None) -> "LatencyProfile":
+        """記録済みのレイテンシから無作為に選ぶ"""
+        if not samples_ms:
+            raise ValueError("サンプルが空です。")
+        return cls("empirical", seed=seed, samples_ms=list(samples_ms))
+
+    def sample(self, recorded_ms: float | None = None) -> float:
+        """遅延を秒で返す。recorded_ms (カセットに記録された値) があり分布が none なら記録値を使う"""
+        with self._lock:
+            if self.kind == "none":
+                ms = recorded_ms or 0.0
+            elif self.kind == "constant":
+                ms = self.params["ms"]
+            elif self.kind == "uniform":
+                ms = self._random.uniform(self.params["low_ms"], self.params["high_ms"])
+            elif self.kind == "lognormal":
+                ms = self._random.lognormvariate(self.params["mu"], self.params["sigma"])
+            else:
+                ms = self._random.choice(self.params["samples_ms"])
+        return ms / 1000
+
+
+class ErrorProfile:
+    """
+    障害注入の設定。
+    rate の割合で statuses のいずれかを返し、timeout_rate の割合で timeout_seconds 待ってから応答し、
+    drop_rate の割合で応答せずに接続を切る (HTTP/2 の ConnectionTerminated 相当)。
+    """
+
+    def __init__(self, rate: float = 0.0, statuses: tuple = (500, 503), timeout_rate: float = 0.0,
+                 timeout_seconds: float = 30.0, drop_rate: float = 0.0, seed: int | None = None):
+        self.rate = rate
+        self.statuses = statuses
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def choose(self) -> tuple[str, int | None]:
+        """('ok' | 'status' | 'timeout' | 'drop', ステータス) を返す"""
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.drop_rate:
+                return "drop", None
+            roll -= self.drop_rate
+            if roll < self.timeout_rate:
+                return "timeout", None
+            roll -= self.timeout_rate
+            if roll < self.rate:
+                return "status", self._random.choice(self.statuses)
+        return "ok", None
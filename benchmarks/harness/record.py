@@ -0,0 +1,69 @@
+"""
+実際の Google Maps / OpenAI に対して検索を実行し、やり取りをカセットに記録する。
+
+GOOGLE_MAPS_API_KEY・OPENAI_API_KEY (・SERPER_API_KEY) に本物のキーを設定して実行する。
+Supabase はメモリ上の PostgREST を使うため記録しない。API キーはカセットに保存しない。
+
+    python -m benchmarks.harness.record --output benchmarks/cassettes/tokyo.json \
+        --location 35.6812,139.7671 --keyword 新宿 [--backend]
+"""
+import argparse
+import logging
+import sys
+import tempfile
+from pathlib import Path
+
+from .cassette import Cassette
+from .fixtures import make_api_app, make_backend_app
+from .servers import FakeUpstreams
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_location(value: str) -> tuple[float, float]:
+    latitude, longitude = (float(part) for part in value.split(","))
+    return latitude, longitude
+
+
+def record(output: Path, locations: list[tuple[float, float]], keywords: list[str], backend: bool = False) -> Cassette:
+    from fastapi.testclient import TestClient
+
+    cassette = Cassette(path=output)
+    with FakeUpstreams(cassette=cassette, record=True) as upstreams, tempfile.TemporaryDirectory() as workdir:
+        if backend:
+            app = make_backend_app(upstreams, Path(workdir) / "jongso.sqlite3")
+            search_path, keyword_path = "/search", "/search_by_keyword"
+        else:
+            app = make_api_app(upstreams)
+            search_path, keyword_path = "/api/search", "/api/search_by_keyword"
+
+        with TestClient(app) as client:
+            for latitude, longitude in locations:
+                response = client.post(search_path, json={"latitude": latitude, "longitude": longitude})
+                logger.info("%s (%s, %s) -> %s", search_path, latitude, longitude, response.status_code)
+            for keyword in keywords:
+                response = client.get(keyword_path, params={"keyword": keyword})
+                logger.info("%s %s -> %s", keyword_path, keyword, response.status_code)
+
+    cassette.save()
+    logger.info("%s件のやり取りを %s に保存しました。", len(cassette.interactions), output)
+    return cassette
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="上流 API とのやり取りをカセットに記録する")
+    parser.add_argument("--output", type=Path, required=True, help="カセットの保存先 (JSON)")
+    parser.add_argument("--location", type=_parse_location, action="append", default=[], help="緯度,経度 (複数指定可)")
+    parser.add_argument("--keyword", action="append", default=[], help="キーワード検索の語 (複数指定可)")
+    parser.add_argument("--backend", action="store_true", help="backend/app/main.py のアプリで記録する")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.location and not args.keyword:
+        parser.error("--location か --keyword を1つ以上指定してください。")
+    record(args.output, args.location, args.keyword, backend=args.backend)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Redis プロトコル (RESP2) を話す最小限の代替サーバー。
+
+services/shared_cache.py の後段 (RedisTier) を、本物の Redis なしで試すためのもの。
+RedisTier が使うコマンド (GET / SET [NX|XX] [EX|PX] / DEL / EXISTS) と、接続時・計測用のコマンドだけを扱う。
+
+    with FakeRedisServer() as server:
+        os.environ["REDIS_URL"] = server.url
+"""
+import socketserver
+import threading
+import time
+from collections import Counter
+
+
+class _RespError(Exception):
+    pass
+
+
+def _read_command(rfile) -> list[bytes] | None:
+    """クライアントからの1コマンド (バルク文字列の配列) を読む"""
+    line = rfile.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # インラインコマンド (redis-cli の PING など)
+        return line.strip().split()
+    count = int(line[1:])
+    args = []
+    for _ in range(count):
+        header = rfile.readline()
+        if not header.startswith(b"$"):
+            raise _RespError("Protocol error: expected bulk string")
+        length = int(header[1:])
+        args.append(rfile.read(length + 2)[:-2])
+    return args
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, _RespError):
+        return b"-ERR " + str(value).encode() + b"\r\n"
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":" + str(value).encode() + b"\r\n"
+    return b"$" + str(len(value)).encode() + b"\r\n" + value + b"\r\n"
+
+
+class FakeRedisServer:
+    """127.0.0.1 の空きポートで動く Redis 互換サーバー (データはメモリ上)"""
+
+    def __init__(self):
+        self._data: dict[bytes, tuple[bytes, float | None]] = {}
+        self._lock = threading.Lock()
+        self.commands = Counter()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        args = _read_command(self.rfile)
+                    except (_RespError, ValueError) as e:
+                        self.wfile.write(_encode(_RespError(str(e))))
+                        return
+                    if args is None:
+                        return
+                    self.wfile.write(_encode(server.execute(args)))
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeRedisServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _live(self, key: bytes) -> bytes | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def execute(self, args: list[bytes]):
+        command = args[0].decode().upper()
+        self.commands[command] += 1
+        with self._lock:
+            if command == "PING":
+                return "PONG"
+            if command in ("CLIENT", "SELECT"):
+                return "OK"
+            if command == "GET":
+                return self._live(args[1])
+            if command == "SET":
+                return self._set(args[1], args[2], [arg.decode().upper() for arg in args[3:]], args[3:])
+            if command == "DEL":
+                return sum(1 for key in args[1:] if self._live(key) is not None and self._data.pop(key))
+            if command == "EXISTS":
+                return sum(1 for key in args[1:] if self._live(key) is not None)
+            if command in ("FLUSHDB", "FLUSHALL"):
+                self._data.clear()
+                return "OK"
+            if command == "DBSIZE":
+                return sum(1 for key in list(self._data) if self._live(key) is not None)
+        return _RespError(f"unknown command '{command}'")
+
+    def _set(self, key: bytes, value: bytes, options: list[str], raw_options: list[bytes]):
+        expires_at = None
+        if "EX" in options:
+            expires_at = time.monotonic() + int(raw_options[options.index("EX") + 1])
+        elif "PX" in options:
+            expires_at = time.monotonic() + int(raw_options[options.index("PX") + 1]) / 1000
+        exists = self._live(key) is not None
+        if ("NX" in options and exists) or ("XX" in options and not exists):
+            return None
+        self._data[key] = (value, expires_at)
+        return "OK"
+
+    def keys(self) -> list[bytes]:
+        with self._lock:
+            return [key for key in list(self._data) if self._live(key) is not None]
@@ -0,0 +1,317 @@
+"""
+Google / OpenAI / Supabase (PostgREST) の代替 HTTP サーバー。
+
+各サーバーは 127.0.0.1 の空きポートで別スレッドとして動き、アプリには
+GOOGLE_MAPS_BASE_URL・OPENAI_BASE_URL・SUPABASE_URL などの環境変数で向け先を差し替えて使う。
+
+- replay モード: カセットに一致するやり取りがあればそれを返し、無ければ合成応答を返す
+- record モード: 実際の API に転送し、応答とレイテンシをカセットに記録する
+"""
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from . import synthetic
+from .cassette import Cassette
+from .postgrest import InMemoryPostgrest
+from .profiles import ErrorProfile, LatencyProfile
+
+logger = logging.getLogger(__name__)
+
+GOOGLE = "google"
+OPENAI = "openai"
+SUPABASE = "supabase"
+
+# record モードの転送先
+REAL_BASE_URLS = {
+    GOOGLE: "https://maps.googleapis.com",
+    OPENAI: "https://api.openai.com",
+    "serper": "https://google.serper.dev",
+}
+
+# 記録時に転送するリクエストヘッダー
+_FORWARD_HEADERS = ("Authorization", "Content-Type", "X-API-KEY", "apikey", "Prefer", "OpenAI-Organization")
+
+
+class FakeUpstreamServer:
+    """1つの上流サービスの代替サーバー"""
+
+    def __init__(self, service: str, cassette: Cassette | None = None, latency: LatencyProfile | None = None,
+                 errors: ErrorProfile | None = None, record: bool = False, database: InMemoryPostgrest | None = None,
+                 forward_urls: dict[str, str] | None = None):
+        if service not in (GOOGLE, OPENAI, SUPABASE):
+            raise ValueError(f"未知のサービスです: {service}")
+        if record and service == SUPABASE:
+            raise ValueError("Supabase はメモリ上の PostgREST を使うため記録できません。")
+        self.service = service
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.latency = latency or LatencyProfile.none()
+        self.errors = errors or ErrorProfile()
+        self.record = record
+        self.forward_urls = {**REAL_BASE_URLS, **(forward_urls or {})}
+        self.database = database if database is not None else InMemoryPostgrest()
+        self._calls = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeUpstreamServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{self.service}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def call_counts(self) -> dict[str, int]:
+        """'METHOD パス' ごとの呼び出し回数"""
+        with self._lock:
+            return dict(self._calls)
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self._calls.clear()
+
+    def _count(self, method: str, path: str) -> None:
+        with self._lock:
+            self._calls[f"{method} {path}"] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug("%s: %s", server.service, format % args)
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle(self)
+
+            def do_PATCH(self):
+                server._handle(self)
+
+        return Handler
+
+    def _handle(self, handler: BaseHTTPRequestHandler) -> None:
+        method = handler.command
+        split = urlsplit(handler.path)
+        path = split.path
+        params = parse_qsl(split.query, keep_blank_values=True)
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw_body = handler.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw_body) if raw_body else None
+        except ValueError:
+            body = None
+        self._count(method, path)
+
+        outcome, status = self.errors.choose()
+        if outcome == "drop":
+            # 応答を返さずに接続を切る
+            handler.close_connection = True
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        if outcome == "timeout":
+            time.sleep(self.errors.timeout_seconds)
+        if outcome == "status":
+            time.sleep(self.latency.sample())
+            self._send_json(handler, status, {"error": {"message": "injected failure", "code": status}})
+            return
+
+        started = time.monotonic()
+        if self.service == SUPABASE:
+            status, response = self.database.handle(method, path, params, body, handler.headers.get("Prefer", ""))
+            time.sleep(self.latency.sample())
+            self._send_json(handler, status, response)
+            return
+
+        query = dict(params)
+        if self.record:
+            status, response = self._forward(handler, method, split, raw_body)
+            self.cassette.record(self.service, method, path, query, body, status, response,
+                                 (time.monotonic() - started) * 1000)
+        else:
+            interaction = self.cassette.match(self.service, method, path, query, body)
+            if interaction is not None:
+                status, response = interaction["status"], interaction["response"]
+                recorded_ms = interaction.get("latency_ms")
+            else:
+                status, response = self._synthesize(method, path, query, body)
+                recorded_ms = None
+            time.sleep(self.latency.sample(recorded_ms))
+
+        if self.service == OPENAI and isinstance(body, dict) and body.get("stream") and status == 200:
+            self._send_stream(handler, response)
+        else:
+            self._send_json(handler, status, response)
+
+    def _synthesize(self, method: str, path: str, query: dict, body) -> tuple[int, object]:
+        if self.service == OPENAI:
+            return synthetic.openai_response(path, body or {})
+        if path.rstrip("/") == "/search":
+            return synthetic.serper_response(path, body or {})
+        return synthetic.google_response(path, query)
+
+    def _forward(self, handler: BaseHTTPRequestHandler, method: str, split, raw_body: bytes) -> tuple[int, object]:
+        """実際の API に転送する (ストリーミング要求も通常の応答として記録する)"""
+        target = "serper" if self.service == GOOGLE and split.path.rstrip("/") == "/search" else self.service
+        url = f"{self.forward_urls[target]}{split.path}"
+        if split.query:
+            url = f"{url}?{split.query}"
+        if raw_body and self.service == OPENAI:
+            payload = json.loads(raw_body)
+            if payload.pop("stream", None):
+                raw_body = json.dumps(payload).encode()
+        headers = {name: handler.headers[name] for name in _FORWARD_HEADERS if handler.headers.get(name)}
+        request = urllib.request.Request(url, data=raw_body or None, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b"null")
+            except ValueError:
+                return e.code, None
+
+    @staticmethod
+    def _send_json(handler: BaseHTTPRequestHandler, status: int, payload) -> None:
+        data = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode()
+        handler.send_response(status)
+        if data:
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        if data:
+            handler.wfile.write(data)
+
+    @staticmethod
+    def _send_stream(handler: BaseHTTPRequestHandler, response: dict) -> None:
+        """Server-Sent Events で chat.completion.chunk を送る"""
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        for chunk in synthetic.openai_stream_chunks(response):
+            handler.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            handler.wfile.flush()
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+
+class FakeUpstreams:
+    """
+    Google・OpenAI・Supabase の代替サーバーをまとめて起動する。
+
+        with FakeUpstreams(latency={"google": LatencyProfile.lognormal(120, 900)}) as upstreams:
+            os.environ.update(upstreams.environment())
+            ...
+    latency / errors はサービス名をキーにした dict か、全サービス共通の1つの設定を受け取る。
+    forward_urls は record モードの転送先をサービス名ごとに差し替える (既定は REAL_BASE_URLS)。
+    """
+
+    def __init__(self, cassette: Cassette | None = None, latency=None, errors=None, record: bool = False,
+                 database: InMemoryPostgrest | None = None, forward_urls: dict[str, str] | None = None):
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.database = database if database is not None else InMemoryPostgrest()
+        self.record = record
+        self.servers = {
+            service: FakeUpstreamServer(
+                service,
+                cassette=self.cassette,
+                latency=self._option(latency, service),
+                errors=self._option(errors, service),
+                record=record and service != SUPABASE,
+                database=self.database,
+                forward_urls=forward_urls,
+            )
+            for service in (GOOGLE, OPENAI, SUPABASE)
+        }
+
+    @staticmethod
+    def _option(option, service: str):
+        return option.get(service) if isinstance(option, dict) else option
+
+    @property
+    def google_url(self) -> str:
+        return self.servers[GOOGLE].url
+
+    @property
+    def openai_url(self) -> str:
+        return f"{self.servers[OPENAI].url}/v1"
+
+    @property
+    def supabase_url(self) -> str:
+        return self.servers[SUPABASE].url
+
+    def environment(self) -> dict[str, str]:
+        """
+        アプリを代替サーバーに向けるための環境変数。
+        API キーは形式だけ合わせたダミーにする (record モードでは実際のキーが必要なので上書きしない)。
+        """
+        environment = {
+            "GOOGLE_MAPS_BASE_URL": self.google_url,
+            "SERPER_BASE_URL": self.google_url,
+            "OPENAI_BASE_URL": self.openai_url,
+            "SUPABASE_URL": self.supabase_url,
+            "SUPABASE_KEY": "fake-supabase-key",
+        }
+        if not self.record:
+            environment.update({
+                "GOOGLE_MAPS_API_KEY": "AIzaFAKE-harness-key-000000000000000",
+                "SERPER_API_KEY": "fake-serper-key",
+                "OPENAI_API_KEY": "sk-fake-harness",
+            })
+        return environment
+
+    def call_counts(self) -> dict[str, dict[str, int]]:
+        return {service: server.call_counts() for service, server in self.servers.items()}
+
+    def total_calls(self, service: str | None = None) -> int:
+        return sum(
+            sum(server.call_counts().values())
+            for name, server in self.servers.items() if service is None or name == service
+        )
+
+    def reset_calls(self) -> None:
+        for server in self.servers.values():
+            server.reset_calls()
+
+    def start(self) -> "FakeUpstreams":
+        for server in self.servers.values():
+            server.start()
+        return self
+
+    def stop(self) -> None:
+        for server in self.servers.values():
+            server.stop()
+
+    def __enter__(self) -> "FakeUpstreams":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,210 @@
+"""
+カセットに無いリクエストに返す合成応答。
+
+店舗は経緯度 0.005 度のグリッドセルごとにハッシュから決定的に配置するため、
+同じ地点を何度検索しても、近い地点を検索しても、同じ店舗 (place_id) が返る。
+"""
+import hashlib
+import math
+import time
+
+GRID_DEGREES = 0.005 # 約500m
+MAX_SHOPS_PER_CELL = 3
+PLACES_PAGE_SIZE = 20
+
+# ジオコーディングで地名として扱うキーワード (それ以外は ZERO_RESULTS)
+GAZETTEER = {
+    "東京": (35.6812, 139.7671), "銀座": (35.6717, 139.7650), "新橋": (35.6663, 139.7583),
+    "有楽町": (35.6751, 139.7630), "品川": (35.6285, 139.7388), "五反田": (35.6261, 139.7236),
+    "渋谷": (35.6580, 139.7016), "新宿": (35.6896, 139.7006), "高田馬場": (35.7126, 139.7038),
+    "池袋": (35.7295, 139.7109), "上野": (35.7138, 139.7773), "秋葉原": (35.6984, 139.7731),
+    "神田": (35.6918, 139.7709), "蒲田": (35.5625, 139.7161), "吉祥寺": (35.7031, 139.5798),
+    "町田": (35.5423, 139.4456), "横浜": (35.4658, 139.6223), "川崎": (35.5313, 139.6968),
+    "大宮": (35.9064, 139.6239), "千葉": (35.6131, 140.1134), "梅田": (34.7025, 135.4959),
+    "難波": (34.6661, 135.5009), "名古屋": (35.1709, 136.8815), "札幌": (43.0687, 141.3508),
+    "博多": (33.5897, 130.4207), "仙台": (38.2601, 140.8822),
+}
+
+_REVIEW_TEMPLATES = [
+    "店員さんの接客が丁寧で、初心者でも安心して打てました。",
+    "全席禁煙なので服に匂いがつかず快適です。",
+    "喫煙室があり分煙されています。換気もしっかりしていました。",
+    "タバコ臭いのが気になりました。常連さんが多い雰囲気です。",
+    "卓が綺麗で清潔感があります。また行きたいです。",
+    "少し狭いですが、料金が安くて満足です。",
+    "マナーの悪いお客さんがいて残念でした。",
+    "駅から近くて便利。土日は混雑しています。",
+    "スタッフの対応が良く、居心地が良いお店です。",
+    "設備が古く、空調がうるさいのが気になりました。",
+]
+
+
+def _hash(*parts) -> int:
+    return int.from_bytes(hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).digest(), "big")
+
+
+def _unit(*parts) -> float:
+    return _hash(*parts) / 2 ** 64
+
+
+def _shops_in_cell(row: int, col: int) -> list[dict]:
+    count = _hash("count", row, col) % (MAX_SHOPS_PER_CELL + 1)
+    shops = []
+    for i in range(count):
+        lat = (row + _unit("lat", row, col, i)) * GRID_DEGREES
+        lng = (col + _unit("lng", row, col, i)) * GRID_DEGREES
+        place_id = f"fake_{row}_{col}_{i}"
+        shops.append({
+            "place_id": place_id,
+            "name": f"雀荘{_hash('name', place_id) % 1000:03d}",
+            "vicinity": f"合成区{row % 100}-{col % 100}-{i + 1}",
+            "formatted_address": f"日本、合成区{row % 100}-{col % 100}-{i + 1}",
+            "geometry": {"location": {"lat": round(lat, 7), "lng": round(lng, 7)}},
+            "rating": round(3.0 + 2.0 * _unit("rating", place_id), 1),
+            "user_ratings_total": int(5 + 400 * _unit("reviews", place_id) ** 2),
+            "types": ["establishment", "point_of_interest"],
+        })
+    return shops
+
+
+def _distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lng = math.radians(lng2 - lng1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lng / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+def shops_near(lat: float, lng: float, radius_m: float, limit: int = PLACES_PAGE_SIZE) -> list[dict]:
+    """半径内の合成店舗を近い順に返す"""
+    delta_lat = radius_m / 111320
+    delta_lng = delta_lat / max(math.cos(math.radians(lat)), 0.01)
+    shops = []
+    for row in range(math.floor((lat - delta_lat) / GRID_DEGREES), math.floor((lat + delta_lat) / GRID_DEGREES) + 1):
+        for col in range(math.floor((lng - delta_lng) / GRID_DEGREES), math.floor((lng + delta_lng) / GRID_DEGREES) + 1):
+            for shop in _shops_in_cell(row, col):
+                location = shop["geometry"]["location"]
+                distance = _distance_m(lat, lng, location["lat"], location["lng"])
+                if distance <= radius_m:
+                    shops.append((distance, shop))
+    shops.sort(key=lambda item: item[0])
+    return [shop for _, shop in shops[:limit]]
+
+
+def shop_by_id(place_id: str) -> dict | None:
+    try:
+        _, row, col, index = place_id.split("_")
+        return _shops_in_cell(int(row), int(col))[int(index)]
+    except (ValueError, IndexError):
+        return None
+
+
+def _ok(payload: dict) -> dict:
+    return {**payload, "status": "OK" if payload.get("results") or payload.get("result") else "ZERO_RESULTS"}
+
+
+def google_response(path: str, query: dict) -> tuple[int, dict]:
+    """Places / Geocoding API の合成応答"""
+    if path.endswith("/geocode/json"):
+        address = query.get("address", "").strip()
+        location = GAZETTEER.get(address)
+        if location is None:
+            return 200, {"results": [], "status": "ZERO_RESULTS"}
+        return 200, _ok({"results": [{
+            "formatted_address": f"日本、{address}",
+            "geometry": {"location": {"lat": location[0], "lng": location[1]}},
+            "place_id": f"geocode_{address}",
+        }]})
+
+    if path.endswith("/place/nearbysearch/json"):
+        lat, lng = (float(value) for value in query.get("location", "0,0").split(","))
+        radius = float(query.get("radius", 3000))
+        return 200, _ok({"results": shops_near(lat, lng, radius)})
+
+    if path.endswith("/place/textsearch/json"):
+        text = query.get("query", "")
+        location = next((coords for name, coords in GAZETTEER.items() if name in text), None)
+        if location is None:
+            # 地名を含まないクエリは、クエリから決まる地点の周辺を返す
+            location = (35.5 + _unit("q-lat", text) * 0.4, 139.5 + _unit("q-lng", text) * 0.4)
+        return 200, _ok({"results": shops_near(location[0], location[1], 1500)})
+
+    if path.endswith("/place/details/json"):
+        shop = shop_by_id(query.get("place_id", ""))
+        if shop is None:
+            return 200, {"status": "NOT_FOUND"}
+        review_count = 1 + _hash("review_count", shop["place_id"]) % 5
+        now = int(time.time())
+        reviews = [
+            {
+                "author_name": f"ユーザー{_hash('author', shop['place_id'], i) % 10000}",
+                "time": now - 86400 * (i * 17 + _hash("age", shop["place_id"], i) % 60),
+                "rating": 1 + _hash("review_rating", shop["place_id"], i) % 5,
+                "text": _REVIEW_TEMPLATES[_hash("text", shop["place_id"], i) % len(_REVIEW_TEMPLATES)],
+            }
+            for i in range(review_count)
+        ]
+        return 200, _ok({"result": {**shop, "reviews": reviews}})
+
+    return 404, {"status": "INVALID_REQUEST", "error_message": f"Unknown path {path}"}
+
+
+def _chat_content(messages: list[dict]) -> str:
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    user = " ".join(m.get("content", "") for m in messages if m.get("role") != "system")
+    if "出力フォーマット" in user:
+        positive = 40 + _hash("pos", user) % 50
+        return f"要約: 接客が丁寧で清潔感のあるお店です。\nポジティブ度: {positive}\nネガティブ度: {100 - positive}"
+    if "0から10" in system or "0から10" in user:
+        return str(3 + _hash("score", user) % 7)
+    if "喫煙" in system:
+        for status in ("分煙", "禁煙", "喫煙可"):
+            # 指示文に並ぶ区分名を拾わないよう、最後の「レビュー」以降だけを見る
+            if status in user.rsplit("レビュー", 1)[-1]:
+                return status
+        return "不明" if "不明" in system else "情報なし"
+    return "接客が丁寧で居心地が良い一方、混雑時は少し狭く感じるとの声があります。"
+
+
+def openai_response(path: str, body: dict) -> tuple[int, dict]:
+    """Chat Completions API の合成応答 (logprobs 要求時は確信度の高いトークン列を付ける)"""
+    if not path.endswith("/chat/completions"):
+        return 404, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}}
+    messages = body.get("messages", [])
+    content = _chat_content(messages)
+    prompt_tokens = sum(len(m.get("content", "")) for m in messages)
+    completion_tokens = max(1, len(content))
+    logprobs = None
+    if body.get("logprobs"):
+        logprobs = {"content": [{"token": content, "logprob": -0.01, "bytes": None, "top_logprobs": []}]}
+    return 200, {
+        "id": f"chatcmpl-fake{_hash('id', content, prompt_tokens) % 10 ** 8}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "logprobs": logprobs,
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def openai_stream_chunks(response: dict) -> list[dict]:
+    """stream=True の場合に送るチャンク (本文を数文字ずつに分ける)"""
+    content = response["choices"][0]["message"]["content"]
+    base = {key: response[key] for key in ("id", "created", "model")}
+    chunks = [
+        {**base, "object": "chat.completion.chunk",
+         "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}]}
+        for i in range(0, len(content), 8)
+    ]
+    chunks.append({**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    return chunks
+
+
+def serper_response(path: str, body: dict) -> tuple[int, dict]:
+    """Serper (Web検索) の合成応答。クロールを発生させないため検索結果は常に空"""
+    return 200, {"searchParameters": body, "organic": []}
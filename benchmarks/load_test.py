@@ -0,0 +1,304 @@
+"""
+検索エンドポイントの負荷試験。
+
+api/index.py (または backend/app/main.py) のアプリを benchmarks/harness の代替サーバーに向けて
+プロセス内 (ASGI) で起動し、主要駅の周辺に集中する座標とキーワードの検索を並行に送る。
+1プロセス = Vercel の関数1インスタンス / uvicorn のワーカー1つ分の上限を測る想定。
+
+スループット・p50/p95/p99 レイテンシ・1リクエストあたりの上流呼び出し数・メモリを表示し、
+保存済みのベースラインと比べて悪化していれば終了コード 1 を返す。
+
+    python benchmarks/load_test.py [--app api|backend] [--requests 300] [--concurrency 16]
+        [--keyword-ratio 0.3] [--cassette path.json] [--upstream-latency realistic|none]
+        [--baseline benchmarks/baselines/load_test.json] [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.resolve()
+sys.path.append(str(project_root))
+
+from benchmarks.harness import LatencyProfile, make_api_app, make_backend_app, start_fake_upstreams  # noqa: E402
+from benchmarks.harness.synthetic import GAZETTEER  # noqa: E402
+
+DEFAULT_BASELINE = project_root / "benchmarks" / "baselines" / "load_test.json"
+
+# 悪化とみなす変化率 (正の値は増加、負の値は減少で悪化)
+REGRESSION_THRESHOLDS = {
+    "throughput_rps": -0.15,
+    "latency_ms.p95": 0.25,
+    "latency_ms.p99": 0.30,
+    "upstream_calls_per_request.total": 0.10,
+    "memory_mb.rss_growth": 0.50,
+}
+
+# 上流の遅延 (中央値, p99) [ms]。実測に近い長いテールを持たせる
+REALISTIC_LATENCY = {
+    "google": (120, 900),
+    "openai": (600, 3000),
+    "supabase": (15, 80),
+}
+
+ENDPOINTS = {
+    "api": {"search": "/api/search", "keyword": "/api/search_by_keyword"},
+    "backend": {"search": "/search", "keyword": "/search_by_keyword"},
+}
+
+
+def make_workload(count: int, keyword_ratio: float = 0.3, seed: int = 42) -> list[tuple[str, dict]]:
+    """
+    検索リクエストの列を作る。
+    地点は GAZETTEER の並び順 (おおよその利用者の多さ) に従う Zipf 分布で選び、
+    周囲に標準偏差 約400m のばらつきを持たせる。キーワードは駅名・地名と、一部は地名を含まない語にする。
+    """
+    rng = random.Random(seed)
+    hubs = list(GAZETTEER.items())
+    weights = [1 / (rank + 1) for rank in range(len(hubs))]
+    workload = []
+    for _ in range(count):
+        name, (lat, lng) = rng.choices(hubs, weights=weights)[0]
+        if rng.random() < keyword_ratio:
+            roll = rng.random()
+            if roll < 0.5:
+                keyword = name
+            elif roll < 0.8:
+                keyword = f"{name}駅"
+            elif roll < 0.9:
+                keyword = f"雀荘 {name}"
+            else:
+                keyword = f"麻雀 {rng.randint(1, 50)}"
+            workload.append(("keyword", {"keyword": keyword}))
+        else:
+            jitter = 400 / 111320
+            workload.append(("search", {
+                "latitude": round(lat + rng.gauss(0, jitter), 5),
+                "longitude": round(lng + rng.gauss(0, jitter / math.cos(math.radians(lat))), 5),
+            }))
+    return workload
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """最近傍順位法のパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def rss_mb() -> float:
+    """現在の RSS (MB)。/proc が無い環境ではピーク値で代用する"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+async def _send(client, endpoints: dict, kind: str, payload: dict):
+    if kind == "search":
+        return await client.post(endpoints["search"], json=payload)
+    return await client.get(endpoints["keyword"], params=payload)
+
+
+async def drive(client, endpoints: dict, workload: list[tuple[str, dict]], concurrency: int) -> tuple[list[float], Counter, float]:
+    """workload を concurrency 並列で送り、(レイテンシ[ms]の一覧, ステータスごとの件数, 所要秒) を返す"""
+    queue = asyncio.Queue()
+    for item in workload:
+        queue.put_nowait(item)
+    latencies = []
+    statuses = Counter()
+
+    async def worker():
+        while True:
+            try:
+                kind, payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                response = await _send(client, endpoints, kind, payload)
+                statuses[response.status_code] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def _upstream_calls(upstreams) -> dict[str, int]:
+    return {service: sum(counts.values()) for service, counts in upstreams.call_counts().items()}
+
+
+async def run(app_name: str, requests: int, concurrency: int, keyword_ratio: float, warmup: int,
+              cassette: str | None, upstream_latency: str, trace_memory: bool, seed: int) -> dict:
+    import httpx
+
+    latency = None
+    if upstream_latency == "realistic":
+        latency = {
+            service: LatencyProfile.lognormal(median, p99, seed=seed + i)
+            for i, (service, (median, p99)) in enumerate(REALISTIC_LATENCY.items())
+        }
+
+    upstreams = start_fake_upstreams(cassette=cassette, latency=latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            if app_name == "backend":
+                app = make_backend_app(upstreams, Path(workdir) / "jongso.sqlite3")
+            else:
+                app = make_api_app(upstreams)
+
+            endpoints = ENDPOINTS[app_name]
+            transport = httpx.ASGITransport(app=app)
+            async with app.router.lifespan_context(app), httpx.AsyncClient(
+                transport=transport, base_url="http://loadtest", timeout=120
+            ) as client:
+                # ウォームアップ (接続プール・import・キャッシュ) は計測に含めない
+                if warmup:
+                    await drive(client, endpoints, make_workload(warmup, keyword_ratio, seed + 1), concurrency)
+
+                workload = make_workload(requests, keyword_ratio, seed)
+                calls_before = _upstream_calls(upstreams)
+                rss_start = rss_mb()
+                if trace_memory:
+                    tracemalloc.start()
+                latencies, statuses, elapsed = await drive(client, endpoints, workload, concurrency)
+                heap_peak = None
+                if trace_memory:
+                    heap_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                    tracemalloc.stop()
+                rss_end = rss_mb()
+                calls_after = _upstream_calls(upstreams)
+    finally:
+        upstreams.stop()
+
+    latencies.sort()
+    calls = {service: calls_after[service] - calls_before.get(service, 0) for service in calls_after}
+    calls["total"] = sum(calls.values())
+    errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+    memory = {"rss_start": round(rss_start, 1), "rss_end": round(rss_end, 1), "rss_growth": round(rss_end - rss_start, 1)}
+    if heap_peak is not None:
+        memory["heap_peak"] = round(heap_peak, 1)
+    return {
+        "scenario": f"{app_name}-c{concurrency}-k{keyword_ratio:g}-{upstream_latency}",
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(latencies[-1], 1) if latencies else 0.0,
+        },
+        "status": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "upstream_calls_per_request": {
+            service: round(count / max(1, len(latencies)), 2) for service, count in calls.items()
+        },
+        "memory_mb": memory,
+    }
+
+
+def _lookup(report: dict, dotted: str):
+    value = report
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(report: dict, baseline: dict) -> list[str]:
+    """ベースラインより悪化した指標を列挙する"""
+    regressions = []
+    for metric, threshold in REGRESSION_THRESHOLDS.items():
+        current, previous = _lookup(report, metric), _lookup(baseline, metric)
+        if current is None or previous is None:
+            continue
+        if metric == "memory_mb.rss_growth":
+            # 増分は小さいと比率が不安定なので、10MB 未満の差は無視する
+            if current - previous >= 10 and current > previous * (1 + threshold):
+                regressions.append(f"{metric}: {previous} -> {current}")
+            continue
+        if previous == 0:
+            continue
+        change = (current - previous) / previous
+        if (threshold < 0 and change < threshold) or (threshold > 0 and change > threshold):
+            regressions.append(f"{metric}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def print_report(report: dict, baseline: dict | None) -> None:
+    print(f"\n=== {report['scenario']} ===")
+    print(f"requests: {report['requests']}  concurrency: {report['concurrency']}  duration: {report['duration_s']}s")
+    print(f"throughput: {report['throughput_rps']} req/s  error rate: {report['error_rate']:.2%}  status: {report['status']}")
+    latency = report["latency_ms"]
+    print(f"latency ms: p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    print(f"upstream calls/request: {report['upstream_calls_per_request']}")
+    print(f"memory MB: {report['memory_mb']}")
+    if baseline:
+        print(f"baseline: {baseline['throughput_rps']} req/s, p95={baseline['latency_ms']['p95']}ms, "
+              f"upstream calls/request={baseline['upstream_calls_per_request'].get('total')}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--app", choices=sorted(ENDPOINTS), default="api")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--keyword-ratio", type=float, default=0.3)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--cassette", help="再生するカセット (省略時は合成応答)")
+    parser.add_argument("--upstream-latency", choices=("realistic", "none"), default="realistic")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc で Python ヒープのピークも測る (遅くなる)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存する")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(
+        args.app, args.requests, args.concurrency, args.keyword_ratio, args.warmup,
+        args.cassette, args.upstream_latency, args.trace_memory, args.seed,
+    ))
+
+    baselines = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    baseline = baselines.get(report["scenario"])
+    print_report(report, baseline)
+
+    if args.save_baseline:
+        baselines[report["scenario"]] = report
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baselines, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("このシナリオのベースラインはありません (--save-baseline で保存できます)。")
+        return 0
+    regressions = compare(report, baseline)
+    if regressions:
+        print("ベースラインより悪化しています:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("ベースラインからの悪化はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
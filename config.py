@@ -9,9 +9,88 @@ class Settings:
     # 環境変数から読み込む、なければ空文字
     GOOGLE_MAPS_API_KEY: str = os.getenv("GOOGLE_MAPS_API_KEY", "")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    # 接続先の上書き (benchmarks/harness のローカルの代替サーバーなど)。未設定なら本番の API
+    GOOGLE_MAPS_BASE_URL: str | None = os.getenv("GOOGLE_MAPS_BASE_URL")
+    OPENAI_BASE_URL: str | None = os.getenv("OPENAI_BASE_URL")
     # --- Supabase 関連の設定を追加 --- (デフォルトは None)
     SUPABASE_URL: str | None = os.getenv("SUPABASE_URL")
     SUPABASE_KEY: str | None = os.getenv("SUPABASE_KEY")
+    SUPABASE_TIMEOUT_SECONDS: float = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", "10"))
+    SUPABASE_MAX_CONNECTIONS: int = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+    # 冪等な読み取り・upsert を再試行する回数
+    SUPABASE_MAX_RETRIES: int = int(os.getenv("SUPABASE_MAX_RETRIES", "3"))
+    # ----------------------------------
+    # --- LLM カスケードの設定 ---
+    # 安い順にカンマ区切りで指定 (例: "gpt-4o-mini,gpt-4o")
+    OPENAI_CASCADE_MODELS: list[str] = [m.strip() for m in os.getenv("OPENAI_CASCADE_MODELS", "gpt-4o-mini,gpt-4o").split(",") if m.strip()]
+    # この確信度未満の結果は次の段のモデルに回す
+    CASCADE_CONFIDENCE_THRESHOLD: float = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", "0.75"))
+    OPENAI_SUMMARY_MODEL: str = os.getenv("OPENAI_SUMMARY_MODEL", "gpt-3.5-turbo")
+    # ----------------------------------
+    # --- OpenAI 接続プールの設定 ---
+    OPENAI_TIMEOUT_SECONDS: float = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+    OPENAI_MAX_CONNECTIONS: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+    # 同時に送るリクエスト数の上限 (超えた分はプールの空きを待つ)
+    OPENAI_MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+    # ----------------------------------
+    # --- サーキットブレーカーの設定 (Google Maps / OpenAI 共通) ---
+    # 直近の呼び出しの失敗率がこれ以上で open にする
+    CIRCUIT_FAILURE_RATE_THRESHOLD: float = float(os.getenv("CIRCUIT_FAILURE_RATE_THRESHOLD", "0.5"))
+    # この秒数以上かかった呼び出しを遅い呼び出しとして数える
+    CIRCUIT_SLOW_CALL_SECONDS: float = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "5"))
+    CIRCUIT_SLOW_CALL_RATE_THRESHOLD: float = float(os.getenv("CIRCUIT_SLOW_CALL_RATE_THRESHOLD", "0.8"))
+    # open にしてから試行を再開するまでの秒数
+    CIRCUIT_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    # ----------------------------------
+    # --- Place Details のヘッジングの設定 ---
+    PLACE_DETAILS_HEDGING: bool = os.getenv("PLACE_DETAILS_HEDGING", "false").lower() in ("1", "true", "yes")
+    # 観測レイテンシのこのパーセンタイルを過ぎたら重複発行する
+    HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    # 重複発行は全呼び出しに対してこの割合まで
+    HEDGE_BUDGET_RATIO: float = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+    # ----------------------------------
+    # --- 用途ごとのスレッドプール (services/executors.py) ---
+    # Google Maps API の呼び出し
+    EXECUTOR_GOOGLE_WORKERS: int = int(os.getenv("EXECUTOR_GOOGLE_WORKERS", "16"))
+    # ディスク上のキャッシュ・Redis への読み書き
+    EXECUTOR_DB_WORKERS: int = int(os.getenv("EXECUTOR_DB_WORKERS", "8"))
+    # ----------------------------------
+    # --- アドミッション制御の設定 (ワーカーごと) ---
+    # Google / OpenAI を使う検索の同時実行数。超えた分は DB のみで応答する
+    ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "8"))
+    # DB のみで応答する検索の同時実行数。超えた分は 429 を返す
+    ADMISSION_MAX_DB_ONLY_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_DB_ONLY_IN_FLIGHT", "64"))
+    # バックグラウンド更新 (X-Request-Priority: background) が使える枠
+    ADMISSION_BACKGROUND_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_BACKGROUND_MAX_IN_FLIGHT", "2"))
+    # ----------------------------------
+    # --- 検索レスポンスの HTTP キャッシュ (GET の検索) ---
+    # ブラウザが再検証せずに使う秒数
+    HTTP_CACHE_MAX_AGE: int = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+    # Vercel のエッジ (共有キャッシュ) が保持する秒数
+    HTTP_CACHE_S_MAXAGE: int = int(os.getenv("HTTP_CACHE_S_MAXAGE", "600"))
+    # 期限切れ後、裏で再検証しながら古い応答を返してよい秒数
+    HTTP_CACHE_STALE_WHILE_REVALIDATE: int = int(os.getenv("HTTP_CACHE_STALE_WHILE_REVALIDATE", "300"))
+    # DB の cell_versions から読んだセルのデータバージョンを使い回す秒数 (他インスタンスの書き込みが反映されるまでの最大遅延)
+    CELL_VERSION_TTL_SECONDS: float = float(os.getenv("CELL_VERSION_TTL_SECONDS", "5"))
+    # ----------------------------------
+    # --- 共有キャッシュ (services/shared_cache.py) ---
+    # 設定するとジオコーディング・Place Details・LLM の結果などを Redis でインスタンス間に共有する (未設定ならプロセス内のみ)
+    REDIS_URL: str | None = os.getenv("REDIS_URL")
+    # プロセス内の LRU に置く最大件数
+    CACHE_LOCAL_MAX_ENTRIES: int = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "5000"))
+    # Redis の1回の操作のタイムアウト (秒)。超えた場合はしばらくプロセス内のキャッシュだけで動く
+    CACHE_REMOTE_TIMEOUT_SECONDS: float = float(os.getenv("CACHE_REMOTE_TIMEOUT_SECONDS", "0.2"))
+    # ディスク上のキャッシュ (SQLite) のパス。ウォームなインスタンスでプロセスが入れ替わっても残る (空文字で無効)
+    CACHE_DISK_PATH: str = os.getenv("CACHE_DISK_PATH", "/tmp/jongso-cache.sqlite3")
+    # ディスク上のキャッシュの最大サイズ (MB)
+    CACHE_DISK_MAX_MB: int = int(os.getenv("CACHE_DISK_MAX_MB", "128"))
+    # ----------------------------------
+    # --- ログ (services/structured_logging.py) ---
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # json (1行1レコード) か text
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    # 詳細なログ (DEBUG) を出すリクエストの割合
+    LOG_VERBOSE_SAMPLE_RATE: float = float(os.getenv("LOG_VERBOSE_SAMPLE_RATE", "0.01"))
     # ----------------------------------
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""
+駅周辺の検索セルを事前に巡回し、jongso_shops を温めておくクローラー。
+
+scripts/import_stations.py で取り込んだ stations テーブルの駅を乗降客数の多い順 (不明は最後) に取り出し、
+駅を含むセルとその周囲 --rings 周分のセルを巡回して
+LocationService.search_nearby_jongso (API と同じ詳細取得・レビュー分析・保存の経路) を呼ぶ。
+セルは検索半径 (DEFAULT_RADIUS_M) の円に内接する正方形の大きさにし、隣り合うセルで同じ範囲を検索し直さない。
+駅の近傍店舗 (station_nearest_shops) は保存時のトリガーで更新されるため、巡回ではこれを使わず常に Google を検索する。
+
+- Google API の呼び出し回数と OpenAI のトークン数に上限を設け、超えたらその時点で止める
+- 巡回済みのセルと消費量は --state のファイルに随時書き出し、--resume で続きから再開する
+- ブレーカーが open のまま (縮退モードで) 処理したセルは保存されないため巡回済みにせず、次回に再試行する
+- 駅ごとに進捗 (件数・消費量・残り時間の目安) を表示する
+
+    python scripts/prewarm_stations.py [--stations 100] [--rings 1] [--max-google-calls 2000]
+        [--max-llm-tokens 500000] [--state prewarm_state.json] [--resume]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.resolve()
+sys.path.append(str(project_root))
+
+from config import settings  # noqa: E402
+from services.circuit_breaker import get_breaker  # noqa: E402
+from services.data_access import StationRepository, get_pool, close_pools  # noqa: E402
+from services.adaptive_radius import DEFAULT_RADIUS_M  # noqa: E402
+from services.geo_grid import cell_index, cell_center, cell_key  # noqa: E402
+from services.google_maps_service import GoogleMapsService, GOOGLE_MAPS_BREAKER  # noqa: E402
+from services.llm_gateway import get_gateway, close_gateways  # noqa: E402
+from services.location_service import LocationService, response_degraded  # noqa: E402
+from services.sentiment_analysis_service import SentimentAnalysisService  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("prewarm_stations")
+
+STATION_PAGE_SIZE = 500 # stations テーブルを読み出す1ページの件数
+DEFAULT_STATE_PATH = project_root / "prewarm_state.json"
+METERS_PER_DEGREE = 111_320
+# 検索半径の円に内接する正方形の一辺 (度)。経度方向は緯度によって短くなるため、円からはみ出さない
+SWEEP_CELL_SIZE = DEFAULT_RADIUS_M * math.sqrt(2) / METERS_PER_DEGREE
+
+
+def sweep_cells(latitude: float, longitude: float, rings: int, cell_size: float = SWEEP_CELL_SIZE) -> list[tuple[str, float, float]]:
+    """駅のセルと、その周囲 rings 周分のセルを (セルキー, 中心緯度, 中心経度) で返す (駅に近い順)"""
+    row, col = cell_index(latitude, longitude, cell_size)
+    offsets = sorted(
+        ((dr, dc) for dr in range(-rings, rings + 1) for dc in range(-rings, rings + 1)),
+        key=lambda offset: (max(abs(offset[0]), abs(offset[1])), abs(offset[0]) + abs(offset[1])),
+    )
+    cells = []
+    for dr, dc in offsets:
+        lat, lng = cell_center(row + dr, col + dc, cell_size)
+        cells.append((cell_key(lat, lng, cell_size), round(lat, 6), round(lng, 6)))
+    return cells
+
+
+class Budget:
+    """Google API の呼び出し回数と OpenAI のトークン数の上限 (実行ごと)"""
+
+    def __init__(self, sentiment_service: SentimentAnalysisService, max_google_calls: int | None, max_llm_tokens: int | None):
+        self.google_breaker = get_breaker(GOOGLE_MAPS_BREAKER)
+        self.sentiment_service = sentiment_service
+        self.max_google_calls = max_google_calls
+        self.max_llm_tokens = max_llm_tokens
+        self._google_start = self._google_calls()
+        self._tokens_start = self._llm_tokens()
+
+    def _google_calls(self) -> int:
+        return self.google_breaker.snapshot()["calls"]
+
+    def _llm_tokens(self) -> int:
+        snapshot = self.sentiment_service.cascade.metrics.snapshot()
+        return sum(
+            tier["prompt_tokens"] + tier["completion_tokens"]
+            for tiers in snapshot.values() for tier in tiers.values()
+        )
+
+    def spent(self) -> dict:
+        return {
+            "google_calls": self._google_calls() - self._google_start,
+            "llm_tokens": self._llm_tokens() - self._tokens_start,
+        }
+
+    def exhausted(self) -> str | None:
+        """上限に達していれば理由を返す"""
+        spent = self.spent()
+        if self.max_google_calls is not None and spent["google_calls"] >= self.max_google_calls:
+            return f"Google API の呼び出し回数が上限 ({self.max_google_calls}) に達しました"
+        if self.max_llm_tokens is not None and spent["llm_tokens"] >= self.max_llm_tokens:
+            return f"OpenAI のトークン数が上限 ({self.max_llm_tokens}) に達しました"
+        return None
+
+
+class CrawlState:
+    """巡回済みのセル・駅と累計の消費量。再開用にJSONファイルへ保存する"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done_cells: set[str] = set()
+        self.done_stations: set[str] = set()
+        self.totals = {"google_calls": 0, "llm_tokens": 0, "shops": 0}
+
+    def load(self) -> None:
+        if not self.path.is_file():
+            logger.info("State file %s not found. Starting from the beginning.", self.path)
+            return
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        self.done_cells = set(data.get("done_cells", []))
+        self.done_stations = set(data.get("done_stations", []))
+        self.totals.update(data.get("totals", {}))
+        logger.info("Resuming: %s stations / %s cells already crawled.", len(self.done_stations), len(self.done_cells))
+
+    def save(self, spent: dict) -> None:
+        """今回の消費量 spent を累計に足した状態を書き出す (途中で止まっても壊れないよう置き換えで保存)"""
+        data = {
+            "done_cells": sorted(self.done_cells),
+            "done_stations": sorted(self.done_stations),
+            "totals": {
+                "google_calls": self.totals["google_calls"] + spent["google_calls"],
+                "llm_tokens": self.totals["llm_tokens"] + spent["llm_tokens"],
+                "shops": self.totals["shops"],
+            },
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+
+def build_services() -> tuple[LocationService, StationRepository]:
+    """api/index.py と同じ設定でサービスを組み立てる"""
+    circuit_options = {
+        "failure_rate_threshold": settings.CIRCUIT_FAILURE_RATE_THRESHOLD,
+        "slow_call_seconds": settings.CIRCUIT_SLOW_CALL_SECONDS,
+        "slow_call_rate_threshold": settings.CIRCUIT_SLOW_CALL_RATE_THRESHOLD,
+        "open_seconds": settings.CIRCUIT_OPEN_SECONDS,
+    }
+    google_maps_service = GoogleMapsService(
+        api_key=settings.GOOGLE_MAPS_API_KEY,
+        breaker_options=circuit_options,
+        base_url=settings.GOOGLE_MAPS_BASE_URL,
+    )
+    llm_gateway = get_gateway(
+        settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        timeout=settings.OPENAI_TIMEOUT_SECONDS,
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+        breaker_options=circuit_options,
+    ) if settings.OPENAI_API_KEY else None
+    sentiment_service = SentimentAnalysisService(
+        api_key=settings.OPENAI_API_KEY,
+        gateway=llm_gateway,
+        cascade_models=settings.OPENAI_CASCADE_MODELS,
+        confidence_threshold=settings.CASCADE_CONFIDENCE_THRESHOLD,
+        summary_model=settings.OPENAI_SUMMARY_MODEL,
+    )
+    db_pool = get_pool(
+        settings.SUPABASE_URL,
+        settings.SUPABASE_KEY,
+        timeout=settings.SUPABASE_TIMEOUT_SECONDS,
+        max_connections=settings.SUPABASE_MAX_CONNECTIONS,
+        max_retries=settings.SUPABASE_MAX_RETRIES,
+    )
+    return LocationService(google_maps_service, sentiment_service, db_pool), StationRepository(db_pool)
+
+
+async def load_stations(stations: StationRepository, max_stations: int | None) -> list[dict]:
+    """乗降客数の多い順に駅を読み出す (座標の無い駅は除く)"""
+    rows: list[dict] = []
+    offset = 0
+    while max_stations is None or len(rows) < max_stations:
+        page = await stations.by_passengers(limit=STATION_PAGE_SIZE, offset=offset)
+        if not page:
+            break
+        rows.extend(row for row in page if row.get("latitude") is not None and row.get("longitude") is not None)
+        offset += len(page)
+        if len(page) < STATION_PAGE_SIZE:
+            break
+    return rows[:max_stations] if max_stations is not None else rows
+
+
+async def crawl_cell(location_service: LocationService, latitude: float, longitude: float) -> tuple[list, bool]:
+    """
+    1セルを検索し、(結果, 縮退モードで処理したか) を返す。
+    縮退モードのフラグはコンテキスト変数で、一度 True になると同じコンテキストでは戻らないため、
+    呼び出し元はセルごとに asyncio.create_task で別のコンテキストとして実行する
+    """
+    results = await location_service.search_nearby_jongso(latitude, longitude, use_station_index=False)
+    return results, response_degraded()
+
+
+def open_upstream(location_service: LocationService) -> str | None:
+    """ブレーカーが open の上流の名前 (どちらも閉じていれば None)"""
+    if location_service.google_breaker.is_open():
+        return "Google Maps"
+    if location_service.llm_breaker.is_open():
+        return "OpenAI"
+    return None
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+async def crawl(args: argparse.Namespace) -> int:
+    if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
+        logger.error("Supabase URLまたはKeyが設定されていません。")
+        return 1
+    if not settings.GOOGLE_MAPS_API_KEY:
+        logger.error("Google Maps API Keyが設定されていません。")
+        return 1
+
+    location_service, station_repository = build_services()
+    budget = Budget(location_service.sentiment_service, args.max_google_calls, args.max_llm_tokens)
+    state = CrawlState(Path(args.state))
+    if args.resume:
+        state.load()
+
+    try:
+        stations = await load_stations(station_repository, args.stations)
+        pending = [station for station in stations if station["name"] not in state.done_stations]
+        logger.info("%s stations loaded, %s to crawl (rings=%s).", len(stations), len(pending), args.rings)
+
+        started_at = time.monotonic()
+        stop_reason = None
+        for position, station in enumerate(pending, start=1):
+            stop_reason = budget.exhausted()
+            if stop_reason:
+                break
+            name = station["name"]
+            station_shops = 0
+            station_complete = True
+            for key, lat, lng in sweep_cells(station["latitude"], station["longitude"], args.rings):
+                if key in state.done_cells:
+                    continue
+                stop_reason = budget.exhausted()
+                if stop_reason:
+                    break
+                upstream = open_upstream(location_service)
+                if upstream:
+                    # 縮退中に巡回してもDBの情報しか得られないため、ブレーカーが閉じるまで待つ
+                    logger.warning("%s circuit is open. Waiting %ss before %s %s.", upstream, settings.CIRCUIT_OPEN_SECONDS, name, key)
+                    await asyncio.sleep(settings.CIRCUIT_OPEN_SECONDS)
+                try:
+                    results, degraded = await asyncio.create_task(crawl_cell(location_service, lat, lng))
+                except Exception as e:
+                    # 失敗したセルは巡回済みにせず、次回の --resume で再試行する
+                    logger.warning("Failed to crawl %s %s: %s", name, key, e)
+                    station_complete = False
+                    continue
+                if degraded:
+                    # 縮退モードの結果は保存されていないため、巡回済みにしない
+                    logger.warning("Crawled %s %s in degraded mode; it will be retried.", name, key)
+                    station_complete = False
+                    continue
+                station_shops += len(results)
+                state.done_cells.add(key)
+                state.save(budget.spent())
+            if stop_reason:
+                break
+
+            if station_complete:
+                state.done_stations.add(name)
+            state.totals["shops"] += station_shops
+            state.save(budget.spent())
+            spent = budget.spent()
+            elapsed = time.monotonic() - started_at
+            eta = elapsed / position * (len(pending) - position)
+            logger.info(
+                "[%s/%s] %s (passengers=%s): %s shops, google_calls=%s, llm_tokens=%s, elapsed=%s, eta=%s",
+                position, len(pending), name, station.get('passengers'), station_shops,
+                spent['google_calls'], spent['llm_tokens'], format_duration(elapsed), format_duration(eta),
+            )
+
+        spent = budget.spent()
+        if stop_reason:
+            logger.warning("Stopped: %s. Re-run with --resume to continue.", stop_reason)
+        else:
+            logger.info("All stations crawled.")
+        logger.info("This run: google_calls=%s, llm_tokens=%s. State saved to %s.", spent['google_calls'], spent['llm_tokens'], state.path)
+        return 0
+    finally:
+        await close_gateways()
+        await close_pools()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stations", type=int, default=None, help="巡回する駅の数 (乗降客数の多い順、省略時は全駅)")
+    parser.add_argument("--rings", type=int, default=1, help="駅のセルの周囲に巡回するセルの周数")
+    parser.add_argument("--max-google-calls", type=int, default=None, help="この実行で許す Google API の呼び出し回数")
+    parser.add_argument("--max-llm-tokens", type=int, default=None, help="この実行で許す OpenAI のトークン数")
+    parser.add_argument("--state", default=str(DEFAULT_STATE_PATH), help="再開用の状態ファイル")
+    parser.add_argument("--resume", action="store_true", help="状態ファイルの続きから巡回する")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(crawl(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from .geo_grid import cell_size_for_zoom, cell_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RADIUS_M = 3000 # 密度が未知の場合の検索半径
+MIN_RADIUS_M = 300
+MAX_RADIUS_M = 10000
+NEARBY_PAGE_SIZE = 20 # Nearby Search が1ページで返す最大件数
+DENSITY_CELL_ZOOM = 12 # 密度を記録するセルの粒度 (約2.4km四方)
+DENSITY_TTL_SECONDS = 7 * 24 * 3600
+DENSITY_MAX_CELLS = 10000
+DENSITY_SMOOTHING = 0.5 # 新しい観測値の重み (指数移動平均)
+
+
+class CellDensityCache:
+    """セルごとの雀荘密度 (件/km²) を記録し、目標件数に合う検索半径を推定する"""
+
+    def __init__(self, ttl_seconds: float = DENSITY_TTL_SECONDS, max_cells: int = DENSITY_MAX_CELLS):
+        self.ttl_seconds = ttl_seconds
+        self.max_cells = max_cells
+        self.cell_size = cell_size_for_zoom(DENSITY_CELL_ZOOM)
+        # セル -> (密度, 下限値かどうか, 記録時刻)
+        self._cells: OrderedDict[tuple[int, int], tuple[float, bool, float]] = OrderedDict()
+
+    def estimate(self, lat: float, lng: float) -> tuple[float, bool] | None:
+        """記録済みの密度と、それが下限値 (結果が上限件数で打ち切られた) かどうかを返す"""
+        key = cell_index(lat, lng, self.cell_size)
+        entry = self._cells.get(key)
+        if entry is None:
+            return None
+        density, is_lower_bound, recorded_at = entry
+        if time.monotonic() - recorded_at > self.ttl_seconds:
+            del self._cells[key]
+            return None
+        self._cells.move_to_end(key)
+        return density, is_lower_bound
+
+    def record(self, lat: float, lng: float, radius_m: float, count: int) -> None:
+        """周辺検索の結果件数から密度を記録する"""
+        area_km2 = math.pi * (radius_m / 1000) ** 2
+        if area_km2 <= 0:
+            return
+        density = count / area_km2
+        # 上限件数に達した場合、実際の密度はこれ以上
+        is_lower_bound = count >= NEARBY_PAGE_SIZE
+
+        key = cell_index(lat, lng, self.cell_size)
+        previous = self.estimate(lat, lng)
+        if previous is not None:
+            previous_density, previous_lower_bound = previous
+            if is_lower_bound and not previous_lower_bound:
+                # 打ち切られた観測より、打ち切られていない観測を信頼する
+                density = max(density, previous_density)
+                is_lower_bound = False
+            elif is_lower_bound and previous_lower_bound:
+                density = max(density, previous_density)
+            elif not previous_lower_bound:
+                density = DENSITY_SMOOTHING * density + (1 - DENSITY_SMOOTHING) * previous_density
+
+        self._cells[key] = (density, is_lower_bound, time.monotonic())
+        self._cells.move_to_end(key)
+        while len(self._cells) > self.max_cells:
+            self._cells.popitem(last=False)
+        logger.debug("Recorded density for cell %s: %.2f/km² (lower_bound=%s)", key, density, is_lower_bound)
+
+    def radius_for_target(self, lat: float, lng: float, target_count: int) -> int:
+        """目標件数が収まる円の半径 (m) を推定する。密度が未知なら既定値"""
+        estimate = self.estimate(lat, lng)
+        if estimate is None:
+            return DEFAULT_RADIUS_M
+        density, _ = estimate
+        if density <= 0:
+            return MAX_RADIUS_M
+        radius_km = math.sqrt(target_count / (math.pi * density))
+        return clamp_radius(radius_km * 1000)
+
+
+def clamp_radius(radius_m: float) -> int:
+    """検索半径を許容範囲に丸める"""
+    return int(max(MIN_RADIUS_M, min(MAX_RADIUS_M, radius_m)))
+
+
+def next_radius(radius_m: int, target_count: int, found_count: int) -> int | None:
+    """件数が足りない場合に次に試す半径を返す。これ以上広げられなければ None"""
+    if found_count >= target_count or radius_m >= MAX_RADIUS_M:
+        return None
+    # 件数は面積 (半径の2乗) に比例すると仮定し、一度に最大4倍まで広げる
+    growth = math.sqrt(target_count / max(found_count, 1))
+    return clamp_radius(radius_m * min(max(growth, 1.25), 4.0))
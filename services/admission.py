@@ -0,0 +1,137 @@
+"""
+検索エンドポイントのアドミッション制御 (負荷制限)。
+
+Google / OpenAI へのファンアウトを伴う「補完処理」の同時実行数を数え、上限を超えたリクエストは
+DBのみの結果 (縮退モード) で応答させ、それも上限を超えたら 429 と Retry-After で断る。
+ユーザーの検索はバックグラウンドの更新より優先し、バックグラウンドは少ない枠しか使えない。
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_USER = "user"
+PRIORITY_BACKGROUND = "background"
+
+MODE_FULL = "full" # Google / OpenAI を使った補完を行う
+MODE_DB_ONLY = "db_only" # DBに保存済みの情報だけで応答する
+
+DEFAULT_MAX_IN_FLIGHT = 8 # 補完処理の同時実行数の上限
+DEFAULT_MAX_DB_ONLY_IN_FLIGHT = 64 # DBのみで応答する処理の同時実行数の上限 (超えたら 429)
+DEFAULT_BACKGROUND_MAX_IN_FLIGHT = 2 # バックグラウンドの更新が使える補完処理の枠
+DEFAULT_SERVICE_TIME_SECONDS = 3.0 # 補完処理の所要時間の初期推定値 (Retry-After の計算用)
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """過負荷のため受け付けなかった"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many requests in flight (retry after {retry_after:.1f}s)")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Admission:
+    """受け付けたリクエストの枠。with ブロックを抜けると解放する"""
+
+    def __init__(self, controller: "AdmissionController", priority: str, mode: str, weight: int = 1):
+        self.controller = controller
+        self.priority = priority
+        self.mode = mode
+        self.weight = weight
+        self._started = time.monotonic()
+        self._released = False
+
+    @property
+    def allow_upstream(self) -> bool:
+        return self.mode == MODE_FULL
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self, time.monotonic() - self._started)
+
+    def __enter__(self) -> "Admission":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """補完処理の同時実行数に応じて、リクエストを full / db_only / 拒否 に振り分ける"""
+
+    def __init__(
+        self,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_db_only_in_flight: int = DEFAULT_MAX_DB_ONLY_IN_FLIGHT,
+        background_max_in_flight: int = DEFAULT_BACKGROUND_MAX_IN_FLIGHT,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_db_only_in_flight = max_db_only_in_flight
+        self.background_max_in_flight = min(background_max_in_flight, max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = {MODE_FULL: 0, MODE_DB_ONLY: 0}
+        self._background_in_flight = 0
+        self._service_time = DEFAULT_SERVICE_TIME_SECONDS
+        self._stats = {"admitted": 0, "db_only": 0, "rejected": 0, "background_rejected": 0}
+
+    def acquire(self, priority: str = PRIORITY_USER, weight: int = 1) -> Admission:
+        """
+        枠を確保して Admission を返す。
+        ユーザーの検索は補完の枠が空いていなければ DB のみで受け付け、それも満杯なら AdmissionRejected。
+        バックグラウンドの更新は専用の少ない枠しか使わず、空いていなければ DB のみに落とさず拒否する。
+        weight はまとめて行う検索の件数 (バッチ検索) で、その数だけ枠を使う (枠の上限を超える分は上限に切り詰める)
+        """
+        with self._lock:
+            if priority == PRIORITY_BACKGROUND:
+                weight = max(1, min(weight, self.background_max_in_flight))
+                if (self._background_in_flight + weight <= self.background_max_in_flight
+                        and self._in_flight[MODE_FULL] + weight <= self.max_in_flight):
+                    self._background_in_flight += weight
+                    return self._admit(priority, MODE_FULL, weight)
+                self._stats["background_rejected"] += 1
+                raise AdmissionRejected(self._retry_after())
+
+            full_weight = max(1, min(weight, self.max_in_flight))
+            if self._in_flight[MODE_FULL] + full_weight <= self.max_in_flight:
+                return self._admit(priority, MODE_FULL, full_weight)
+            db_only_weight = max(1, min(weight, self.max_db_only_in_flight))
+            if self._in_flight[MODE_DB_ONLY] + db_only_weight <= self.max_db_only_in_flight:
+                self._stats["db_only"] += 1
+                return self._admit(priority, MODE_DB_ONLY, db_only_weight)
+            self._stats["rejected"] += 1
+            raise AdmissionRejected(self._retry_after())
+
+    def _admit(self, priority: str, mode: str, weight: int) -> Admission:
+        self._in_flight[mode] += weight
+        self._stats["admitted"] += 1
+        return Admission(self, priority, mode, weight)
+
+    def _release(self, admission: Admission, elapsed: float) -> None:
+        with self._lock:
+            self._in_flight[admission.mode] -= admission.weight
+            if admission.priority == PRIORITY_BACKGROUND:
+                self._background_in_flight -= admission.weight
+            if admission.mode == MODE_FULL:
+                # 補完処理の所要時間を指数移動平均で追い、Retry-After の目安にする
+                self._service_time += SERVICE_TIME_SMOOTHING * (elapsed - self._service_time)
+
+    def _retry_after(self) -> float:
+        """補完の枠が1つ空くまでのおおよその時間"""
+        return self._service_time * max(1, self._in_flight[MODE_FULL]) / max(1, self.max_in_flight)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": dict(self._in_flight),
+                "background_in_flight": self._background_in_flight,
+                "service_time_seconds": self._service_time,
+                **self._stats,
+            }
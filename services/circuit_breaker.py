@@ -0,0 +1,219 @@
+"""
+外部サービス (Google Maps / OpenAI) ごとのサーキットブレーカー。
+
+直近の呼び出し結果をスライディングウィンドウで保持し、失敗率または遅い呼び出しの割合が閾値を超えたら
+一定時間 open にして呼び出しを即座に拒否する。時間が経つと half-open に移り、少数の試行が成功すれば closed に戻る。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_WINDOW_SIZE = 20 # 判定に使う直近の呼び出し数
+DEFAULT_MIN_CALLS = 5 # これ未満の呼び出し数では open にしない
+DEFAULT_FAILURE_RATE_THRESHOLD = 0.5
+DEFAULT_SLOW_CALL_SECONDS = 5.0
+DEFAULT_SLOW_CALL_RATE_THRESHOLD = 0.8
+DEFAULT_OPEN_SECONDS = 30.0 # open から half-open に移るまでの時間
+DEFAULT_HALF_OPEN_MAX_CALLS = 2 # half-open で通す試行の数 (すべて成功すれば closed に戻る)
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが open のため呼び出しを行わなかった"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open (retry after {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """失敗率・レイテンシの閾値で開閉するサーキットブレーカー"""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        min_calls: int = DEFAULT_MIN_CALLS,
+        failure_rate_threshold: float = DEFAULT_FAILURE_RATE_THRESHOLD,
+        slow_call_seconds: float = DEFAULT_SLOW_CALL_SECONDS,
+        slow_call_rate_threshold: float = DEFAULT_SLOW_CALL_RATE_THRESHOLD,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+        half_open_max_calls: int = DEFAULT_HALF_OPEN_MAX_CALLS,
+        is_failure: Callable[[BaseException], bool] | None = None,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        # 例外のうち障害として数えるものを判定する (入力エラーなどで open にしないため)
+        self.is_failure = is_failure or (lambda error: True)
+
+        self._lock = threading.Lock()
+        self._window: deque[tuple[bool, bool]] = deque(maxlen=window_size) # (失敗したか, 遅かったか)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self._stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+            logger.info("Circuit '%s' is half-open, allowing trial calls.", self.name)
+        return self._state
+
+    def is_open(self) -> bool:
+        """呼び出しを拒否する状態か (half-open は試行を受け付けるため False)"""
+        return self.state == OPEN
+
+    def allow_request(self) -> bool:
+        """呼び出してよければ True を返し、half-open の試行枠を確保する"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def retry_after(self) -> float:
+        """open の場合、half-open に移るまでの残り秒数"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self, latency: float) -> None:
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            self._stats["calls"] += 1
+            if slow:
+                self._stats["slow_calls"] += 1
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if slow:
+                    self._trip("slow trial call")
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._state = CLOSED
+                    self._window.clear()
+                    logger.info("Circuit '%s' closed after successful trial calls.", self.name)
+                return
+            self._window.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self, latency: float = 0.0) -> None:
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._trip("failed trial call")
+                return
+            self._window.append((True, latency >= self.slow_call_seconds))
+            self._evaluate()
+
+    def release(self) -> None:
+        """結果を記録せずに half-open の試行枠を返す (取り消された呼び出しは上流の失敗として数えない)"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def _evaluate(self) -> None:
+        if self._state != CLOSED or len(self._window) < self.min_calls:
+            return
+        calls = len(self._window)
+        failure_rate = sum(1 for failed, _ in self._window if failed) / calls
+        slow_rate = sum(1 for _, slow in self._window if slow) / calls
+        if failure_rate >= self.failure_rate_threshold:
+            self._trip(f"failure rate {failure_rate:.0%}")
+        elif slow_rate >= self.slow_call_rate_threshold:
+            self._trip(f"slow call rate {slow_rate:.0%}")
+
+    def _trip(self, reason: str) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._window.clear()
+        self._stats["opened"] += 1
+        logger.warning("Circuit '%s' opened (%s); rejecting calls for %ss.", self.name, reason, self.open_seconds)
+
+    def _record_error(self, error: BaseException, latency: float) -> None:
+        if self.is_failure(error):
+            self.record_failure(latency)
+        else:
+            # 入力エラーなどは上流が応答しているので成功として扱う
+            self.record_success(latency)
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """同期関数をブレーカー経由で呼び出す。open の場合は CircuitOpenError"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record_error(e, time.perf_counter() - started)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success(time.perf_counter() - started)
+        return result
+
+    async def acall(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """コルーチン関数をブレーカー経由で呼び出す。open の場合は CircuitOpenError"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self._record_error(e, time.perf_counter() - started)
+            raise
+        except BaseException:
+            # 呼び出し元のタイムアウト・切断による取り消し (CancelledError) など
+            self.release()
+            raise
+        self.record_success(time.perf_counter() - started)
+        return result
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self._current_state(), **self._stats}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **options) -> CircuitBreaker:
+    """名前ごとのブレーカーを返す (初回だけ options で作成する)"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, **options)
+    return breaker
+
+
+def snapshot_breakers() -> dict:
+    """全ブレーカーの状態と統計"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
@@ -0,0 +1,320 @@
+"""
+Supabase (PostgREST) への非同期アクセス層。
+
+プロセス内で1つの HTTP/2 コネクションプールを共有し、冪等な読み取り・upsert は
+接続断 (ConnectionTerminated など) や 5xx の際にジッター付きの指数バックオフで再試行する。
+クエリ名ごとに回数・再試行・エラー・レイテンシを記録する。
+テーブルごとの問い合わせは JongsoShopRepository などのリポジトリにまとめ、各サービスはこれを使う。
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 3.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE_SECONDS = 0.1
+DEFAULT_BACKOFF_MAX_SECONDS = 2.0
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+IN_FILTER_CHUNK_SIZE = 100 # in フィルタ1回あたりの値の数 (URL が長くなりすぎないように分割する)
+
+
+class DataAccessError(Exception):
+    """PostgREST への問い合わせが失敗した (再試行後も含む)"""
+
+    def __init__(self, query: str, message: str, status_code: int | None = None):
+        super().__init__(f"{query}: {message}")
+        self.query = query
+        self.status_code = status_code
+
+
+class QueryMetrics:
+    """クエリ名ごとの実行統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, float]] = {}
+
+    def record(self, query: str, latency: float, retries: int, error: bool) -> None:
+        with self._lock:
+            entry = self._stats.get(query)
+            if entry is None:
+                entry = self._stats[query] = {"calls": 0, "retries": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+            entry["calls"] += 1
+            entry["retries"] += retries
+            entry["errors"] += 1 if error else 0
+            entry["latency_total"] += latency
+            entry["latency_max"] = max(entry["latency_max"], latency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                query: {**entry, "latency_avg": entry["latency_total"] / entry["calls"] if entry["calls"] else 0.0}
+                for query, entry in self._stats.items()
+            }
+
+
+def in_filter(values) -> str:
+    """in フィルタの値を作る (カンマや括弧を含む値も扱えるよう二重引用符で囲む)"""
+    quoted = ",".join('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values)
+    return f"in.({quoted})"
+
+
+class PostgrestPool:
+    """共有コネクションプールを持つ PostgREST クライアント"""
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = DEFAULT_BACKOFF_BASE_SECONDS,
+        backoff_max: float = DEFAULT_BACKOFF_MAX_SECONDS,
+        http2: bool = True,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http_client = httpx.AsyncClient(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.metrics = QueryMetrics()
+        logger.info("PostgrestPool initialized (http2=%s, max_connections=%s, max_retries=%s).", http2, max_connections, max_retries)
+
+    async def request(self, query: str, method: str, path: str, params=None, json=None, headers: dict | None = None,
+                      retry: bool = True) -> httpx.Response:
+        """
+        リクエストを送り、2xx/3xx の応答を返す。
+        retry=True (冪等な操作) の場合、接続エラー・タイムアウト・RETRYABLE_STATUSES の応答は再試行する。
+        """
+        attempts = self.max_retries + 1 if retry else 1
+        started = time.perf_counter()
+        retries = 0
+        error = None
+        for attempt in range(attempts):
+            try:
+                response = await self.http_client.request(method, path, params=params, json=json, headers=headers)
+            except httpx.TransportError as e:
+                # HTTP/2 の ConnectionTerminated は RemoteProtocolError として届く
+                error = DataAccessError(query, f"{type(e).__name__}: {e}")
+            else:
+                if response.status_code < 400:
+                    self.metrics.record(query, time.perf_counter() - started, retries, error=False)
+                    return response
+                error = DataAccessError(query, f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                if response.status_code not in RETRYABLE_STATUSES:
+                    break
+
+            if attempt + 1 < attempts:
+                # full jitter: 0 〜 base * 2^attempt (上限 backoff_max) のランダムな時間だけ待つ
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                logger.warning("Query %s failed (%s), retrying in %.2fs (%s/%s).", query, error, delay, attempt + 1, self.max_retries)
+                retries += 1
+                await asyncio.sleep(delay)
+
+        self.metrics.record(query, time.perf_counter() - started, retries, error=True)
+        raise error
+
+    async def select(self, query: str, table: str, columns: str = "*", filters: list | None = None,
+                     order: str | None = None, limit: int | None = None, offset: int | None = None) -> list[dict]:
+        """filters は (カラム, "演算子.値") のタプルのリスト (同じカラムに複数の条件を付けられる)"""
+        params = [("select", columns.replace(" ", ""))]
+        params.extend(filters or [])
+        if order:
+            params.append(("order", order))
+        if limit is not None:
+            params.append(("limit", str(limit)))
+        if offset:
+            params.append(("offset", str(offset)))
+        response = await self.request(query, "GET", f"/{table}", params=params)
+        return response.json()
+
+    async def upsert(self, query: str, table: str, rows: list[dict], on_conflict: str | None = None,
+                     ignore_duplicates: bool = False) -> None:
+        """主キー (または on_conflict のカラム) が重複する行は更新する。同じ行を何度送っても結果は同じなので再試行する"""
+        if not rows:
+            return
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        params = [("on_conflict", on_conflict)] if on_conflict else None
+        await self.request(query, "POST", f"/{table}", params=params, json=rows,
+                           headers={"Prefer": f"resolution={resolution},return=minimal"})
+
+    async def update(self, query: str, table: str, values: dict, filters: list, retry: bool = False) -> None:
+        """条件に一致する行を更新する。値が固定の更新だけ retry=True にする"""
+        await self.request(query, "PATCH", f"/{table}", params=filters, json=values,
+                           headers={"Prefer": "return=minimal"}, retry=retry)
+
+    async def rpc(self, query: str, function: str, args: dict, retry: bool = True) -> Any:
+        """DB関数を呼ぶ。読み取り専用の関数だけ retry=True のまま使う"""
+        response = await self.request(query, "POST", f"/rpc/{function}", json=args, retry=retry)
+        return response.json()
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+
+_pools: dict[tuple, PostgrestPool] = {}
+
+
+def get_pool(url: str, key: str, **options) -> PostgrestPool:
+    """同じ接続先のプールをプロセス内で共有する"""
+    pool = _pools.get((url, key))
+    if pool is None:
+        pool = _pools[(url, key)] = PostgrestPool(url, key, **options)
+    return pool
+
+
+async def close_pools() -> None:
+    """共有しているプールをすべて閉じる (アプリ終了時)"""
+    for pool in list(_pools.values()):
+        await pool.aclose()
+    _pools.clear()
+
+
+class JongsoShopRepository:
+    """jongso_shops テーブルへの問い合わせ"""
+
+    TABLE = "jongso_shops"
+
+    def __init__(self, pool: PostgrestPool):
+        self.pool = pool
+
+    async def get(self, place_id: str, columns: str = "*") -> dict | None:
+        rows = await self.pool.select("shops.get", self.TABLE, columns, [("place_id", f"eq.{place_id}")], limit=1)
+        return rows[0] if rows else None
+
+    async def get_many(self, place_ids: list, columns: str = "*") -> dict:
+        """place_id -> レコード を返す"""
+        records = {}
+        for start in range(0, len(place_ids), IN_FILTER_CHUNK_SIZE):
+            chunk = place_ids[start:start + IN_FILTER_CHUNK_SIZE]
+            rows = await self.pool.select("shops.get_many", self.TABLE, columns, [("place_id", in_filter(chunk))])
+            records.update((row["place_id"], row) for row in rows)
+        return records
+
+    async def in_bbox(self, south: float, west: float, north: float, east: float, columns: str = "*",
+                      limit: int | None = None) -> list[dict]:
+        filters = [("lat", f"gte.{south}"), ("lat", f"lte.{north}"), ("lng", f"gte.{west}"), ("lng", f"lte.{east}")]
+        return await self.pool.select("shops.in_bbox", self.TABLE, columns, filters, limit=limit)
+
+    async def search_text(self, keyword: str, columns: str = "*", limit: int | None = None) -> list[dict]:
+        """店舗名または住所にキーワードを含む店舗"""
+        # PostgREST の or フィルタで区切り文字として扱われる文字は除く
+        pattern = keyword.replace(',', ' ').replace('(', ' ').replace(')', ' ').strip()
+        if not pattern:
+            return []
+        filters = [("or", f"(name.ilike.*{pattern}*,address.ilike.*{pattern}*)")]
+        return await self.pool.select("shops.search_text", self.TABLE, columns, filters, limit=limit)
+
+    async def bbox_clusters(self, south: float, west: float, north: float, east: float, cell_size: float) -> list[dict]:
+        """jongso_shops_bbox_clusters (読み取り専用の集約関数) を呼ぶ"""
+        return await self.pool.rpc("shops.bbox_clusters", "jongso_shops_bbox_clusters", {
+            "south": south, "west": west, "north": north, "east": east, "cell_size": cell_size,
+        })
+
+    async def upsert(self, records: list[dict]) -> None:
+        await self.pool.upsert("shops.upsert", self.TABLE, records)
+
+    async def insert_if_absent(self, records: list[dict]) -> None:
+        """既に存在する place_id の行は変更しない"""
+        await self.pool.upsert("shops.insert_if_absent", self.TABLE, records, ignore_duplicates=True)
+
+    async def set_last_fetched_at(self, place_id: str, fetched_at: str) -> None:
+        await self.pool.update("shops.set_last_fetched_at", self.TABLE, {"last_fetched_at": fetched_at},
+                               [("place_id", f"eq.{place_id}")], retry=True)
+
+
+class StationRepository:
+    """stations テーブル (scripts/import_stations.py で取り込んだ駅) への問い合わせ"""
+
+    TABLE = "stations"
+    COLUMNS = "name, latitude, longitude, passengers"
+
+    def __init__(self, pool: PostgrestPool):
+        self.pool = pool
+
+    async def by_passengers(self, columns: str = COLUMNS, limit: int | None = None, offset: int | None = None) -> list[dict]:
+        """乗降客数の多い順 (不明は最後) に駅を返す"""
+        return await self.pool.select("stations.by_passengers", self.TABLE, columns, order="passengers.desc.nullslast,name.asc",
+                                      limit=limit, offset=offset)
+
+    async def in_bbox(self, south: float, west: float, north: float, east: float, columns: str = COLUMNS,
+                      limit: int | None = None) -> list[dict]:
+        filters = [("latitude", f"gte.{south}"), ("latitude", f"lte.{north}"),
+                   ("longitude", f"gte.{west}"), ("longitude", f"lte.{east}")]
+        return await self.pool.select("stations.in_bbox", self.TABLE, columns, filters, limit=limit)
+
+    async def upsert(self, rows: list[dict]) -> None:
+        await self.pool.upsert("stations.upsert", self.TABLE, rows, on_conflict="name")
+
+
+class StationShopRepository:
+    """
+    station_nearest_shops (駅ごとの近傍店舗。supabase/migrations/20261019000100_station_nearest_shops.sql) への問い合わせ。
+    店舗の情報は jongso_shops を埋め込んで1回の読み取りで返す。
+    """
+
+    TABLE = "station_nearest_shops"
+
+    def __init__(self, pool: PostgrestPool):
+        self.pool = pool
+
+    @staticmethod
+    def _columns(shop_columns: str) -> str:
+        return f"station_name, station_lat, station_lng, rank, distance_m, jongso_shops({shop_columns})"
+
+    async def for_station(self, name: str, shop_columns: str = "*", limit: int | None = None) -> list[dict]:
+        """駅名の近傍店舗を近い順に返す"""
+        return await self.pool.select("station_shops.for_station", self.TABLE, self._columns(shop_columns),
+                                      [("station_name", f"eq.{name}")], order="rank.asc", limit=limit)
+
+    async def near_point(self, south: float, west: float, north: float, east: float, shop_columns: str = "*") -> list[dict]:
+        """範囲内にある駅の近傍店舗を返す (駅ごとに近い順)"""
+        filters = [("station_lat", f"gte.{south}"), ("station_lat", f"lte.{north}"),
+                   ("station_lng", f"gte.{west}"), ("station_lng", f"lte.{east}")]
+        return await self.pool.select("station_shops.near_point", self.TABLE, self._columns(shop_columns), filters,
+                                      order="station_name.asc,rank.asc")
+
+    async def refresh(self, station_names: list[str]) -> int:
+        """指定した駅の近傍店舗を作り直す (通常はトリガーで維持されるため、手動の再構築用)"""
+        return await self.pool.rpc("station_shops.refresh", "refresh_station_nearest_shops", {"station_names": station_names})
+
+
+class CellVersionRepository:
+    """cell_versions (セルごとのデータバージョン。jongso_shops の変更時にトリガーで上がる) への問い合わせ"""
+
+    TABLE = "cell_versions"
+
+    def __init__(self, pool: PostgrestPool):
+        self.pool = pool
+
+    async def for_cells(self, zoom: int, cells: list[tuple[int, int]]) -> dict[tuple[int, int], int]:
+        """
+        (行, 列) -> version を返す (行の無いセルは version 0 として扱う)。
+        行・列それぞれの in フィルタで読み、指定したセル以外の組み合わせは捨てる
+        """
+        cells = set(cells)
+        if not cells:
+            return {}
+        filters = [("zoom", f"eq.{zoom}"), ("cell_row", in_filter(sorted({row for row, _ in cells}))),
+                   ("cell_col", in_filter(sorted({col for _, col in cells})))]
+        rows = await self.pool.select("cell_versions.for_cells", self.TABLE, "cell_row, cell_col, version", filters)
+        versions = {(row["cell_row"], row["cell_col"]): row["version"] for row in rows}
+        return {cell: version for cell, version in versions.items() if cell in cells}
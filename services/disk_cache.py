@@ -0,0 +1,207 @@
+"""
+共有キャッシュ (services/shared_cache.py) のディスク上の段。
+
+Vercel のウォームなインスタンスは書き込み可能な /tmp を持つが、呼び出しをまたいで残るのはモジュールのグローバル変数だけで、
+プロセスが入れ替わるとプロセス内の LRU は空になる。ジオコーディング・周辺検索・Place Details などの応答を
+SQLite (WAL モード) のファイルに置き、同じマシン上の次のプロセスや uvicorn の他のワーカーからも使えるようにする。
+
+- 期限は実時刻 (time.time) で持ち、プロセスを再起動しても有効なまま残る
+- ファイルの合計サイズが max_bytes を超えたら、期限切れのもの、次に最後に読まれた時刻が古いものから消す。
+  他のプロセスも同じファイルに書き込むため、合計サイズは SIZE_REFRESH_SECONDS ごと、
+  および上限を超えたと見積もったときに SQLite から読み直してから判定する
+- 読み取り時刻の更新は ACCESS_UPDATE_SECONDS に1回までにし、読み取りのたびに書き込みが起きないようにする
+- SQLite のエラーは呼び出し元に伝えず、ミスとして扱う
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+EVICT_TO_RATIO = 0.9 # 上限を超えたら、この割合まで減らす
+ACCESS_UPDATE_SECONDS = 60.0
+SIZE_REFRESH_SECONDS = 5.0 # 他のプロセスの書き込みを反映するため、合計サイズを読み直す間隔
+BUSY_TIMEOUT_MS = 200 # 他のワーカーが書き込み中の場合に待つ最大時間
+
+_SCHEMA = """
+create table if not exists entries (
+    key text primary key,
+    value blob not null,
+    size integer not null,
+    expires_at real not null,
+    accessed_at real not null
+);
+create index if not exists entries_expires_at_idx on entries (expires_at);
+create index if not exists entries_accessed_at_idx on entries (accessed_at);
+"""
+
+
+class DiskTier:
+    """SQLite (WAL) のファイルに置くキャッシュ。キー -> JSON 化したバイト列"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # close で全スレッドの接続を閉じるため、開いた接続を覚えておく。
+        # close で世代を進め、古い世代の接続を持つスレッドは次の呼び出しで開き直す
+        self._connections: list[sqlite3.Connection] = []
+        self._generation = 0
+        self.errors = 0
+        self.evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        self._bytes = self._read_size(connection)
+        self._size_read_at = time.monotonic()
+        logger.info("DiskTier opened at %s (%.1f MiB cached, max %.0f MiB).", path, self._bytes / 1024 / 1024, max_bytes / 1024 / 1024)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        スレッドごとの接続 (sqlite3 の接続はスレッド間で共有しない)。
+        close だけは別のスレッドから閉じるため check_same_thread=False で開く
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.generation != self._generation:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("pragma journal_mode=wal")
+            connection.execute("pragma synchronous=normal")
+            connection.execute(f"pragma busy_timeout={BUSY_TIMEOUT_MS}")
+            with self._lock:
+                self._connections.append(connection)
+                self._local.generation = self._generation
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _read_size(connection: sqlite3.Connection) -> int:
+        return connection.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        with self._lock:
+            self.errors += 1
+        logger.warning("DiskTier %s failed: %s", operation, error)
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            connection = self._connection()
+            row = connection.execute("select value, expires_at, accessed_at from entries where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at, accessed_at = row
+            now = time.time()
+            if expires_at <= now:
+                self.delete(key)
+                return None
+            if now - accessed_at >= ACCESS_UPDATE_SECONDS:
+                connection.execute("update entries set accessed_at = ? where key = ?", (now, key))
+            return value
+        except sqlite3.Error as e:
+            self._failed("get", e)
+            return None
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        now = time.time()
+        try:
+            connection = self._connection()
+            previous = connection.execute("select size from entries where key = ?", (key,)).fetchone()
+            connection.execute(
+                "insert or replace into entries (key, value, size, expires_at, accessed_at) values (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl, now),
+            )
+        except sqlite3.Error as e:
+            self._failed("set", e)
+            return
+        with self._lock:
+            self._bytes += len(data) - (previous[0] if previous else 0)
+            refresh = self._bytes > self.max_bytes or time.monotonic() - self._size_read_at >= SIZE_REFRESH_SECONDS
+        if refresh and self._refresh_size(connection) > self.max_bytes:
+            self.evict()
+
+    def _refresh_size(self, connection: sqlite3.Connection) -> int:
+        """他のプロセスの書き込み・削除も含めた合計サイズを読み直す"""
+        try:
+            total = self._read_size(connection)
+        except sqlite3.Error as e:
+            self._failed("size", e)
+            return self._bytes
+        with self._lock:
+            self._bytes = total
+            self._size_read_at = time.monotonic()
+        return total
+
+    def delete(self, key: str) -> None:
+        try:
+            connection = self._connection()
+            row = connection.execute("select size from entries where key = ?", (key,)).fetchone()
+            connection.execute("delete from entries where key = ?", (key,))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+            return
+        if row is not None:
+            with self._lock:
+                self._bytes -= row[0]
+
+    def evict(self) -> None:
+        """期限切れのものを消し、まだ多ければ読まれていない順に EVICT_TO_RATIO まで減らす"""
+        target = int(self.max_bytes * EVICT_TO_RATIO)
+        try:
+            connection = self._connection()
+            connection.execute("begin immediate")
+            try:
+                removed = connection.execute("delete from entries where expires_at <= ?", (time.time(),)).rowcount
+                total = connection.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+                if total > target:
+                    # 読まれた時刻の古い順に累積サイズを数え、超過分を覆うまでの行を消す
+                    removed += connection.execute(
+                        """
+                        delete from entries where key in (
+                            select key from (
+                                select key, size, sum(size) over (order by accessed_at, key) as running from entries
+                            ) where running - size < ?
+                        )
+                        """,
+                        (total - target,),
+                    ).rowcount
+                    total = connection.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+                connection.execute("commit")
+            except BaseException:
+                connection.execute("rollback")
+                raise
+        except sqlite3.Error as e:
+            self._failed("evict", e)
+            return
+        with self._lock:
+            self._bytes = total
+            self._size_read_at = time.monotonic()
+            self.evictions += removed
+        logger.info("DiskTier evicted %s entries (%.1f MiB remaining).", removed, total / 1024 / 1024)
+
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute("select count(*) from entries").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"path": self.path, "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions, "errors": self.errors}
+
+    def close(self) -> None:
+        """全スレッドの接続を閉じる (以降に呼ばれた場合は、呼び出したスレッドで開き直す)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error as e:
+                logger.warning("DiskTier close failed: %s", e)
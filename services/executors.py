@@ -0,0 +1,144 @@
+"""
+用途ごとに分けたスレッドプール。
+
+同期のクライアント (googlemaps・SQLite・redis-py) や CPU を使う処理を既定のスレッドプール (run_in_executor(None, ...)) で動かすと、
+遅い Place Details の呼び出しがプールを埋め、DB・キャッシュの読み取りがその後ろで待たされる。
+用途ごとに大きさを決めたプールで実行し、キューの長さ・キューでの待ち時間・実行時間をプールごとに記録する
+(/api/metrics の executors。待ち時間が伸びているプールだけを大きくする)。
+
+- google: Google Maps API の呼び出し (googlemaps は同期クライアント)
+- db: 同期のデータストア (ディスク上のキャッシュの SQLite・Redis) への読み書き
+- cpu: HTML からのテキスト抽出など、CPU を使う解析
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_EXECUTOR = "google"
+DB_EXECUTOR = "db"
+CPU_EXECUTOR = "cpu"
+
+DEFAULT_MAX_WORKERS = {
+    GOOGLE_EXECUTOR: 16,
+    DB_EXECUTOR: 8,
+    CPU_EXECUTOR: min(4, os.cpu_count() or 1),
+}
+DEFAULT_WINDOW_SIZE = 500 # 待ち時間のパーセンタイルに使う直近のサンプル数
+
+
+class BoundedExecutor:
+    """最大スレッド数を固定したプール。キューの長さ・待ち時間・実行時間を記録する"""
+
+    def __init__(self, name: str, max_workers: int, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-executor")
+        self._lock = threading.Lock()
+        self._waits: deque[float] = deque(maxlen=window_size)
+        self._queued = 0
+        self._active = 0
+        self._stats = {"submitted": 0, "completed": 0, "errors": 0, "cancelled": 0, "max_queue_depth": 0,
+                       "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0}
+
+    def _task(self, func: Callable, args: tuple, kwargs: dict, enqueued_at: float) -> Callable[[], Any]:
+        def run():
+            started_at = time.monotonic()
+            waited = started_at - enqueued_at
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._waits.append(waited)
+                self._stats["wait_total"] += waited
+                self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+            failed = False
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._stats["completed"] += 1
+                    self._stats["errors"] += 1 if failed else 0
+                    self._stats["run_total"] += time.monotonic() - started_at
+        return run
+
+    def _on_done(self, future: Future) -> None:
+        # 実行前に取り消されたもの (呼び出し元のタイムアウトなど) はキューから外れたまま実行されない
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+                self._stats["cancelled"] += 1
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self._queued += 1
+            self._stats["submitted"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queued)
+        future = self._executor.submit(self._task(func, args, kwargs, time.monotonic()))
+        future.add_done_callback(self._on_done)
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        イベントループから同期関数を呼び、結果を待つ (loop.run_in_executor の代わり)。
+        asyncio.to_thread と同じく、呼び出し元のコンテキスト変数を引き継ぐ
+        """
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(self.submit(context.run, func, *args, **kwargs))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+            queued, active = self._queued, self._active
+        started = stats["completed"] + active
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": queued,
+            "active": active,
+            **stats,
+            "wait_avg": stats["wait_total"] / started if started else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+            "run_avg": stats["run_total"] / stats["completed"] if stats["completed"] else 0.0,
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int | None = None) -> BoundedExecutor:
+    """名前ごとのプールを返す (初回だけ max_workers で作成する。省略時は DEFAULT_MAX_WORKERS)"""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                workers = max_workers or DEFAULT_MAX_WORKERS.get(name, 8)
+                executor = _executors[name] = BoundedExecutor(name, workers)
+                logger.info("Executor '%s' initialized (max_workers=%s).", name, workers)
+    return executor
+
+
+def snapshot_executors() -> dict:
+    """全プールのキューの長さ・待ち時間・実行時間"""
+    return {name: executor.snapshot() for name, executor in list(_executors.items())}
+
+
+def shutdown_executors() -> None:
+    for executor in list(_executors.values()):
+        executor.shutdown()
+    _executors.clear()
@@ -0,0 +1,84 @@
+"""
+検索レスポンスの高速な JSON 化。
+
+FastAPI は dict を返すと店舗ごとに jsonable_encoder を通し、response_model があれば Pydantic で検証し直す。
+店舗レコードはアプリ内で組み立てた信頼できるデータなので、FastJSONResponse を直接返してこれらを省き、
+orjson (無い環境では標準の json) でそのままバイト列にする。
+
+結果を丸ごとキャッシュする場合は SerializedPayload を保存すると、JSON 化したバイト列も一緒に保持されるため、
+キャッシュヒット時は JSON 化も省ける。
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson はオプション
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(value: Any):
+    """orjson / json がそのまま扱えない値の変換"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """content を UTF-8 の JSON バイト列にする"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes | str) -> Any:
+    """dumps で作ったバイト列を戻す"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SerializedPayload:
+    """レスポンスの内容と、初回に JSON 化したバイト列を一緒に持つ"""
+    __slots__ = ("content", "_body")
+
+    def __init__(self, content: Any, body: bytes | None = None):
+        self.content = content
+        self._body = body
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = dumps(self.content)
+        return self._body
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    jsonable_encoder と response_model の検証を通さずに返す JSON レスポンス。
+    content には dict などのほか、SerializedPayload や JSON 化済みの bytes も渡せる。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, SerializedPayload):
+            return content.body
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
@@ -0,0 +1,102 @@
+import math
+
+# Web メルカトルのタイル1枚 (256px) が経度方向に覆う範囲は 360 / 2^zoom 度。
+# クラスタリング用のセルはタイルの1/4 (約64px) を1セルとする。
+CELLS_PER_TILE = 4
+MIN_ZOOM = 0
+MAX_ZOOM = 21
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def clamp_zoom(zoom: int) -> int:
+    """ズームレベルを有効範囲に丸める"""
+    return max(MIN_ZOOM, min(MAX_ZOOM, int(zoom)))
+
+
+def cell_size_for_zoom(zoom: int) -> float:
+    """ズームレベルに対応するグリッドセルの一辺 (度) を返す"""
+    return 360.0 / (2 ** clamp_zoom(zoom)) / CELLS_PER_TILE
+
+
+def cell_index(lat: float, lng: float, cell_size: float) -> tuple[int, int]:
+    """緯度経度が属するグリッドセルの整数インデックス (行, 列) を返す"""
+    return math.floor(lat / cell_size), math.floor(lng / cell_size)
+
+
+def cell_key(lat: float, lng: float, cell_size: float) -> str:
+    """キャッシュキーなどに使えるセルの文字列表現を返す"""
+    row, col = cell_index(lat, lng, cell_size)
+    return f"{cell_size:.6f}:{row}:{col}"
+
+
+def cell_center(row: int, col: int, cell_size: float) -> tuple[float, float]:
+    """セルの中心座標 (lat, lng) を返す"""
+    return (row + 0.5) * cell_size, (col + 0.5) * cell_size
+
+
+def count_cells_in_bbox(south: float, west: float, north: float, east: float, cell_size: float) -> int:
+    """バウンディングボックスが跨るセル数を返す"""
+    south_row, west_col = cell_index(south, west, cell_size)
+    north_row, east_col = cell_index(north, east, cell_size)
+    return (north_row - south_row + 1) * (east_col - west_col + 1)
+
+
+def validate_bbox(south: float, west: float, north: float, east: float) -> None:
+    """バウンディングボックスの値を検証する。不正な場合は ValueError"""
+    if not (-90.0 <= south <= 90.0 and -90.0 <= north <= 90.0):
+        raise ValueError("緯度は -90 から 90 の範囲で指定してください。")
+    if not (-180.0 <= west <= 180.0 and -180.0 <= east <= 180.0):
+        raise ValueError("経度は -180 から 180 の範囲で指定してください。")
+    if south >= north or west >= east:
+        raise ValueError("south < north かつ west < east となるように範囲を指定してください。")
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """2点間の大円距離 (km)。geodesic より粗いが大量計算向けに高速"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cluster_shops(shops: list[dict], cell_size: float) -> list[dict]:
+    """店舗リストをグリッドセル単位で集約する (件数・重心・最高評価)
+
+    DB側の集約関数が使えない場合のフォールバック用。
+    """
+    buckets: dict[tuple[int, int], list] = {}
+    for shop in shops:
+        lat = shop.get('lat')
+        lng = shop.get('lng')
+        if lat is None or lng is None:
+            continue
+        lat = float(lat)
+        lng = float(lng)
+        key = cell_index(lat, lng, cell_size)
+        bucket = buckets.get(key)
+        if bucket is None:
+            # [件数, 緯度合計, 経度合計, 最高評価]
+            bucket = buckets[key] = [0, 0.0, 0.0, None]
+        bucket[0] += 1
+        bucket[1] += lat
+        bucket[2] += lng
+        rating = shop.get('rating')
+        if rating is not None:
+            rating = float(rating)
+            if bucket[3] is None or rating > bucket[3]:
+                bucket[3] = rating
+
+    return [
+        {
+            "cell_row": row,
+            "cell_col": col,
+            "count": count,
+            "lat": lat_sum / count,
+            "lng": lng_sum / count,
+            "best_rating": best_rating,
+        }
+        for (row, col), (count, lat_sum, lng_sum, best_rating) in buckets.items()
+    ]
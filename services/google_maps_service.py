@@ -1,11 +1,40 @@
 import googlemaps
 import logging
+from functools import partial
+from .circuit_breaker import get_breaker, CircuitOpenError
+from .hedging import Hedger
+from .shared_cache import TieredCache, make_key
 
 logger = logging.getLogger(__name__)
 
+GOOGLE_MAPS_BREAKER = "google_maps"
+# 上流は応答しているので、障害としては数えない API エラーのステータス
+_CLIENT_ERROR_STATUSES = ("INVALID_REQUEST", "NOT_FOUND", "ZERO_RESULTS")
+# 共有キャッシュ (services/shared_cache.py) に応答を置く秒数
+CACHE_TTL_SECONDS = {
+    "geocode": 7 * 24 * 3600,
+    "text_search": 6 * 3600,
+    "nearby_search": 6 * 3600,
+    "place_details": 24 * 3600,
+}
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status not in _CLIENT_ERROR_STATUSES
+    return True
+
+
 class GoogleMapsService:
     """Google Maps API とのやり取りを担当するサービスクラス"""
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, breaker_options: dict | None = None, hedge_place_details: bool = False,
+                 hedge_options: dict | None = None, base_url: str | None = None, cache: TieredCache | None = None):
+        # 障害時は呼び出しを即座に打ち切り、呼び出し元が DB のみの結果に切り替えられるようにする
+        self.breaker = get_breaker(GOOGLE_MAPS_BREAKER, is_failure=_is_upstream_failure, **(breaker_options or {}))
+        # Place Details は p95 を過ぎたら重複発行し、先に返った方を使う (オプション)
+        self.details_hedger = Hedger("place_details", **(hedge_options or {})) if hedge_place_details else None
+        # 同じ引数の呼び出しはインスタンス間で共有するキャッシュから返す (エラーはキャッシュしない)
+        self.caches = {name: cache.namespace(name, ttl) for name, ttl in CACHE_TTL_SECONDS.items()} if cache else {}
         if not api_key:
             logger.error("Google Maps API Key is not provided.")
             # APIキーがない場合、クライアントを初期化しないか、エラーを発生させる
@@ -13,7 +42,9 @@ class GoogleMapsService:
             self.client = None
             logger.warning("GoogleMapsService initialized without a client due to missing API key.")
         else:
-            self.client = googlemaps.Client(key=api_key) # 実際のクライアント初期化
+            # base_url は接続先をローカルの代替サーバーなどに向ける場合だけ指定する
+            client_options = {"base_url": base_url.rstrip('/')} if base_url else {}
+            self.client = googlemaps.Client(key=api_key, **client_options) # 実際のクライアント初期化
             logger.info("GoogleMapsService initialized successfully.")
 
     def _check_client(self):
@@ -23,63 +54,84 @@ class GoogleMapsService:
             # 例外を発生させて処理を中断させる
             raise ValueError("Google Maps client is not available due to missing API key.")
 
+    def _cached(self, name: str, key_parts: tuple, fetch):
+        namespace = self.caches.get(name)
+        if namespace is None:
+            return fetch()
+        return namespace.get_or_compute(make_key(*key_parts), fetch)
+
     def geocode(self, address):
         """住所から緯度経度を取得する"""
         self._check_client() # クライアントが利用可能かチェック
-        logger.info(f"Geocoding address: {address}")
+        logger.info("Geocoding address: %s", address)
         try:
-            result = self.client.geocode(address, language='ja') # 日本語結果を優先
-            logger.debug(f"Geocode result for {address}: {result}")
+            result = self._cached("geocode", (address, 'ja'),
+                                  lambda: self.breaker.call(self.client.geocode, address, language='ja')) # 日本語結果を優先
+            logger.debug("Geocode result for %s: %s", address, result)
             return result
+        except CircuitOpenError:
+            raise
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps Geocoding API error for '{address}': {e}")
+            logger.error("Google Maps Geocoding API error for '%s': %s", address, e)
             raise # エラーを呼び出し元に伝播させる
         except Exception as e:
-            logger.error(f"Unexpected error during geocoding for '{address}': {e}", exc_info=True)
+            logger.error("Unexpected error during geocoding for '%s': %s", address, e, exc_info=True)
             raise
 
     def text_search(self, query, language='ja'):
         """テキストクエリで場所を検索する"""
         self._check_client()
-        logger.info(f"Text searching for: '{query}' with language '{language}'")
+        logger.info("Text searching for: '%s' with language '%s'", query, language)
         try:
-            result = self.client.places(query=query, language=language)
-            logger.debug(f"Text search result for '{query}': {len(result.get('results', []))} places found.")
+            result = self._cached("text_search", (query, language),
+                                  lambda: self.breaker.call(self.client.places, query=query, language=language))
+            logger.debug("Text search result for '%s': %s places found.", query, len(result.get('results', [])))
             return result
+        except CircuitOpenError:
+            raise
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps Text Search API error for query '{query}': {e}")
+            logger.error("Google Maps Text Search API error for query '%s': %s", query, e)
             raise
         except Exception as e:
-            logger.error(f"Unexpected error during text search for '{query}': {e}", exc_info=True)
+            logger.error("Unexpected error during text search for '%s': %s", query, e, exc_info=True)
             raise
 
     def nearby_search(self, location, radius, type=None, keyword=None, language='ja'):
         """指定地点の周辺を検索する"""
         self._check_client()
         # location は (lat, lng) のタプルであることを想定
-        logger.info(f"Nearby search at {location} (radius: {radius}, type: {type}, keyword: {keyword}, lang: {language})")
+        logger.info("Nearby search at %s (radius: %s, type: %s, keyword: %s, lang: %s)", location, radius, type, keyword, language)
         try:
-            result = self.client.places_nearby(location=location, radius=radius, type=type, keyword=keyword, language=language)
-            logger.debug(f"Nearby search result for {location}: {len(result.get('results', []))} places found.")
+            result = self._cached("nearby_search", (location, radius, type, keyword, language),
+                                  lambda: self.breaker.call(self.client.places_nearby, location=location, radius=radius, type=type, keyword=keyword, language=language))
+            logger.debug("Nearby search result for %s: %s places found.", location, len(result.get('results', [])))
             return result
+        except CircuitOpenError:
+            raise
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps Nearby Search API error: {e}")
+            logger.error("Google Maps Nearby Search API error: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Unexpected error during nearby search at {location}: {e}", exc_info=True)
+            logger.error("Unexpected error during nearby search at %s: %s", location, e, exc_info=True)
             raise
 
-    def place_details(self, place_id, fields, language='ja'):
-        """場所の詳細情報を取得する"""
+    def place_details(self, place_id, fields, language='ja', reviews_sort='most_relevant'):
+        """場所の詳細情報を取得する (reviews_sort='newest' で新しい順のレビューを取得)"""
         self._check_client()
-        logger.info(f"Fetching details for place_id: {place_id} (fields: {fields}, lang: {language})")
+        logger.debug("Fetching details for place_id: %s (fields: %s, lang: %s, reviews_sort: %s)", place_id, fields, language, reviews_sort)
         try:
-            result = self.client.place(place_id=place_id, fields=fields, language=language)
-            logger.debug(f"Place details result for {place_id}: {result.get('result', {}).get('name')}")
+            place = self.client.place
+            if self.details_hedger is not None:
+                place = partial(self.details_hedger.call, self.client.place)
+            result = self._cached("place_details", (place_id, fields, language, reviews_sort),
+                                  lambda: self.breaker.call(place, place_id=place_id, fields=fields, language=language, reviews_sort=reviews_sort))
+            logger.debug("Place details result for %s: %s", place_id, result.get('result', {}).get('name'))
             return result
+        except CircuitOpenError:
+            raise
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps Place Details API error for {place_id}: {e}")
+            logger.error("Google Maps Place Details API error for %s: %s", place_id, e)
             raise
         except Exception as e:
-            logger.error(f"Unexpected error during place details fetch for {place_id}: {e}", exc_info=True)
+            logger.error("Unexpected error during place details fetch for %s: %s", place_id, e, exc_info=True)
             raise
\ No newline at end of file
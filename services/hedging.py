@@ -0,0 +1,188 @@
+"""
+リクエストのヘッジング (テールレイテンシ対策)。
+
+呼び出しが観測済みレイテンシの p95 を過ぎても返らない場合に同じ呼び出しをもう1つ発行し、先に返った方を使う。
+重複発行は予算 (全呼び出しに対する割合) の範囲内に限り、コストが上限を超えないようにする。
+外部 API のクライアント (googlemaps など) は同期なので、呼び出しは専用のスレッドプールで実行する。
+先に返らなかった方は取り消し、実行中で止められない場合も結果・例外を回収して捨てる。
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_BUDGET_RATIO = 0.05 # 重複発行は全呼び出しの5%まで
+DEFAULT_WINDOW_SIZE = 200 # 遅延の基準に使う直近のレイテンシ数
+DEFAULT_MIN_SAMPLES = 20 # これ未満のサンプル数ではヘッジしない
+DEFAULT_MIN_DELAY_SECONDS = 0.05
+DEFAULT_MAX_WORKERS = 16
+
+
+class LatencyTracker:
+    """直近のレイテンシを保持し、パーセンタイルを返す"""
+
+    def __init__(self, window_size: int = DEFAULT_WINDOW_SIZE):
+        self._lock = threading.Lock()
+        self._samples: deque[float] = deque(maxlen=window_size)
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _discard(futures) -> None:
+    """使わない方の呼び出しを取り消す。実行中で取り消せないものは、終わったときに例外を回収して捨てる"""
+    for future in futures:
+        if not future.cancel():
+            future.add_done_callback(_consume_result)
+
+
+def _consume_result(future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+class Hedger:
+    """p95 を過ぎた呼び出しを予算の範囲で重複発行し、先に返った結果を使う"""
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = DEFAULT_PERCENTILE,
+        budget_ratio: float = DEFAULT_BUDGET_RATIO,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        min_delay: float = DEFAULT_MIN_DELAY_SECONDS,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker(window_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "budget_denied": 0}
+
+    def hedge_delay(self) -> float | None:
+        """重複発行までの待ち時間。サンプルが足りない間は None (ヘッジしない)"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        delay = self.latencies.percentile(self.percentile)
+        return max(self.min_delay, delay) if delay is not None else None
+
+    def _acquire_budget(self) -> bool:
+        with self._lock:
+            if self._stats["hedged"] + 1 > self.budget_ratio * self._stats["calls"]:
+                self._stats["budget_denied"] += 1
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def _record(self, key: str, started: float) -> None:
+        self.latencies.observe(time.perf_counter() - started)
+        with self._lock:
+            self._stats[key] += 1
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        同期呼び出しをヘッジ付きで実行する。
+        呼び出し元のスレッドは結果が返るまでブロックするため、services/executors.py のプールなどワーカーのスレッドから呼ぶ
+        (イベントループのスレッドからは呼べない。acall を使う)
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(f"Hedger.call ({self.name}) blocks the calling thread; use acall on the event loop.")
+        with self._lock:
+            self._stats["calls"] += 1
+        started = time.perf_counter()
+        delay = self.hedge_delay()
+        primary = self.executor.submit(func, *args, **kwargs)
+        if delay is None:
+            result = primary.result()
+            self._record("primary_wins", started)
+            return result
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire_budget():
+            result = primary.result()
+            self._record("primary_wins", started)
+            return result
+
+        logger.debug("Hedging %s call after %.3fs.", self.name, delay)
+        hedge = self.executor.submit(func, *args, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    _discard((done | pending) - {future})
+                    self._record("hedge_wins" if future is hedge else "primary_wins", started)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acall(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """同期呼び出しをスレッドプールで実行し、イベントループをブロックせずにヘッジ付きで待つ"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._stats["calls"] += 1
+        started = time.perf_counter()
+        delay = self.hedge_delay()
+        primary = loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+        if delay is None:
+            result = await primary
+            self._record("primary_wins", started)
+            return result
+
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self._acquire_budget():
+            result = await primary
+            self._record("primary_wins", started)
+            return result
+
+        logger.debug("Hedging %s call after %.3fs.", self.name, delay)
+        hedge = loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    _discard((done | pending) - {future})
+                    self._record("hedge_wins" if future is hedge else "primary_wins", started)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        hedged = stats["hedged"]
+        return {
+            **stats,
+            "hedge_rate": hedged / stats["calls"] if stats["calls"] else 0.0,
+            "hedge_win_rate": stats["hedge_wins"] / hedged if hedged else 0.0,
+            "p95_seconds": self.latencies.percentile(self.percentile),
+        }
@@ -0,0 +1,209 @@
+"""
+検索レスポンスの HTTP キャッシュ (ETag / Cache-Control)。
+
+- レスポンスの本文から強い ETag を作り、If-None-Match が一致すれば 304 を返す
+- Cache-Control に max-age / s-maxage を付け、Vercel のエッジで同じ URL の繰り返しを返せるようにする
+- 検索条件を正規化したキー (座標はセル、キーワードは表記ゆれを吸収した文字列) ごとに、発行した ETag と
+  結果が依存するセルのデータバージョンを覚えておき、バージョンが変わっていなければ検索せずに 304 を返す
+- _save_results_to_db が店舗を書き込むと、その店舗のセルのバージョンを上げて (DataVersionRegistry.bump_points)
+  そのセルに依存する ETag を無効にする
+
+DB の cell_versions テーブル (supabase/migrations/20261019000200_cell_versions.sql) を渡すと、バージョンは
+jongso_shops のトリガーが上げる値になり、インスタンス間で共有される (last_fetched_at などの記録用の列だけが
+変わった upsert では上がらない)。読み取った値は ttl 秒だけ使い回すため、
+別インスタンスで書き込まれた変更は最大 ttl 秒遅れて反映される (自インスタンスの書き込みは即座に反映される)。
+渡さない場合はプロセス内のバージョンだけを使う。
+"""
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Iterable
+
+from .geo_grid import cell_size_for_zoom, cell_index, cell_center
+
+logger = logging.getLogger(__name__)
+
+QUERY_CELL_ZOOM = 17 # 検索地点を丸めるセルの粒度 (約76m四方)
+VERSION_CELL_ZOOM = 13 # データバージョンを管理するセルの粒度 (約1.2km四方)
+DEFAULT_MAX_ENTRIES = 10_000 # 覚えておく ETag の最大数
+MAX_TRACKED_CELLS = 64 # 1つの結果が依存するセルの最大数。超える結果 (全国に散らばるキーワード検索など) はバージョンで管理しない
+DEFAULT_VERSION_TTL_SECONDS = 5.0 # DB から読んだセルのバージョンを使い回す秒数
+
+
+def strong_etag(body: bytes) -> str:
+    """本文のハッシュから強い ETag を作る (本文が同じならどのインスタンスでも同じ値になる)"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match ヘッダーに etag が含まれるか (弱い比較。* はすべてに一致)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def normalize_keyword(keyword: str) -> str:
+    """全角・半角、大文字・小文字、空白の違いを吸収したキーワード"""
+    return " ".join(unicodedata.normalize("NFKC", keyword).lower().split())
+
+
+def snap_to_cell(latitude: float, longitude: float, zoom: int = QUERY_CELL_ZOOM) -> tuple[float, float]:
+    """座標をセルの中心に丸める (同じセル内の検索は同じ URL・同じ結果になる)"""
+    cell_size = cell_size_for_zoom(zoom)
+    lat, lng = cell_center(*cell_index(latitude, longitude, cell_size), cell_size)
+    return round(lat, 6), round(lng, 6)
+
+
+def cache_control(max_age: int, s_maxage: int, stale_while_revalidate: int) -> str:
+    return f"public, max-age={max_age}, s-maxage={s_maxage}, stale-while-revalidate={stale_while_revalidate}"
+
+
+class DataVersionRegistry:
+    """
+    セルごとのデータバージョン。店舗の書き込みでセルのバージョンを上げる。
+    store (services/data_access.py の CellVersionRepository) を渡すと DB のバージョンを正とする。
+    """
+
+    def __init__(self, zoom: int = VERSION_CELL_ZOOM, store=None, ttl: float = DEFAULT_VERSION_TTL_SECONDS):
+        self.zoom = zoom
+        self.cell_size = cell_size_for_zoom(zoom)
+        self.store = store
+        self.ttl = ttl
+        self._versions: dict[tuple[int, int], int] = {}
+        self._fetched_at: dict[tuple[int, int], float] = {}
+        self._lock = threading.Lock()
+        self.bumps = 0
+        self.remote_reads = 0
+        self.remote_errors = 0
+
+    def cells_for_points(self, points: Iterable[tuple[float, float]]) -> set[tuple[int, int]]:
+        """点 (結果の店舗と検索地点) を含むセル"""
+        return {cell_index(lat, lng, self.cell_size) for lat, lng in points if lat is not None and lng is not None}
+
+    async def refresh(self, cells: Iterable[tuple[int, int]]) -> None:
+        """ttl 秒以上前に読んだ (または未読の) セルのバージョンを DB から読み直す。store が無ければ何もしない"""
+        if self.store is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            expired = [cell for cell in cells if now - self._fetched_at.get(cell, float("-inf")) >= self.ttl]
+        if not expired:
+            return
+        try:
+            remote = await self.store.for_cells(self.zoom, expired)
+        except Exception as e:
+            # 読めなかった場合は手元の値を使い、ttl 秒後に再び読む
+            logger.warning("Could not read cell versions (%s cells): %s", len(expired), e)
+            with self._lock:
+                self.remote_errors += 1
+                for cell in expired:
+                    self._fetched_at[cell] = now
+            return
+        with self._lock:
+            self.remote_reads += 1
+            for cell in expired:
+                self._versions[cell] = remote.get(cell, 0)
+                self._fetched_at[cell] = now
+
+    def versions(self, cells: Iterable[tuple[int, int]]) -> dict[tuple[int, int], int]:
+        """手元のバージョン (DB を使う場合は先に refresh を呼ぶ)"""
+        with self._lock:
+            return {cell: self._versions.get(cell, 0) for cell in cells}
+
+    async def current(self, cells: Iterable[tuple[int, int]]) -> dict[tuple[int, int], int]:
+        """必要なら DB から読み直したうえで、セルの現在のバージョンを返す"""
+        cells = list(cells)
+        await self.refresh(cells)
+        return self.versions(cells)
+
+    async def versions_for_points(self, points: Iterable[tuple[float, float]]) -> dict[tuple[int, int], int] | None:
+        """
+        点を含むセルの現在のバージョン (キャッシュに結果と一緒に保存する)。
+        セルが MAX_TRACKED_CELLS を超える場合は None (その結果はキャッシュしない)
+        """
+        cells = self.cells_for_points(points)
+        if len(cells) > MAX_TRACKED_CELLS:
+            return None
+        return await self.current(cells)
+
+    def bump_points(self, points: Iterable[tuple[float, float]]) -> set[tuple[int, int]]:
+        """
+        書き込まれた店舗の座標を受け取り、そのセルのバージョンを上げる。
+        DB を使う場合はトリガーが DB 側の値を上げているため、次の refresh で読み直すようにする。
+        """
+        cells = {cell_index(lat, lng, self.cell_size) for lat, lng in points if lat is not None and lng is not None}
+        with self._lock:
+            for cell in cells:
+                self._versions[cell] = self._versions.get(cell, 0) + 1
+                self._fetched_at.pop(cell, None)
+            self.bumps += len(cells)
+        if cells:
+            logger.debug("Bumped data version of %s cells.", len(cells))
+        return cells
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "db" if self.store is not None else "memory",
+                "cells": len(self._versions),
+                "bumps": self.bumps,
+                "remote_reads": self.remote_reads,
+                "remote_errors": self.remote_errors,
+            }
+
+
+class ETagIndex:
+    """正規化した検索キー -> (ETag, 依存するセルのバージョン)。LRU で件数を制限する"""
+
+    def __init__(self, versions: DataVersionRegistry, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.data_versions = versions
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"not_modified_without_search": 0, "not_modified_after_search": 0, "full_responses": 0, "stale_entries": 0,
+                       "untracked": 0}
+
+    async def current_etag(self, key: str) -> str | None:
+        """依存するセルのバージョンが変わっていなければ、前回発行した ETag を返す"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        etag, versions = entry
+        if await self.data_versions.current(versions) != versions:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._stats["stale_entries"] += 1
+            return None
+        return etag
+
+    async def store(self, key: str, etag: str, points: Iterable[tuple[float, float]]) -> None:
+        """ETag と、結果の店舗・検索地点を含むセルの現在のバージョンを記録する (セルが多すぎる結果は記録しない)"""
+        versions = await self.data_versions.versions_for_points(points)
+        if versions is None:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._stats["untracked"] += 1
+            return
+        with self._lock:
+            self._entries[key] = (etag, versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, outcome: str) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+            stats = dict(self._stats)
+        return {"entries": entries, "data_versions": self.data_versions.snapshot(), **stats}
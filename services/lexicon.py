@@ -0,0 +1,76 @@
+"""
+語彙ベースの簡易分類器。LLM を呼ぶ前の最も安い段として使い、結果と確信度を返す。
+"""
+from .review_store import detect_smoking_signal
+
+POSITIVE_WORDS = ("良い", "よい", "良かった", "親切", "丁寧", "綺麗", "きれい", "清潔", "快適", "楽しい", "楽しめ",
+                  "おすすめ", "オススメ", "最高", "満足", "また行きたい", "居心地が良", "優しい", "安心")
+NEGATIVE_WORDS = ("悪い", "最悪", "汚い", "汚れ", "臭い", "くさい", "不快", "態度が悪", "うるさい", "二度と",
+                  "残念", "ひどい", "酷い", "不親切", "狭い", "行かない", "イライラ")
+
+# ポジティブな語の直後にこれらが続く場合は否定されているとみなす (「綺麗ではない」「満足できなかった」など)。
+# ネガティブな語は「行かない」「二度と」のように否定の形を含むため対象にしない
+NEGATION_SUFFIXES = ("ない", "なく", "なかった", "ません", "ず")
+NEGATION_WINDOW = 5 # 語の直後の何文字以内に否定があれば否定とみなすか
+# ポジティブとネガティブの語が混ざる・否定されたポジティブな語がある場合の確信度の上限。
+# 語の数だけではカスケードの閾値 (services/model_cascade.py の 0.75) に届かないようにし、LLM に回す
+MIXED_MAX_CONFIDENCE = 0.5
+
+# 喫煙に触れているかの判定に使う語。区分の判定 (SMOKING_SIGNAL_KEYWORDS) より広く取り、
+# 区分を判断できない記述 (「タバコが吸えます」など) は確信度を下げて LLM に回す
+SMOKING_MENTION_TERMS = ("タバコ", "たばこ", "煙草", "喫煙", "禁煙", "分煙", "吸", "煙", "スモーク", "スモーキング")
+
+
+def _count_hits(text: str, words: tuple[str, ...]) -> tuple[int, int]:
+    """(語の出現数, そのうち否定されているものの数) を返す"""
+    hits = negated = 0
+    for word in words:
+        start = text.find(word)
+        while start != -1:
+            hits += 1
+            following = text[start + len(word):start + len(word) + NEGATION_WINDOW]
+            if any(suffix in following for suffix in NEGATION_SUFFIXES):
+                negated += 1
+            start = text.find(word, start + len(word))
+    return hits, negated
+
+
+def lexicon_sentiment(text: str) -> tuple[int | None, float]:
+    """
+    ポジティブ度 (0〜10) と確信度 (0〜1) を返す。
+    手がかりとなる語が多く、かつ一方に偏っているほど確信度が高い。
+    ポジティブとネガティブの語が混ざっている場合や否定されたポジティブな語がある場合は、語の数によらず MIXED_MAX_CONFIDENCE までにする。
+    """
+    positive, negated = _count_hits(text, POSITIVE_WORDS)
+    negative = sum(text.count(word) for word in NEGATIVE_WORDS)
+    # 否定されたポジティブな語はネガティブな語として数える
+    positive, negative = positive - negated, negative + negated
+    hits = positive + negative
+    if hits == 0:
+        return None, 0.0
+    balance = (positive - negative) / hits
+    score = round(5 + 5 * balance)
+    confidence = min(0.95, 0.35 + 0.15 * hits) * abs(balance)
+    if (positive and negative) or negated:
+        confidence = min(confidence, MIXED_MAX_CONFIDENCE)
+    return score, confidence
+
+
+def lexicon_smoking(texts: list[str]) -> tuple[str, float]:
+    """
+    レビュー群から喫煙状況と確信度を返す。
+    喫煙に関する記述が全く無ければ「不明」を高い確信度で返し、手がかりが食い違う場合は確信度を下げる。
+    """
+    mentions = [text for text in texts if text and any(term in text for term in SMOKING_MENTION_TERMS)]
+    if not mentions:
+        return "不明", 0.95
+
+    signals = [signal for signal in (detect_smoking_signal(text) for text in mentions) if signal]
+    if not signals:
+        # 「煙」などの語はあるが区分を判断できない
+        return "不明", 0.2
+
+    top = max(set(signals), key=signals.count)
+    agreement = signals.count(top) / len(signals)
+    confidence = min(0.9, 0.45 + 0.15 * len(signals)) * agreement
+    return top, confidence
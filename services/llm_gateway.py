@@ -0,0 +1,105 @@
+"""
+OpenAI への非同期アクセスを一本化するゲートウェイ。
+
+プロセス内で1つの AsyncOpenAI クライアント (キープアライブ付きの httpx コネクションプール) を共有し、
+タイムアウト・同時実行数の上限・ストリーミングをまとめて扱う。
+"""
+import asyncio
+import logging
+from typing import AsyncIterator
+
+import httpx
+import openai
+
+from .circuit_breaker import get_breaker
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BREAKER = "openai"
+
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY_SECONDS = 30.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """リクエスト内容の誤り (4xx) は障害として数えない。レート制限・タイムアウト・5xx は障害"""
+    if isinstance(error, openai.RateLimitError):
+        return True
+    return not isinstance(error, openai.APIStatusError) or error.status_code >= 500
+
+
+class LLMGateway:
+    """共有コネクションプールを持つ AsyncOpenAI のラッパー"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str | None = None,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_SECONDS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        breaker_options: dict | None = None,
+    ):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_client,
+            max_retries=max_retries,
+        )
+        # プールを使い切って待ち続けないよう、同時に送るリクエスト数を制限する
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 障害中は待たずに CircuitOpenError を返し、呼び出し元が既存のデータで応答できるようにする
+        self.breaker = get_breaker(OPENAI_BREAKER, is_failure=_is_upstream_failure, **(breaker_options or {}))
+        logger.info("LLMGateway initialized (max_connections=%s, timeout=%ss, max_concurrency=%s).", max_connections, timeout, max_concurrency)
+
+    async def chat(self, **kwargs):
+        """chat.completions.create を非同期で実行する"""
+        async with self._semaphore:
+            return await self.breaker.acall(self.client.chat.completions.create, **kwargs)
+
+    async def stream_chat(self, **kwargs) -> AsyncIterator[str]:
+        """chat.completions.create をストリーミングで実行し、本文の差分を順に返す"""
+        async with self._semaphore:
+            stream = await self.breaker.acall(self.client.chat.completions.create, stream=True, **kwargs)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+
+_gateways: dict[tuple, LLMGateway] = {}
+
+
+def get_gateway(api_key: str, base_url: str | None = None, **options) -> LLMGateway:
+    """同じ API キー・接続先のゲートウェイをプロセス内で共有する"""
+    key = (api_key, base_url)
+    gateway = _gateways.get(key)
+    if gateway is None:
+        gateway = _gateways[key] = LLMGateway(api_key, base_url=base_url, **options)
+    return gateway
+
+
+async def close_gateways() -> None:
+    """共有しているゲートウェイをすべて閉じる (アプリ終了時)"""
+    for gateway in list(_gateways.values()):
+        await gateway.aclose()
+    _gateways.clear()
@@ -1,18 +1,70 @@
+import asyncio
 import logging
+import math
+from contextvars import ContextVar
 import googlemaps
 from fastapi import HTTPException
 from geopy.distance import geodesic
 from datetime import datetime, timezone, timedelta # timedelta を追加
-from postgrest.exceptions import APIError
 # 外部サービスのインポートパスはプロジェクト構造に合わせて調整が必要
 # from .google_maps_service import GoogleMapsService
 # from .sentiment_analysis_service import SentimentAnalysisService
 # from supabase import Client
-from supabase import Client
 # from supabase_async import AsyncClient # 非同期クライアントをインポート
+from .geo_grid import cell_size_for_zoom, count_cells_in_bbox, validate_bbox, cluster_shops, cell_index, cell_center, haversine_km
+from .adaptive_radius import CellDensityCache, DEFAULT_RADIUS_M, next_radius
+from .ranking import rank_results, DEFAULT_RANKING
+from .review_store import ReviewStore, review_hash, detect_smoking_signal
+from .circuit_breaker import get_breaker, CircuitOpenError
+from .google_maps_service import GOOGLE_MAPS_BREAKER
+from .llm_gateway import OPENAI_BREAKER
+from .data_access import PostgrestPool, JongsoShopRepository, StationShopRepository, DataAccessError
+from .http_cache import DataVersionRegistry, normalize_keyword
+from .shop_record import ShopRecord
+from .shared_cache import TieredCache, make_key
+from .executors import get_executor, GOOGLE_EXECUTOR
 
 logger = logging.getLogger(__name__)
 
+# ビューポート検索の設定
+BBOX_INDIVIDUAL_MIN_ZOOM = 15 # このズーム以上では個別店舗を返す
+BBOX_MAX_MARKERS = 100 # 個別店舗として返す最大件数 (超える場合はクラスタ表示)
+BBOX_MAX_CLUSTERS = 200 # クラスタとして返す最大セル数
+# 集約関数が使えない場合にアプリ側で集約するため取得する最大行数。
+# 集約関数と同じく取得量を上限で抑える (超える場合のクラスタの件数は概数になる)
+BBOX_FALLBACK_MAX_ROWS = BBOX_MAX_CLUSTERS * 25
+BBOX_SHOP_COLUMNS = "place_id, name, address, lat, lng, rating, user_ratings_total, smoking_status, positive_score, negative_score, summary, last_fetched_at"
+
+# レビュー再分析の設定
+REVIEW_REFRESH_DAYS = 30 # last_fetched_at がこれより古い店舗はレビューを取り直す
+
+# 適応半径検索の設定
+ADAPTIVE_MAX_ATTEMPTS = 3 # 件数不足時に半径を広げて再検索する最大回数 (初回含む)
+
+# バッチ検索の設定
+BATCH_MAX_INPUTS = 25 # 1リクエストで受け付ける地点・キーワードの合計数
+BATCH_CELL_ZOOM = 15 # 近接地点をまとめるセルの粒度 (約300m四方)
+DB_DETAIL_COLUMNS = "place_id, smoking_status, last_fetched_at, positive_score, negative_score, summary"
+
+# 駅の近傍店舗 (station_nearest_shops、supabase/migrations/20261019000100_station_nearest_shops.sql) の設定
+STATION_NEAREST_K = 20 # 駅ごとに保持している店舗数 (マイグレーションの k と合わせる)
+STATION_SNAP_M = 150 # 検索地点からこの距離以内に駅があれば、駅の近傍店舗で応答する
+STATION_SUFFIX = "駅"
+
+# 周辺検索の結果の共有キャッシュ (services/shared_cache.py) の設定
+SEARCH_CACHE_TTL_SECONDS = 24 * 3600 # データバージョンが変われば期限前でも作り直す
+
+# 縮退モード (Google / OpenAI のブレーカーが open の間、DBの情報だけで応答する) の設定
+DEGRADED_MAX_RESULTS = 60 # DBから取得する最大件数
+
+# 現在のリクエストを縮退モードで処理したか (api/index.py がレスポンスの degraded に使う)
+_degraded = ContextVar("degraded", default=False)
+
+
+def response_degraded() -> bool:
+    """現在のリクエストで、上流を呼ばずにDBの情報だけで応答した結果があれば True"""
+    return _degraded.get()
+
 # --- 仮の Service クラス定義 ---
 # 依存関係エラーを避けるため、一時的にダミークラスを定義
 # 実際の Service クラスが別ファイルにある場合はそちらをインポートする
@@ -54,59 +106,105 @@ class Client:
 
 class LocationService:
     # 実際の Service クラスや Client を受け取るように修正が必要
-    def __init__(self, maps_service: GoogleMapsService, sentiment_service: SentimentAnalysisService, db_client: Client):
+    def __init__(self, maps_service: GoogleMapsService, sentiment_service: SentimentAnalysisService, db_pool: PostgrestPool | None,
+                 data_versions: DataVersionRegistry | None = None, cache: TieredCache | None = None):
         self.maps_service = maps_service
         self.sentiment_service = sentiment_service
-        self.db_client = db_client
+        # DBへのアクセスは共有プール上のリポジトリ経由で行う (services/data_access.py)
+        self.shops = JongsoShopRepository(db_pool) if db_pool else None
+        self.station_shops = StationShopRepository(db_pool) if db_pool else None
         logger.info("LocationService initialized with provided services.")
         self.walk_speed_km_per_hour = 4.8 # 徒歩速度 (km/h), 例: 80m/分 = 4.8km/h
+        self.density_cache = CellDensityCache() # 適応半径検索用のセル密度
+        self.review_store = ReviewStore(db_pool)
+        self.google_breaker = get_breaker(GOOGLE_MAPS_BREAKER)
+        self.llm_breaker = get_breaker(OPENAI_BREAKER)
+        # googlemaps は同期クライアントなので、イベントループを止めないよう google のプールで呼ぶ (services/executors.py)
+        self.google_executor = get_executor(GOOGLE_EXECUTOR)
+        # 店舗を書き込んだセルのバージョンを上げ、HTTP キャッシュの ETag を無効にする (services/http_cache.py)
+        self.data_versions = data_versions
+        # 周辺検索の結果の共有キャッシュ。無効化にデータバージョンを使うため、data_versions がある場合だけ使う
+        self.search_cache = cache.namespace("nearby_results", SEARCH_CACHE_TTL_SECONDS) if cache and data_versions else None
 
     async def _get_jongso_from_db(self, place_id: str) -> dict | None:
         """指定された place_id を持つ雀荘情報をDBから取得する"""
-        if not self.db_client:
+        if not self.shops:
             logger.warning("Supabase client is not available, skipping DB query.")
             return None
 
-        logger.debug(f"Querying DB for place_id: {place_id}")
+        logger.debug("Querying DB for place_id: %s", place_id)
         try:
-            response = self.db_client.table('jongso_shops') \
-                .select("place_id, smoking_status, last_fetched_at, positive_score, negative_score, summary") \
-                .eq('place_id', place_id) \
-                .maybe_single() \
-                .execute()
-
-            # response が None でなく、かつ data 属性を持つかチェック
-            if response and hasattr(response, 'data') and response.data:
-                logger.debug(f"Found DB record for {place_id}: {response.data}")
-                return response.data
-            else:
-                # レスポンスが期待通りでない場合 (None や data 無し含む)
-                logger.warning(f"No valid DB record found or unexpected response for {place_id}. Response: {response}")
-                return None
-        except APIError as e:
-            # maybe_single() で結果が0件の場合、PostgREST は 204 を返し、
-            # postgrest-py は APIError を発生させる。これはデータが無い正常ケースとして扱う。
-            if e.code == '204':
-                logger.warning(f"No DB record found for {place_id} (APIError 204 from maybe_single).")
-                return None
+            record = await self.shops.get(place_id, DB_DETAIL_COLUMNS)
+            if record:
+                logger.debug("Found DB record for %s: %s", place_id, record)
             else:
-                # それ以外の APIError は本来のエラーとしてログ出力
-                logger.error(f"APIError querying database for place_id {place_id}: {e}", exc_info=True)
-                return None
+                logger.debug("No DB record found for %s.", place_id)
+            return record
+        except DataAccessError as e:
+            logger.error("Error querying database for place_id %s: %s", place_id, e)
+            return None
         except Exception as e:
-            logger.error(f"Unexpected error querying database for place_id {place_id}: {e}", exc_info=True)
+            logger.error("Unexpected error querying database for place_id %s: %s", place_id, e, exc_info=True)
             return None
 
-    async def _process_place_details(self, place: dict, distanceKm: float | None = None, walkMinutes: int | None = None):
-        """Google Place の情報にDB情報やセンチメント分析結果、距離情報を追加する共通処理"""
+    async def _get_jongso_batch_from_db(self, place_ids: list) -> dict:
+        """複数の place_id の雀荘情報を1回のクエリでまとめて取得する (place_id -> レコード)"""
+        if not self.shops:
+            logger.warning("Supabase client is not available, skipping DB batch query.")
+            return {}
+        if not place_ids:
+            return {}
+
+        logger.debug("Querying DB for %s place_ids in one batch.", len(place_ids))
+        try:
+            return await self.shops.get_many(place_ids, DB_DETAIL_COLUMNS)
+        except DataAccessError as e:
+            logger.error("Error querying database for %s place_ids: %s", len(place_ids), e)
+            return {}
+        except Exception as e:
+            logger.error("Unexpected error querying database for %s place_ids: %s", len(place_ids), e, exc_info=True)
+            return {}
+
+    def _calculate_distance(self, origin: tuple, place: dict) -> tuple[float | None, int | None]:
+        """基準地点から店舗までの距離 (km) と徒歩時間 (分) を計算する"""
+        place_location_data = place.get('geometry', {}).get('location', {})
+        place_lat = place_location_data.get('lat')
+        place_lng = place_location_data.get('lng')
+        if place_lat is None or place_lng is None:
+            return None, None
+
+        try:
+            # 距離計算 (km)
+            distanceKm = geodesic(origin, (place_lat, place_lng)).km
+        except ValueError:
+            logger.warning("Could not calculate distance for place %s. Invalid coordinates?", place.get('name'))
+            return None, None
+
+        # 徒歩時間計算 (分)
+        walk_speed_km_per_minute = self.walk_speed_km_per_hour / 60
+        if walk_speed_km_per_minute <= 0:
+            return distanceKm, None # 速度が0以下なら計算しない
+        return distanceKm, round(distanceKm / walk_speed_km_per_minute)
+
+    async def _process_place_details(self, place: dict, distanceKm: float | None = None, walkMinutes: int | None = None,
+                                     prefetched: dict | None = None, allow_upstream: bool = True) -> ShopRecord | None:
+        """
+        Google Place の情報にDB情報やセンチメント分析結果、距離情報を追加した ShopRecord を返す共通処理。
+        prefetched に _get_jongso_batch_from_db の結果を渡すと、店舗ごとのDB問い合わせを省略する。
+        allow_upstream=False またはブレーカーが open の場合、レビュー取得・分析は行わずDBの情報だけを使う。
+        place_id の無い結果は None を返す。
+        """
         place_id = place.get('place_id')
         if not place_id:
             logger.warning("Place details processing skipped: place_id is missing.")
-            return place
+            return None
 
-        logger.debug(f"Processing details for place_id: {place_id}")
+        logger.debug("Processing details for place_id: %s", place_id)
 
-        db_data = await self._get_jongso_from_db(place_id)
+        if prefetched is not None:
+            db_data = prefetched.get(place_id)
+        else:
+            db_data = await self._get_jongso_from_db(place_id)
 
         smoking_status = "不明"
         last_fetched_at = None
@@ -120,221 +218,688 @@ class LocationService:
             db_positive_score = db_data.get('positive_score')
             db_negative_score = db_data.get('negative_score')
             db_summary = db_data.get('summary')
-            logger.debug(f"Using DB info for {place_id}: Smoking={smoking_status}, FetchedAt={last_fetched_at}, Scores=({db_positive_score},{db_negative_score}), Summary={db_summary is not None}")
+            logger.debug("Using DB info for %s: Smoking=%s, FetchedAt=%s, Scores=(%s,%s), Summary=%s", place_id, smoking_status, last_fetched_at, db_positive_score, db_negative_score, db_summary is not None)
         else:
-            logger.debug(f"No DB data found for {place_id}, using defaults or fetching new.")
+            logger.debug("No DB data found for %s, using defaults or fetching new.", place_id)
 
         positive_score = db_positive_score
         negative_score = db_negative_score
         summary = db_summary if db_summary else "レビュー情報取得中..."
 
-        should_fetch_reviews = positive_score is None or negative_score is None or summary == "レビュー情報取得中..."
-        if should_fetch_reviews:
-            logger.debug(f"Fetching reviews/sentiment for {place_id} as DB data is missing or incomplete.")
+        is_stale = self._is_stale(last_fetched_at)
+        should_fetch_reviews = positive_score is None or negative_score is None or summary == "レビュー情報取得中..." or is_stale
+        if should_fetch_reviews and (not allow_upstream or self.google_breaker.is_open() or self.llm_breaker.is_open()):
+            logger.debug("Skipping review fetch/sentiment analysis for %s: upstream circuit is open.", place_id)
+            _degraded.set(True)
+        elif should_fetch_reviews:
+            logger.debug("Fetching reviews/sentiment for %s as DB data is missing, incomplete or stale (stale=%s).", place_id, is_stale)
             try:
-                details = self.maps_service.place_details(place_id=place_id, fields=['review'], language='ja')
+                details = await self.google_executor.run(
+                    self.maps_service.place_details, place_id=place_id, fields=['review'], language='ja', reviews_sort='newest')
                 reviews = details.get('result', {}).get('reviews', [])
-                logger.debug(f"Found {len(reviews)} reviews for {place_id} via place_details.")
+                logger.debug("Found %s reviews for %s via place_details.", len(reviews), place_id)
 
                 if reviews:
                     review_texts = [review.get('text', '') for review in reviews if review.get('text')]
                     if review_texts:
-                        sentiment_results = self.sentiment_service.analyze_text_list(review_texts)
-                        positive_score = round(sum(r['positive_score'] for r in sentiment_results) / len(sentiment_results) * 10)
-                        negative_score = round(sum(r['negative_score'] for r in sentiment_results) / len(sentiment_results) * 10)
-                        logger.debug(f"Calculated Sentiment scores for {place_id}: Pos={positive_score}, Neg={negative_score}")
-                        summary = self.sentiment_service.get_summary_from_reviews(reviews)
-                        logger.debug(f"Generated summary for {place_id}: {summary[:50]}...")
-
-                        # DBに喫煙情報がない場合にレビューから判定する
-                        if smoking_status == "不明":
-                            smoking_status = self.sentiment_service.get_smoking_status_from_reviews(reviews)
-                            logger.debug(f"Determined smoking status for {place_id} from reviews: {smoking_status}")
-
+                        positive_score, negative_score, summary, smoking_status = await self._analyze_reviews_incremental(
+                            place_id, reviews, db_summary, smoking_status
+                        )
                     else:
-                        logger.debug(f"No review texts found for {place_id} to analyze.")
+                        logger.debug("No review texts found for %s to analyze.", place_id)
                         summary = db_summary if db_summary else "有効なレビューが見つかりませんでした。"
                 else:
-                    logger.debug(f"No reviews found for {place_id} in place_details result.")
+                    logger.debug("No reviews found for %s in place_details result.", place_id)
                     summary = db_summary if db_summary else "レビューはありません。"
 
+            except CircuitOpenError as e:
+                logger.debug("Skipping review fetch for %s: %s", place_id, e)
+                _degraded.set(True)
             except googlemaps.exceptions.ApiError as e:
-                logger.error(f"Google Maps Place Details API error for {place_id}: {e}")
+                logger.error("Google Maps Place Details API error for %s: %s", place_id, e)
                 summary = db_summary if db_summary else "レビュー情報の取得中にエラーが発生しました。"
             except Exception as e:
-                logger.error(f"Unexpected error during sentiment analysis for {place_id}: {e}", exc_info=True)
+                logger.error("Unexpected error during sentiment analysis for %s: %s", place_id, e, exc_info=True)
                 summary = db_summary if db_summary else "センチメント分析中に予期せぬエラーが発生しました。"
         else:
-            logger.debug(f"Skipping review fetch/sentiment analysis for {place_id} as sufficient data exists in DB.")
-
-        processed_place = {
-            "id": place_id,
-            "name": place.get('name'),
-            "address": place.get('formatted_address') or place.get('vicinity'),
-            "lat": place.get('geometry', {}).get('location', {}).get('lat'),
-            "lng": place.get('geometry', {}).get('location', {}).get('lng'),
-            "rating": place.get('rating'),
-            "user_ratings_total": place.get('user_ratings_total'),
-            "smoking_status": smoking_status,
-            "positive_score": positive_score if positive_score is not None else 0,
-            "negative_score": negative_score if negative_score is not None else 0,
-            "summary": summary,
-            "last_fetched_at": last_fetched_at,
-            "distanceKm": distanceKm,
-            "walkMinutes": walkMinutes,
-            "place_id": place_id
-        }
-        return processed_place
-
-    async def search_nearby_jongso(self, latitude: float, longitude: float):
-        """指定された緯度経度の周辺にある雀荘を検索する"""
-        logger.info(f"Searching nearby jongso at lat={latitude}, lng={longitude}")
+            logger.debug("Skipping review fetch/sentiment analysis for %s as sufficient data exists in DB.", place_id)
+
+        return ShopRecord.from_place(
+            place,
+            smoking_status=smoking_status,
+            positive_score=positive_score if positive_score is not None else 0,
+            negative_score=negative_score if negative_score is not None else 0,
+            summary=summary,
+            last_fetched_at=last_fetched_at,
+            distance_km=distanceKm,
+            walk_minutes=walkMinutes,
+        )
+
+    async def _nearby_places(self, latitude: float, longitude: float, radius: int) -> list:
+        """周辺検索を行い、結果件数をセル密度として記録する"""
+        places_result = await self.google_executor.run(
+            self.maps_service.nearby_search,
+            location=(latitude, longitude),
+            radius=radius,
+            keyword='雀荘',
+            language='ja'
+        )
+        if not places_result or 'results' not in places_result:
+            logger.warning("No nearby places found with keyword '雀荘' (radius=%s).", radius)
+            return []
+
+        potential_places = places_result['results']
+        logger.info("Nearby search with keyword '雀荘' found %s potential places (radius=%s).", len(potential_places), radius)
+        self.density_cache.record(latitude, longitude, radius, len(potential_places))
+        return potential_places
+
+    async def _adaptive_nearby_places(self, latitude: float, longitude: float, target_count: int) -> list:
+        """セル密度から目標件数に合う半径を推定して周辺検索し、不足すれば半径を広げて再検索する"""
+        radius = self.density_cache.radius_for_target(latitude, longitude, target_count)
+        potential_places = []
+        for _ in range(ADAPTIVE_MAX_ATTEMPTS):
+            potential_places = await self._nearby_places(latitude, longitude, radius)
+            radius = next_radius(radius, target_count, len(potential_places))
+            if radius is None:
+                break
+            logger.debug("Adaptive search found %s/%s places, retrying with radius=%s.", len(potential_places), target_count, radius)
+        return potential_places
+
+    def _is_stale(self, last_fetched_at: str | None) -> bool:
+        """last_fetched_at が REVIEW_REFRESH_DAYS より古ければ True (未取得の場合は False)"""
+        if not last_fetched_at:
+            return False
         try:
-            location_tuple = (latitude, longitude)
-            places_result = self.maps_service.nearby_search(
-                location=location_tuple,
-                radius=3000,
-                keyword='雀荘',
-                language='ja'
+            fetched_at = datetime.fromisoformat(last_fetched_at)
+        except (TypeError, ValueError):
+            logger.warning("Could not parse last_fetched_at ('%s'). Treating as stale.", last_fetched_at)
+            return True
+        if fetched_at.tzinfo is None:
+            fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+        return fetched_at < datetime.now(timezone.utc) - timedelta(days=REVIEW_REFRESH_DAYS)
+
+    async def _analyze_reviews_incremental(self, place_id: str, reviews: list, db_summary: str | None, smoking_status: str | None):
+        """
+        未分析のレビューだけを OpenAI に送り、保存済みのレビュー単位のスコアと合わせて店舗のスコアを更新する。
+        戻り値は (positive_score, negative_score, summary, smoking_status)。
+        """
+        analyzed = await self.review_store.get_reviews(place_id)
+        new_reviews = [review for review in reviews if review.get('text') and review_hash(review) not in analyzed]
+        logger.debug("Reviews for %s: %s fetched, %s already analyzed, %s new.", place_id, len(reviews), len(analyzed), len(new_reviews))
+
+        # スコア・要約・喫煙判定は互いに独立しているので、OpenAI への問い合わせを並行して行う
+        summary_task = None
+        if new_reviews or not db_summary:
+            # 要約は新しいレビューがある場合だけ、以前の要約を踏まえて作り直す
+            summary_task = asyncio.create_task(
+                self.sentiment_service.get_summary_from_reviews(new_reviews or reviews, previous_summary=db_summary)
+            )
+        # 喫煙情報が未判定の場合、または新しいレビューに喫煙の記述がある場合だけ判定する
+        smoking_task = None
+        smoking_unknown = not smoking_status or smoking_status == "不明"
+        signal_reviews = [] if smoking_unknown else [review for review in new_reviews if detect_smoking_signal(review['text'])]
+        if smoking_unknown or signal_reviews:
+            smoking_task = asyncio.create_task(
+                self.sentiment_service.get_smoking_status_from_reviews(reviews if smoking_unknown else signal_reviews)
             )
 
-            if not places_result or 'results' not in places_result:
-                logger.warning("No nearby places found with keyword '雀荘'.")
-                return []
-
-            potential_places = places_result['results']
-            logger.info(f"Nearby search with keyword '雀荘' found {len(potential_places)} potential places.")
-
-            user_location = (latitude, longitude) # ユーザーの現在地
-
-            processed_results = []
-            for place in potential_places:
-                place_location_data = place.get('geometry', {}).get('location', {})
-                place_lat = place_location_data.get('lat')
-                place_lng = place_location_data.get('lng')
-
-                distanceKm = None
-                walkMinutes = None
-
-                if place_lat is not None and place_lng is not None:
-                    place_location = (place_lat, place_lng)
-                    try:
-                        # 距離計算 (km)
-                        distanceKm = geodesic(user_location, place_location).km
-                        # 徒歩時間計算 (分)
-                        walk_speed_km_per_minute = self.walk_speed_km_per_hour / 60
-                        if walk_speed_km_per_minute > 0:
-                            walkMinutes = round(distanceKm / walk_speed_km_per_minute)
-                        else:
-                            walkMinutes = None # 速度が0以下なら計算しない
-                    except ValueError:
-                        logger.warning(f"Could not calculate distance for place {place.get('name')}. Invalid coordinates?")
-                        distanceKm = None
-                        walkMinutes = None
-
-                processed_place = await self._process_place_details(place, distanceKm=distanceKm, walkMinutes=walkMinutes)
-                processed_results.append(processed_place)
-
-            # レーティングの降順でソート (Noneは末尾に)
-            processed_results.sort(key=lambda x: x.get('rating', -1) if x.get('rating') is not None else -1, reverse=True)
+        pending = [task for task in (summary_task, smoking_task) if task is not None]
+        try:
+            new_results = []
+            if new_reviews:
+                new_results = await self.sentiment_service.analyze_text_list([review['text'] for review in new_reviews])
+                # エラー等で既定値になったレビューは保存せず、次回の再取得で分析し直す
+                await self.review_store.save_reviews(
+                    place_id,
+                    [(review, result) for review, result in zip(new_reviews, new_results) if result.get('analyzed')]
+                )
+
+            scores = [
+                (row['positive_score'], row['negative_score'])
+                for row in analyzed.values()
+                if row.get('positive_score') is not None and row.get('negative_score') is not None
+            ]
+            scores.extend((result['positive_score'], result['negative_score']) for result in new_results)
+            if scores:
+                positive_score = round(sum(p for p, _ in scores) / len(scores) * 10)
+                negative_score = round(sum(n for _, n in scores) / len(scores) * 10)
+            else:
+                positive_score = negative_score = None
+            logger.debug("Calculated Sentiment scores for %s: Pos=%s, Neg=%s (%s reviews)", place_id, positive_score, negative_score, len(scores))
 
-            await self._save_results_to_db(processed_results)
+            if summary_task is not None:
+                summary = await summary_task
+                logger.debug("Generated summary for %s: %s...", place_id, summary[:50])
+            else:
+                summary = db_summary
 
-            logger.info(f"Finished processing {len(processed_results)} nearby jongso.")
-            return processed_results
+            if smoking_task is not None:
+                updated_status = await smoking_task
+                if smoking_unknown:
+                    smoking_status = updated_status
+                    logger.debug("Determined smoking status for %s from reviews: %s", place_id, smoking_status)
+                else:
+                    if updated_status != "不明":
+                        smoking_status = updated_status
+                    logger.debug("Re-evaluated smoking status for %s from %s new reviews: %s", place_id, len(signal_reviews), smoking_status)
+        finally:
+            # スコアの分析・保存で例外になった場合も、並行して投げた問い合わせを残さない
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return positive_score, negative_score, summary, smoking_status
+
+    async def search_nearby_jongso(self, latitude: float, longitude: float, target_count: int | None = None,
+                                   ranking: str = DEFAULT_RANKING, smoking_preference: str | None = None, limit: int | None = None,
+                                   allow_upstream: bool = True, use_station_index: bool = True):
+        """
+        指定された緯度経度の周辺にある雀荘を検索する。
+        target_count を指定すると、セル密度から検索半径を調整し、近い順に最大 target_count 件だけ分析する。
+        結果は ranking (services/ranking.py) の順に並べ、limit 指定時は上位 limit 件を返す。
+        allow_upstream=False (過負荷時など) の場合は Google / OpenAI を呼ばず、DBの情報だけで応答する。
+        駅のすぐ近くの検索は station_nearest_shops から返す (use_station_index=False で常に Google を検索する)。
+        """
+        logger.info("Searching nearby jongso at lat=%s, lng=%s, target_count=%s", latitude, longitude, target_count)
+        try:
+            station_results = await self._station_results_nearby(latitude, longitude) if use_station_index else None
+            if station_results is not None:
+                if target_count and len(station_results) > target_count:
+                    station_results = sorted(station_results, key=lambda r: r.distance_km if r.distance_km is not None else float('inf'))[:target_count]
+                return rank_results(station_results, ranking, limit=limit, smoking_preference=smoking_preference)
+
+            if self.search_cache is not None:
+                # 同じ地点・件数・モードの結果は、依存するセルのデータが変わるまでインスタンス間で共有する。
+                # DBだけの結果は上流の状態に左右されないため、縮退 (分析待ちの店舗を含む) でもキャッシュする
+                mode = "upstream" if allow_upstream else "db"
+                entry = await self.search_cache.aget_or_compute(
+                    make_key(mode, round(latitude, 6), round(longitude, 6), target_count),
+                    lambda: self._nearby_results_entry(latitude, longitude, target_count, allow_upstream),
+                    cache_if=lambda entry: (not allow_upstream or not entry["degraded"]) and entry["versions"] is not None,
+                    is_fresh=self._results_entry_is_fresh,
+                )
+                if entry["degraded"]:
+                    _degraded.set(True)
+                processed_results = [
+                    shop if isinstance(shop, ShopRecord) else ShopRecord.from_dict(shop) for shop in entry["results"]
+                ]
+            else:
+                processed_results = await self._nearby_results(latitude, longitude, target_count, allow_upstream)
+            return rank_results(processed_results, ranking, limit=limit, smoking_preference=smoking_preference)
 
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps Nearby Search API error: {e}")
+            logger.error("Google Maps Nearby Search API error: %s", e)
             raise HTTPException(status_code=503, detail="Google Maps API への接続でエラーが発生しました。") from e
         except Exception as e:
-            logger.error(f"Unexpected error during nearby search: {e}", exc_info=True)
+            logger.error("Unexpected error during nearby search: %s", e, exc_info=True)
             raise HTTPException(status_code=500, detail="周辺検索中に予期せぬエラーが発生しました。") from e
 
 
-    async def search_by_keyword(self, keyword: str):
+    async def _nearby_results(self, latitude: float, longitude: float, target_count: int | None,
+                              allow_upstream: bool) -> list[ShopRecord]:
+        """周辺の店舗を取得・分析して保存し、ランキング前の結果を返す (search_nearby_jongso の本体)"""
+        prefetched = None
+        potential_places = None
+        if allow_upstream and not self.google_breaker.is_open():
+            try:
+                if target_count:
+                    potential_places = await self._adaptive_nearby_places(latitude, longitude, target_count)
+                else:
+                    potential_places = await self._nearby_places(latitude, longitude, DEFAULT_RADIUS_M)
+            except CircuitOpenError as e:
+                logger.warning("Nearby search skipped: %s", e)
+        if potential_places is None:
+            # Google が使えない間はDBに保存済みの店舗だけで応答する
+            potential_places, prefetched = await self._db_places_nearby(latitude, longitude, DEFAULT_RADIUS_M)
+        if not potential_places:
+            return []
+
+        user_location = (latitude, longitude) # ユーザーの現在地
+
+        candidates = [(place, *self._calculate_distance(user_location, place)) for place in potential_places]
+        if target_count and len(candidates) > target_count:
+            # 表示しない店舗の詳細取得・分析を避けるため、近い順に目標件数まで絞る
+            candidates.sort(key=lambda c: c[1] if c[1] is not None else float('inf'))
+            candidates = candidates[:target_count]
+
+        processed_results = []
+        for place, distanceKm, walkMinutes in candidates:
+            processed_place = await self._process_place_details(
+                place, distanceKm=distanceKm, walkMinutes=walkMinutes,
+                prefetched=prefetched, allow_upstream=prefetched is None
+            )
+            if processed_place is not None:
+                processed_results.append(processed_place)
+
+        await self._save_results_to_db_unless_degraded(processed_results)
+
+        logger.info("Finished processing %s nearby jongso.", len(processed_results))
+        return processed_results
+
+    async def _nearby_results_entry(self, latitude: float, longitude: float, target_count: int | None,
+                                    allow_upstream: bool = True) -> dict:
+        """共有キャッシュに置く周辺検索の結果と、その結果が依存するセルのデータバージョン (保存後の値)"""
+        results = await self._nearby_results(latitude, longitude, target_count, allow_upstream)
+        points = [(result.lat, result.lng) for result in results]
+        points.append((latitude, longitude))
+        versions = await self.data_versions.versions_for_points(points)
+        return {
+            "results": results,
+            "degraded": _degraded.get(),
+            # 依存するセルが多すぎて無効化を追えない結果は None (キャッシュしない)
+            "versions": [[row, col, version] for (row, col), version in versions.items()] if versions is not None else None,
+        }
+
+    async def _results_entry_is_fresh(self, entry: dict) -> bool:
+        """キャッシュした結果が依存するセルのデータバージョンが変わっていなければ True"""
+        current = await self.data_versions.current((row, col) for row, col, _ in entry["versions"])
+        return all(current[(row, col)] == version for row, col, version in entry["versions"])
+
+    async def search_by_keyword(self, keyword: str, ranking: str | None = None, smoking_preference: str | None = None, limit: int | None = None,
+                                allow_upstream: bool = True):
         """
         キーワード（地名または施設名）で雀荘を検索する。
         地名が指定された場合は、その地点周辺を検索する。
         施設名が指定された場合は、テキスト検索を行う。
+        駅名 (「新宿駅」「池袋」など) の場合は station_nearest_shops の近傍店舗を1回の読み取りで返す。
+        ranking 未指定の場合、テキスト検索の結果は Google の関連度順のまま返す。
+        allow_upstream=False の場合は、DBの店舗名・住所だけで検索する。
         """
-        logger.info(f"Attempting to geocode keyword: {keyword}")
         try:
-            geocode_result = self.maps_service.geocode(keyword)
+            station_results = await self._station_results_for_keyword(keyword)
+            if station_results is not None:
+                return rank_results(station_results, ranking or DEFAULT_RANKING, limit=limit, smoking_preference=smoking_preference)
+
+            logger.info("Attempting to geocode keyword: %s", keyword)
+            if not allow_upstream or self.google_breaker.is_open():
+                return await self._search_keyword_from_db(keyword, ranking, smoking_preference, limit)
+            try:
+                geocode_result = await self.google_executor.run(self.maps_service.geocode, keyword)
+            except CircuitOpenError as e:
+                logger.warning("Keyword geocoding skipped: %s", e)
+                return await self._search_keyword_from_db(keyword, ranking, smoking_preference, limit)
             if geocode_result and isinstance(geocode_result, list) and len(geocode_result) > 0:
                 location = geocode_result[0]['geometry']['location']
                 lat = location['lat']
                 lng = location['lng']
-                logger.info(f"Geocoding successful for '{keyword}': lat={lat}, lng={lng}. Searching nearby.")
-                return await self.search_nearby_jongso(latitude=lat, longitude=lng)
+                logger.info("Geocoding successful for '%s': lat=%s, lng=%s. Searching nearby.", keyword, lat, lng)
+                return await self.search_nearby_jongso(
+                    latitude=lat,
+                    longitude=lng,
+                    ranking=ranking or DEFAULT_RANKING,
+                    smoking_preference=smoking_preference,
+                    limit=limit
+                )
             else:
-                logger.info(f"Could not geocode '{keyword}' as a location. Assuming it's a place name/query and performing text search.")
-                places_result = self.maps_service.text_search(query=f"雀荘 {keyword}", language='ja')
+                logger.info("Could not geocode '%s' as a location. Assuming it's a place name/query and performing text search.", keyword)
+                try:
+                    places_result = await self.google_executor.run(self.maps_service.text_search, query=f"雀荘 {keyword}", language='ja')
+                except CircuitOpenError as e:
+                    logger.warning("Text search skipped: %s", e)
+                    return await self._search_keyword_from_db(keyword, ranking, smoking_preference, limit)
 
                 if not places_result or 'results' not in places_result or not places_result['results']:
-                    logger.warning(f"No places found via text search for keyword: 雀荘 {keyword}")
+                    logger.warning("No places found via text search for keyword: 雀荘 %s", keyword)
                     return []
 
                 potential_places = places_result['results']
-                logger.info(f"Text search for '雀荘 {keyword}' found {len(potential_places)} potential results.")
+                logger.info("Text search for '雀荘 %s' found %s potential results.", keyword, len(potential_places))
 
                 processed_results = []
                 for place in potential_places:
                     processed_place = await self._process_place_details(place, distanceKm=None, walkMinutes=None)
-                    processed_results.append(processed_place)
+                    if processed_place is not None:
+                        processed_results.append(processed_place)
 
-                await self._save_results_to_db(processed_results)
+                await self._save_results_to_db_unless_degraded(processed_results)
 
-                logger.info(f"Finished processing {len(processed_results)} keyword search results.")
+                logger.info("Finished processing %s keyword search results.", len(processed_results))
+                if ranking or smoking_preference or limit:
+                    return rank_results(processed_results, ranking or DEFAULT_RANKING, limit=limit, smoking_preference=smoking_preference)
                 return processed_results
 
         except googlemaps.exceptions.ApiError as e:
-            logger.error(f"Google Maps API error during keyword search for '{keyword}': {e}")
+            logger.error("Google Maps API error during keyword search for '%s': %s", keyword, e)
             raise HTTPException(status_code=503, detail="Google Maps API への接続でエラーが発生しました。") from e
         except Exception as e:
-            logger.error(f"Unexpected error during keyword search for '{keyword}': {e}", exc_info=True)
+            logger.error("Unexpected error during keyword search for '%s': %s", keyword, e, exc_info=True)
             raise HTTPException(status_code=500, detail="キーワード検索中に予期せぬエラーが発生しました。") from e
 
-    async def _save_results_to_db(self, results: list):
-        """検索結果リストをDBに保存/更新する。ただし、last_fetched_atが30日以内のレコードは更新しない"""
-        if not self.db_client:
-            logger.warning("Supabase client is not available, skipping DB save.")
-            return
-        if not results:
+    async def search_batch(self, locations: list, keywords: list, allow_upstream: bool = True) -> list:
+        """
+        複数の地点・キーワードをまとめて検索する。
+        近接する地点は同じセルとして1回の周辺検索にまとめ、place_id もバッチ全体で重複排除する。
+        DB事前取得・レビュー分析・DB保存はバッチ全体でそれぞれ1回だけ行い、入力ごとの結果リストを返す。
+        allow_upstream=False の場合は Google / OpenAI を呼ばず、地点は周辺、キーワードは店舗名・住所でDBから検索する。
+        """
+        if len(locations) + len(keywords) > BATCH_MAX_INPUTS:
+            raise ValueError(f"一度に検索できる地点・キーワードは合計{BATCH_MAX_INPUTS}件までです。")
+
+        logger.info("Batch search: %s locations, %s keywords", len(locations), len(keywords))
+        cell_size = cell_size_for_zoom(BATCH_CELL_ZOOM)
+
+        # 入力ごとの検索方法を決める: ('cell', セル) / ('text', キーワード) / ('none', None)
+        entries = []
+        for latitude, longitude in locations:
+            entries.append({
+                "input": {"latitude": latitude, "longitude": longitude},
+                "origin": (latitude, longitude),
+                "source": ('cell', cell_index(latitude, longitude, cell_size)),
+            })
+
+        geocoded = {}
+        for keyword in keywords:
+            normalized = keyword.strip()
+            if normalized not in geocoded:
+                geocoded[normalized] = await self._geocode_keyword(normalized) if allow_upstream else None
+            location = geocoded[normalized]
+            if location:
+                entries.append({
+                    "input": {"keyword": keyword},
+                    "origin": location,
+                    "source": ('cell', cell_index(location[0], location[1], cell_size)),
+                })
+            elif normalized:
+                entries.append({"input": {"keyword": keyword}, "origin": None, "source": ('text', normalized)})
+            else:
+                entries.append({"input": {"keyword": keyword}, "origin": None, "source": ('none', None)})
+
+        # 重複を除いたセル・テキストごとに1回だけ Google 検索を行う (ブレーカーが open ならDBから取得する)
+        places_by_source = {}
+        prefetched = {}
+        for entry in entries:
+            source = entry["source"]
+            if source in places_by_source:
+                continue
+            kind, value = source
+            if not allow_upstream and kind != 'none':
+                places_by_source[source], db_records = await self._db_places_for_source(source, cell_size)
+                prefetched.update(db_records)
+                continue
+            try:
+                if kind == 'cell':
+                    places_result = await self.google_executor.run(
+                        self.maps_service.nearby_search,
+                        location=cell_center(value[0], value[1], cell_size),
+                        radius=DEFAULT_RADIUS_M,
+                        keyword='雀荘',
+                        language='ja'
+                    )
+                elif kind == 'text':
+                    places_result = await self.google_executor.run(self.maps_service.text_search, query=f"雀荘 {value}", language='ja')
+                else:
+                    places_result = None
+            except CircuitOpenError as e:
+                logger.warning("Batch search for %s served from DB: %s", source, e)
+                places_by_source[source], db_records = await self._db_places_for_source(source, cell_size)
+                prefetched.update(db_records)
+                continue
+            except googlemaps.exceptions.ApiError as e:
+                logger.error("Google Maps API error during batch search for %s: %s", source, e)
+                places_result = None
+            places_by_source[source] = (places_result or {}).get('results', [])
+
+        unique_places = {}
+        for places in places_by_source.values():
+            for place in places:
+                place_id = place.get('place_id')
+                if place_id and place_id not in unique_places:
+                    unique_places[place_id] = place
+        logger.info("Batch search: %s inputs -> %s upstream searches -> %s unique places", len(entries), len(places_by_source), len(unique_places))
+
+        # DB事前取得とレビュー分析は重複排除後の店舗に対して1回ずつ
+        missing_ids = [place_id for place_id in unique_places if place_id not in prefetched]
+        prefetched.update(await self._get_jongso_batch_from_db(missing_ids))
+        processed_by_id = {}
+        for place_id, place in unique_places.items():
+            processed = await self._process_place_details(place, prefetched=prefetched, allow_upstream=allow_upstream)
+            if processed is not None:
+                processed_by_id[place_id] = processed
+
+        await self._save_results_to_db_unless_degraded(list(processed_by_id.values()))
+
+        batch_results = []
+        for entry in entries:
+            origin = entry["origin"]
+            results = []
+            for place in places_by_source[entry["source"]]:
+                processed = processed_by_id.get(place.get('place_id'))
+                if processed is None:
+                    continue
+                if origin is not None:
+                    processed = processed.with_distance(*self._calculate_distance(origin, place))
+                results.append(processed)
+            batch_results.append({**entry["input"], "results": rank_results(results)})
+
+        return batch_results
+
+    async def _db_places_for_source(self, source: tuple, cell_size: float) -> tuple[list, dict]:
+        """バッチ検索の検索単位 ('cell', セル) / ('text', キーワード) を、保存済みの店舗だけで検索する (縮退モード用)"""
+        kind, value = source
+        if kind == 'cell':
+            latitude, longitude = cell_center(value[0], value[1], cell_size)
+            return await self._db_places_nearby(latitude, longitude, DEFAULT_RADIUS_M)
+        return await self._db_places_matching(value)
+
+    async def _geocode_keyword(self, keyword: str) -> tuple[float, float] | None:
+        """キーワードを地名としてジオコーディングする。地名でなければ None"""
+        if not keyword:
+            return None
+        try:
+            geocode_result = await self.google_executor.run(self.maps_service.geocode, keyword)
+        except CircuitOpenError as e:
+            # 地名として扱えないため、呼び出し元ではDBの店舗名・住所で検索する
+            logger.warning("Geocoding skipped during batch search for '%s': %s", keyword, e)
+            return None
+        except googlemaps.exceptions.ApiError as e:
+            logger.error("Google Maps Geocoding API error during batch search for '%s': %s", keyword, e)
+            return None
+        if geocode_result and isinstance(geocode_result, list) and len(geocode_result) > 0:
+            location = geocode_result[0]['geometry']['location']
+            return location['lat'], location['lng']
+        return None
+
+    async def _save_results_to_db_unless_degraded(self, results: list):
+        """縮退モードではDBの内容を変えていないため保存しない (last_fetched_at を進めて再分析が遅れるのを防ぐ)"""
+        if _degraded.get():
+            logger.info("Skipping DB save for %s results served in degraded mode.", len(results))
             return
+        await self._save_results_to_db(results)
+
+    def _db_rows_to_places(self, rows: list) -> tuple[list, dict]:
+        """DBの行を Google Places の結果と同じ形の辞書に変換し、(店舗リスト, place_id -> DBレコード) を返す"""
+        places = []
+        for row in rows:
+            places.append({
+                'place_id': row['place_id'],
+                'name': row.get('name'),
+                'formatted_address': row.get('address'),
+                'geometry': {'location': {'lat': row.get('lat'), 'lng': row.get('lng')}},
+                'rating': row.get('rating'),
+                'user_ratings_total': row.get('user_ratings_total'),
+            })
+        return places, {row['place_id']: row for row in rows}
+
+    async def _db_places_nearby(self, latitude: float, longitude: float, radius_m: int) -> tuple[list, dict]:
+        """指定地点から半径 radius_m 以内の保存済み店舗を近い順に返す (縮退モード用)"""
+        _degraded.set(True)
+        if not self.shops:
+            logger.warning("Supabase client is not available, returning no degraded results.")
+            return [], {}
+
+        delta_lat = radius_m / 1000 / 111.32
+        delta_lng = delta_lat / max(math.cos(math.radians(latitude)), 0.01)
+        try:
+            rows = await self.shops.in_bbox(
+                latitude - delta_lat, longitude - delta_lng, latitude + delta_lat, longitude + delta_lng,
+                BBOX_SHOP_COLUMNS, limit=DEGRADED_MAX_RESULTS
+            )
+        except Exception as e:
+            logger.error("Error querying DB for degraded nearby search: %s", e, exc_info=True)
+            return [], {}
+
+        rows = [
+            row for row in rows
+            if row.get('lat') is not None and row.get('lng') is not None
+            and haversine_km(latitude, longitude, row['lat'], row['lng']) * 1000 <= radius_m
+        ]
+        rows.sort(key=lambda row: haversine_km(latitude, longitude, row['lat'], row['lng']))
+        logger.info("Degraded nearby search returned %s shops from DB.", len(rows))
+        return self._db_rows_to_places(rows)
+
+    async def _db_places_matching(self, keyword: str) -> tuple[list, dict]:
+        """店舗名または住所にキーワードを含む保存済み店舗を返す (縮退モード用)"""
+        _degraded.set(True)
+        if not self.shops or not keyword:
+            return [], {}
+        try:
+            rows = await self.shops.search_text(keyword, BBOX_SHOP_COLUMNS, limit=DEGRADED_MAX_RESULTS)
+        except Exception as e:
+            logger.error("Error querying DB for degraded keyword search '%s': %s", keyword, e, exc_info=True)
+            return [], {}
+        logger.info("Degraded keyword search for '%s' returned %s shops from DB.", keyword, len(rows))
+        return self._db_rows_to_places(rows)
+
+    async def _search_keyword_from_db(self, keyword: str, ranking: str | None, smoking_preference: str | None, limit: int | None) -> list:
+        """キーワード検索を保存済みの店舗だけで行う (縮退モード)"""
+        places, prefetched = await self._db_places_matching(keyword)
+        processed_results = [
+            await self._process_place_details(place, prefetched=prefetched, allow_upstream=False)
+            for place in places
+        ]
+        processed_results = [result for result in processed_results if result is not None]
+        return rank_results(processed_results, ranking or DEFAULT_RANKING, limit=limit, smoking_preference=smoking_preference)
+
+    @staticmethod
+    def _station_name_for_keyword(keyword: str) -> str | None:
+        """駅名として問い合わせる名前 (「新宿駅」「 池袋 」-> 「新宿」「池袋」)"""
+        name = "".join(normalize_keyword(keyword).split()).removesuffix(STATION_SUFFIX)
+        return name or None
+
+    def _station_rows_to_results(self, rows: list, origin: tuple | None) -> list[ShopRecord] | None:
+        """
+        station_nearest_shops の行を ShopRecord にする。origin を渡すとその地点からの距離を、省略すると駅からの距離を付ける。
+        未分析・再分析が必要な店舗を含む場合は None を返し、通常の検索で取り直す。
+        """
+        walk_speed_km_per_minute = self.walk_speed_km_per_hour / 60
+        results = []
+        for row in rows:
+            shop = row.get('jongso_shops')
+            if not shop or not shop.get('last_fetched_at') or self._is_stale(shop['last_fetched_at']):
+                return None
+            record = ShopRecord.from_db_row(shop)
+            if origin is None:
+                record.distance_km = row['distance_m'] / 1000
+            elif record.lat is not None and record.lng is not None:
+                record.distance_km = haversine_km(origin[0], origin[1], record.lat, record.lng)
+                if record.distance_km * 1000 > DEFAULT_RADIUS_M:
+                    continue
+            if record.distance_km is not None:
+                record.walk_minutes = round(record.distance_km / walk_speed_km_per_minute)
+            results.append(record)
+        return results or None
+
+    async def _station_results_for_keyword(self, keyword: str) -> list[ShopRecord] | None:
+        """キーワードが近傍店舗を保持している駅名であれば、その店舗を返す (ジオコーディング・周辺検索を省く)"""
+        name = self._station_name_for_keyword(keyword)
+        if not self.station_shops or not name:
+            return None
+        try:
+            rows = await self.station_shops.for_station(name, BBOX_SHOP_COLUMNS, limit=STATION_NEAREST_K)
+        except DataAccessError as e:
+            logger.warning("Station lookup for '%s' failed, falling back to geocoding: %s", keyword, e)
+            return None
+        results = self._station_rows_to_results(rows, None) if rows else None
+        if results is not None:
+            logger.info("Served keyword '%s' from station_nearest_shops (%s, %s shops).", keyword, name, len(results))
+        return results
+
+    async def _station_results_nearby(self, latitude: float, longitude: float) -> list[ShopRecord] | None:
+        """検索地点から STATION_SNAP_M 以内に近傍店舗を保持している駅があれば、その店舗を返す"""
+        if not self.station_shops:
+            return None
+        delta_lat = STATION_SNAP_M / 1000 / 111.32
+        delta_lng = delta_lat / max(math.cos(math.radians(latitude)), 0.01)
+        try:
+            rows = await self.station_shops.near_point(
+                latitude - delta_lat, longitude - delta_lng, latitude + delta_lat, longitude + delta_lng, BBOX_SHOP_COLUMNS
+            )
+        except DataAccessError as e:
+            logger.warning("Station lookup near (%s, %s) failed, searching normally: %s", latitude, longitude, e)
+            return None
+        if not rows:
+            return None
 
-        logger.info(f"Attempting to save/update {len(results)} results to DB table 'jongso_shops', skipping recent records.")
-
-        place_ids = [result['id'] for result in results if result.get('id')]
-        if not place_ids:
-            logger.warning("No valid place_ids found in results, skipping DB save.")
-            return
+        by_station: dict[str, list] = {}
+        for row in rows:
+            by_station.setdefault(row['station_name'], []).append(row)
+        name, station_rows = min(
+            by_station.items(),
+            key=lambda item: haversine_km(latitude, longitude, item[1][0]['station_lat'], item[1][0]['station_lng']),
+        )
+        first = station_rows[0]
+        if haversine_km(latitude, longitude, first['station_lat'], first['station_lng']) * 1000 > STATION_SNAP_M:
+            return None
+        results = self._station_rows_to_results(station_rows, (latitude, longitude))
+        if results is not None:
+            logger.info("Served nearby search from station_nearest_shops (%s, %s shops).", name, len(results))
+        return results
 
-        # DBから既存レコードのlast_fetched_atを取得
-        existing_records = {}
+    async def search_in_bounds(self, south: float, west: float, north: float, east: float, zoom: int) -> dict:
+        """
+        ビューポート内の雀荘をDBから取得する。
+        ズームが十分大きく件数が少なければ個別店舗を、そうでなければグリッド集約したクラスタを返す。
+        Google Maps / OpenAI は呼ばないため、パン操作のたびに呼ばれても安価。
+        """
+        validate_bbox(south, west, north, east)
+        if not self.shops:
+            logger.warning("Supabase client is not available, returning empty bbox result.")
+            return {"mode": "shops", "results": [], "clusters": []}
+
+        logger.info("BBox search: south=%s, west=%s, north=%s, east=%s, zoom=%s", south, west, north, east, zoom)
+
+        if zoom >= BBOX_INDIVIDUAL_MIN_ZOOM:
+            # 上限+1件だけ取得し、上限を超えるかどうかを判定する
+            rows = await self.shops.in_bbox(south, west, north, east, BBOX_SHOP_COLUMNS, limit=BBOX_MAX_MARKERS + 1)
+            if len(rows) <= BBOX_MAX_MARKERS:
+                logger.info("BBox search returned %s individual shops.", len(rows))
+                return {"mode": "shops", "results": [ShopRecord.from_db_row(row) for row in rows], "clusters": []}
+            logger.debug("BBox search exceeded %s markers at zoom %s, falling back to clusters.", BBOX_MAX_MARKERS, zoom)
+
+        # セル数が上限を超えないようにセルを粗くする
+        cell_size = cell_size_for_zoom(zoom)
+        while count_cells_in_bbox(south, west, north, east, cell_size) > BBOX_MAX_CLUSTERS:
+            cell_size *= 2
+
+        clusters = await self._fetch_bbox_clusters(south, west, north, east, cell_size)
+        logger.info("BBox search returned %s clusters (cell_size=%s).", len(clusters), cell_size)
+        return {"mode": "clusters", "results": [], "clusters": clusters, "cell_size": cell_size}
+
+    async def _fetch_bbox_clusters(self, south: float, west: float, north: float, east: float, cell_size: float) -> list:
+        """DBの集約関数でクラスタを取得する。関数が未作成の場合は行を取得してアプリ側で集約する"""
         try:
-            response = self.db_client.table('jongso_shops') \
-                .select("place_id, last_fetched_at") \
-                .in_('place_id', place_ids) \
-                .execute()
-
-            if response and hasattr(response, 'data'):
-                for record in response.data:
-                    existing_records[record['place_id']] = record.get('last_fetched_at')
-                logger.debug(f"Fetched last_fetched_at for {len(existing_records)} existing records.")
-            else:
-                logger.warning(f"Could not fetch existing records or unexpected response: {response}")
+            return await self.shops.bbox_clusters(south, west, north, east, cell_size) or []
+        except DataAccessError as e:
+            logger.warning("jongso_shops_bbox_clusters RPC failed, clustering in application instead: %s", e)
 
-        except Exception as e:
-            logger.error(f"Error fetching existing records from DB: {e}", exc_info=True)
-            # エラーが発生しても、できる限り処理を続行する（既存レコードが見つからなかったものとして扱う）
+        rows = await self.shops.in_bbox(south, west, north, east, "lat, lng, rating", limit=BBOX_FALLBACK_MAX_ROWS)
+        if len(rows) >= BBOX_FALLBACK_MAX_ROWS:
+            logger.warning("BBox cluster fallback hit the %s row limit; cluster counts are partial.", BBOX_FALLBACK_MAX_ROWS)
+        return cluster_shops(rows, cell_size)
 
+    def _build_upsert_records(self, results: list[ShopRecord], existing_records: dict) -> tuple[list, int]:
+        """
+        検索結果から upsert するレコードを作る。last_fetched_at が30日以内の既存レコードは除く。
+        戻り値は (レコードのリスト, 除いた件数)。
+        """
         records_to_upsert = []
         skipped_count = 0
         current_time_utc = datetime.now(timezone.utc)
+        current_time_iso = current_time_utc.isoformat() # 保存する last_fetched_at (現在時刻を ISO 形式で設定)
         thirty_days_ago = current_time_utc - timedelta(days=30) # 30日前の datetime オブジェクト
 
         for result in results:
-            place_id = result.get('id')
+            place_id = result.place_id
             if not place_id:
                 continue # place_id がない結果はスキップ
 
@@ -349,44 +914,63 @@ class LocationService:
                     # タイムゾーン情報がない場合は UTC とみなす (DBの保存形式に依存)
                     if existing_last_fetched_at.tzinfo is None:
                          # 警告: タイムゾーンなしの文字列は予期せぬ挙動の可能性
-                         logger.warning(f"last_fetched_at for {place_id} ('{existing_last_fetched_at_str}') lacks timezone info. Assuming UTC.")
+                         logger.warning("last_fetched_at for %s ('%s') lacks timezone info. Assuming UTC.", place_id, existing_last_fetched_at_str)
                          existing_last_fetched_at = existing_last_fetched_at.replace(tzinfo=timezone.utc)
 
                     if existing_last_fetched_at > thirty_days_ago:
                         should_skip = True
                         skipped_count += 1
-                        logger.debug(f"Skipping update for place_id {place_id}: last_fetched_at ({existing_last_fetched_at}) is within 30 days.")
+                        logger.debug("Skipping update for place_id %s: last_fetched_at (%s) is within 30 days.", place_id, existing_last_fetched_at)
                 except ValueError:
-                    logger.warning(f"Could not parse last_fetched_at ('{existing_last_fetched_at_str}') for place_id {place_id}. Proceeding with upsert.")
+                    logger.warning("Could not parse last_fetched_at ('%s') for place_id %s. Proceeding with upsert.", existing_last_fetched_at_str, place_id)
                 except Exception as e:
-                    logger.error(f"Error processing last_fetched_at for {place_id}: {e}", exc_info=True)
+                    logger.error("Error processing last_fetched_at for %s: %s", place_id, e, exc_info=True)
 
 
             if not should_skip:
-                record = {
-                    'place_id': place_id,
-                    'name': result.get('name'),
-                    'address': result.get('address'),
-                    'lat': result.get('lat'),
-                    'lng': result.get('lng'),
-                    'rating': result.get('rating'),
-                    'user_ratings_total': result.get('user_ratings_total'),
-                    'smoking_status': result.get('smoking_status'),
-                    'positive_score': result.get('positive_score'),
-                    'negative_score': result.get('negative_score'),
-                    'summary': result.get('summary'),
-                    'last_fetched_at': current_time_utc.isoformat() # 現在時刻を ISO 形式で設定
-                }
-                records_to_upsert.append(record)
+                records_to_upsert.append(result.to_db_row(current_time_iso))
+
+        return records_to_upsert, skipped_count
+
+    async def _save_results_to_db(self, results: list[ShopRecord]):
+        """検索結果リストをDBに保存/更新する。ただし、last_fetched_atが30日以内のレコードは更新しない"""
+        if not self.shops:
+            logger.warning("Supabase client is not available, skipping DB save.")
+            return
+        if not results:
+            return
+
+        logger.info("Attempting to save/update %s results to DB table 'jongso_shops', skipping recent records.", len(results))
+
+        place_ids = [result.place_id for result in results if result.place_id]
+        if not place_ids:
+            logger.warning("No valid place_ids found in results, skipping DB save.")
+            return
+
+        # DBから既存レコードのlast_fetched_atを取得
+        existing_records = {}
+        try:
+            records = await self.shops.get_many(place_ids, "place_id, last_fetched_at")
+            for place_id, record in records.items():
+                existing_records[place_id] = record.get('last_fetched_at')
+            logger.debug("Fetched last_fetched_at for %s existing records.", len(existing_records))
+
+        except Exception as e:
+            logger.error("Error fetching existing records from DB: %s", e, exc_info=True)
+            # エラーが発生しても、できる限り処理を続行する（既存レコードが見つからなかったものとして扱う）
+
+        records_to_upsert, skipped_count = self._build_upsert_records(results, existing_records)
 
         if not records_to_upsert:
-            logger.info(f"No records to upsert after filtering based on last_fetched_at. Skipped {skipped_count} records.")
+            logger.info("No records to upsert after filtering based on last_fetched_at. Skipped %s records.", skipped_count)
             return
 
-        logger.info(f"Attempting to upsert {len(records_to_upsert)} records (skipped {skipped_count}).")
+        logger.info("Attempting to upsert %s records (skipped %s).", len(records_to_upsert), skipped_count)
         try:
             # upsertのcolumnsパラメータに 'last_fetched_at' を追加する必要はない（デフォルトですべてのカラムが対象）
-            self.db_client.table('jongso_shops').upsert(records_to_upsert).execute()
-            logger.info(f"Successfully upserted {len(records_to_upsert)} records to DB table 'jongso_shops'.")
+            await self.shops.upsert(records_to_upsert)
+            logger.info("Successfully upserted %s records to DB table 'jongso_shops'.", len(records_to_upsert))
+            if self.data_versions:
+                self.data_versions.bump_points((record['lat'], record['lng']) for record in records_to_upsert)
         except Exception as e:
-            logger.error(f"Error upserting records to database table 'jongso_shops': {e}", exc_info=True)
\ No newline at end of file
+            logger.error("Error upserting records to database table 'jongso_shops': %s", e, exc_info=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""
+モデルのカスケード実行。
+
+分析は最も安い段 (語彙ベースの分類器、次に小さいモデル) から始め、確信度が閾値に届かない場合だけ
+次の段のモデルに回す。LLM の確信度は回答トークンの logprob から求める。
+段ごとの呼び出し回数・レイテンシ・トークン数・推定コスト・エスカレーション率を記録し、閾値の調整に使う。
+"""
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CASCADE_MODELS = ["gpt-4o-mini", "gpt-4o"]
+DEFAULT_CONFIDENCE_THRESHOLD = 0.75
+LEXICON_TIER = "lexicon"
+
+# 100万トークンあたりの料金 (USD, 入力/出力)。未登録のモデルはコスト0として記録する
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+
+class CascadeMetrics:
+    """タスク・段ごとの実行統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[tuple[str, str], dict[str, float]] = {}
+
+    def _entry(self, task: str, tier: str) -> dict:
+        key = (task, tier)
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = self._stats[key] = {
+                "calls": 0, "accepted": 0, "escalated": 0, "errors": 0,
+                "latency_total": 0.0, "latency_max": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+            }
+        return entry
+
+    def record(self, task: str, tier: str, outcome: str, latency: float = 0.0,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cost: float = 0.0) -> None:
+        """outcome は accepted / escalated / errors のいずれか"""
+        with self._lock:
+            entry = self._entry(task, tier)
+            entry["calls"] += 1
+            entry[outcome] += 1
+            entry["latency_total"] += latency
+            entry["latency_max"] = max(entry["latency_max"], latency)
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+
+    def snapshot(self) -> dict:
+        """タスク -> 段 -> 統計 の辞書を返す (平均レイテンシとエスカレーション率を含む)"""
+        with self._lock:
+            result: dict[str, dict[str, Any]] = {}
+            for (task, tier), entry in self._stats.items():
+                calls = entry["calls"]
+                result.setdefault(task, {})[tier] = {
+                    **entry,
+                    "latency_avg": entry["latency_total"] / calls if calls else 0.0,
+                    "escalation_rate": entry["escalated"] / calls if calls else 0.0,
+                }
+            return result
+
+
+def _estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def _answer_confidence(choice) -> float:
+    """回答トークン全体の同時確率を確信度とする。logprobs が無い場合は 1.0"""
+    logprobs = getattr(choice, "logprobs", None)
+    content = getattr(logprobs, "content", None) if logprobs else None
+    if not content:
+        return 1.0
+    return math.exp(sum(token.logprob for token in content))
+
+
+class ModelCascade:
+    """安い段から順に実行し、確信度が閾値未満なら次の段に回す"""
+
+    def __init__(self, gateway, models: list[str] | None = None, confidence_threshold: float | None = None):
+        self.gateway = gateway
+        self.models = models or DEFAULT_CASCADE_MODELS
+        self.confidence_threshold = DEFAULT_CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+        self.metrics = CascadeMetrics()
+
+    async def complete(self, task: str, model: str, messages: list, max_tokens: int, temperature: float,
+                 logprobs: bool = False) -> tuple[str, float, tuple]:
+        """
+        1つのモデルで補完を実行し、(応答本文, 確信度, 使用量) を返す。
+        使用量は (レイテンシ, 入力トークン, 出力トークン, 推定コスト) で、受理・エスカレーションの判定後に記録する。
+        """
+        started = time.perf_counter()
+        try:
+            response = await self.gateway.chat(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                logprobs=logprobs,
+            )
+        except Exception:
+            self.metrics.record(task, model, "errors", latency=time.perf_counter() - started)
+            raise
+        latency = time.perf_counter() - started
+
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        usage_stats = (latency, prompt_tokens, completion_tokens, _estimate_cost(model, prompt_tokens, completion_tokens))
+
+        choice = response.choices[0]
+        confidence = _answer_confidence(choice) if logprobs else 1.0
+        return choice.message.content.strip(), confidence, usage_stats
+
+    def _record_call(self, task: str, model: str, outcome: str, usage_stats: tuple) -> None:
+        latency, prompt_tokens, completion_tokens, cost = usage_stats
+        self.metrics.record(task, model, outcome, latency=latency, prompt_tokens=prompt_tokens,
+                            completion_tokens=completion_tokens, cost=cost)
+
+    async def generate(self, task: str, messages: list, max_tokens: int, temperature: float, model: str | None = None) -> str:
+        """確信度を判定しない生成タスク (要約など) を1段で実行する"""
+        model = model or self.models[0]
+        content, _, usage_stats = await self.complete(task, model, messages, max_tokens, temperature)
+        self._record_call(task, model, "accepted", usage_stats)
+        return content
+
+    async def classify(self, task: str, messages: list, parse: Callable[[str], Any], max_tokens: int, temperature: float,
+                 local_result: tuple[Any, float] | None = None) -> Any:
+        """
+        分類タスクをカスケード実行する。
+        local_result に語彙ベースの (結果, 確信度) を渡すと、確信度が閾値以上ならモデルを呼ばずにそれを返す。
+        parse は応答本文を結果に変換し、解釈できなければ None を返す関数。
+        どの段でも閾値に届かなければ最後の段の結果を返す。
+        """
+        if local_result is not None:
+            value, confidence = local_result
+            if value is not None and confidence >= self.confidence_threshold:
+                self.metrics.record(task, LEXICON_TIER, "accepted")
+                return value
+            self.metrics.record(task, LEXICON_TIER, "escalated")
+
+        last_error = None
+        fallback = None
+        for index, model in enumerate(self.models):
+            is_last = index == len(self.models) - 1
+            try:
+                content, confidence, usage_stats = await self.complete(task, model, messages, max_tokens, temperature, logprobs=True)
+            except openai.APIError as e:
+                logger.warning("Cascade tier %s failed for %s: %s", model, task, e)
+                last_error = e
+                continue
+
+            value = parse(content)
+            if value is None:
+                confidence = 0.0
+            else:
+                fallback = value
+            if confidence >= self.confidence_threshold or is_last:
+                self._record_call(task, model, "accepted", usage_stats)
+                logger.debug("Cascade %s: accepted %r from %s (confidence=%.2f)", task, value, model, confidence)
+                return value if value is not None else fallback
+            self._record_call(task, model, "escalated", usage_stats)
+            logger.debug("Cascade %s: escalating from %s (confidence=%.2f)", task, model, confidence)
+
+        if fallback is not None:
+            return fallback
+        if last_error is not None:
+            raise last_error
+        return None
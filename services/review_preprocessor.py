@@ -0,0 +1,181 @@
+"""
+LLM に送る前のレビュー前処理。
+
+- 文字 n-gram の MinHash で重複・定型レビューを除く
+- 文字数ではなくトークン数で予算を管理する (tiktoken が無い環境では概算)
+- 喫煙・雰囲気に関する文を優先し、文の途中で切らずに予算内へ詰める
+"""
+import logging
+import re
+import unicodedata
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken はオプション
+    tiktoken = None
+
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+DUPLICATE_THRESHOLD = 0.8 # 推定 Jaccard 係数がこれ以上なら重複とみなす
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+SMOKING_KEYWORDS = ("禁煙", "喫煙", "分煙", "タバコ", "たばこ", "煙草", "煙", "タバコ臭", "換気", "空気清浄")
+ATMOSPHERE_KEYWORDS = ("雰囲気", "店員", "スタッフ", "接客", "清潔", "綺麗", "きれい", "汚", "広", "狭",
+                       "客層", "常連", "初心者", "うるさ", "静か", "マナー", "居心地")
+
+PRIORITY_SMOKING = 0
+PRIORITY_ATMOSPHERE = 1
+PRIORITY_OTHER = 2
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[。！？!?])|\n+')
+_NORMALIZE_STRIP = re.compile(r'[\s\W_]+')
+
+# 固定の係数で MinHash の疑似置換を作る (プロセス間で結果を再現できるようにする)
+_PERMUTATIONS = [
+    ((i * 0x9E3779B1 + 0x7F4A7C15) % _MERSENNE_PRIME | 1, (i * 0x85EBCA6B + 0xC2B2AE35) % _MERSENNE_PRIME)
+    for i in range(1, MINHASH_PERMUTATIONS + 1)
+]
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning("Failed to load tiktoken encoding, falling back to estimation: %s", e)
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """トークン数を返す。tiktoken が無い場合は ASCII 4文字=1トークン、それ以外1文字=1トークンで概算する"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE_STRIP.sub('', unicodedata.normalize('NFKC', text).lower())
+
+
+def minhash_signature(text: str) -> tuple:
+    """文字 n-gram 集合の MinHash シグネチャを返す"""
+    normalized = _normalize(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimate_similarity(signature_a: tuple, signature_b: tuple) -> float:
+    """2つの MinHash シグネチャから Jaccard 係数を推定する"""
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a)
+
+
+def find_duplicates(texts: list[str], threshold: float = DUPLICATE_THRESHOLD) -> list[int]:
+    """
+    各テキストについて、重複元となる先行テキストの添字を返す (重複でなければ自分自身の添字)。
+    レビューは1店舗あたり数件なので、シグネチャ同士を総当たりで比較する。
+    """
+    representatives: list[tuple[int, tuple]] = []
+    mapping = []
+    for i, text in enumerate(texts):
+        signature = minhash_signature(text or '')
+        for j, representative_signature in representatives:
+            if estimate_similarity(signature, representative_signature) >= threshold:
+                mapping.append(j)
+                break
+        else:
+            representatives.append((i, signature))
+            mapping.append(i)
+    return mapping
+
+
+def dedupe_reviews(texts: list[str], threshold: float = DUPLICATE_THRESHOLD) -> list[str]:
+    """重複・定型レビューを除いたリストを返す (最初に現れたものを残す)"""
+    mapping = find_duplicates(texts, threshold)
+    unique = [text for i, text in enumerate(texts) if mapping[i] == i]
+    if len(unique) < len(texts):
+        logger.debug("Removed %s near-duplicate reviews out of %s.", len(texts) - len(unique), len(texts))
+    return unique
+
+
+def split_sentences(text: str) -> list[str]:
+    """レビューを文に分割する"""
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text) if sentence and sentence.strip()]
+
+
+def sentence_priority(sentence: str) -> int:
+    """喫煙に関する文 > 雰囲気に関する文 > その他 の順に小さい値を返す"""
+    if any(keyword in sentence for keyword in SMOKING_KEYWORDS):
+        return PRIORITY_SMOKING
+    if any(keyword in sentence for keyword in ATMOSPHERE_KEYWORDS):
+        return PRIORITY_ATMOSPHERE
+    return PRIORITY_OTHER
+
+
+def pack_reviews(texts: list[str], token_budget: int, bullet: str = "- ") -> list[str]:
+    """
+    レビューの文を優先度順に予算内へ詰め、レビューごとに元の文順で並べ直して返す。
+    予算に収まらない文は丸ごと省き、文の途中では切らない。
+    """
+    candidates = []
+    for review_index, text in enumerate(texts):
+        for sentence_index, sentence in enumerate(split_sentences(text)):
+            candidates.append((sentence_priority(sentence), review_index, sentence_index, sentence))
+    candidates.sort(key=lambda c: (c[0], c[1], c[2]))
+
+    bullet_tokens = count_tokens(bullet + "\n")
+    selected: dict[int, list[tuple[int, str]]] = {}
+    used = 0
+    for _, review_index, sentence_index, sentence in candidates:
+        cost = count_tokens(sentence)
+        if review_index not in selected:
+            cost += bullet_tokens
+        if used + cost > token_budget:
+            continue
+        used += cost
+        selected.setdefault(review_index, []).append((sentence_index, sentence))
+
+    packed = []
+    for review_index in sorted(selected):
+        sentences = [sentence for _, sentence in sorted(selected[review_index])]
+        packed.append(" ".join(sentences))
+    return packed
+
+
+def prepare_reviews(texts: list[str], token_budget: int) -> list[str]:
+    """重複を除いた上で、トークン予算内に喫煙・雰囲気の文を優先して詰めたレビューのリストを返す"""
+    texts = [text for text in texts if text and text.strip()]
+    unique = dedupe_reviews(texts)
+    packed = pack_reviews(unique, token_budget)
+    logger.debug("Prepared reviews: %s input, %s unique, %s packed within %s tokens.", len(texts), len(unique), len(packed), token_budget)
+    return packed
+
+
+def truncate_to_tokens(text: str, token_budget: int) -> str:
+    """1件のテキストを、優先度の高い文から予算内に収まるだけ残して返す"""
+    if count_tokens(text) <= token_budget:
+        return text
+    packed = pack_reviews([text], token_budget)
+    if packed:
+        return packed[0]
+    # 1文だけで予算を超える場合は先頭から切る (日本語は1文字1トークン以上なので文字数で近似)
+    return text[:token_budget]
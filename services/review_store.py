@@ -0,0 +1,85 @@
+import hashlib
+import logging
+from datetime import datetime, timezone
+from .data_access import PostgrestPool
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'jongso_reviews'
+
+# レビュー本文から喫煙状況の手がかりを拾うための語彙 (判定順に評価する)
+SMOKING_SIGNAL_KEYWORDS = [
+    ("分煙", ["分煙", "喫煙室", "喫煙ルーム", "喫煙スペース", "喫煙ブース", "禁煙席"]),
+    ("喫煙可", ["喫煙可", "タバコ臭", "たばこ臭", "煙草臭", "煙い", "タバコの煙", "喫煙者が多"]),
+    ("禁煙", ["完全禁煙", "全席禁煙", "禁煙", "ノンスモーキング"]),
+]
+
+
+def review_hash(review: dict) -> str:
+    """著者と投稿時刻からレビューを識別するハッシュを作る (どちらもなければ本文を使う)"""
+    author = review.get('author_name') or review.get('author_url') or ''
+    posted_at = review.get('time')
+    if author or posted_at is not None:
+        source = f"{author}\x1f{posted_at}"
+    else:
+        source = review.get('text', '')
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def detect_smoking_signal(text: str) -> str | None:
+    """レビュー本文に喫煙状況の手がかりがあれば、該当する区分を返す"""
+    if not text:
+        return None
+    for status, keywords in SMOKING_SIGNAL_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return status
+    return None
+
+
+class ReviewStore:
+    """レビュー単位の分析結果 (jongso_reviews) の読み書きを担当する"""
+
+    def __init__(self, db_pool: PostgrestPool | None):
+        self.db_pool = db_pool
+
+    async def get_reviews(self, place_id: str) -> dict:
+        """店舗の分析済みレビューを review_hash -> レコード で返す"""
+        if not self.db_pool:
+            return {}
+        try:
+            rows = await self.db_pool.select(
+                "reviews.get", TABLE_NAME,
+                "review_hash, positive_score, negative_score, smoking_signal, review_time",
+                [("place_id", f"eq.{place_id}")]
+            )
+            return {row['review_hash']: row for row in rows}
+        except Exception as e:
+            logger.error("Error fetching analyzed reviews for %s: %s", place_id, e, exc_info=True)
+            return {}
+
+    async def save_reviews(self, place_id: str, analyzed: list) -> None:
+        """
+        新たに分析したレビューを保存する。
+        analyzed は (Google のレビュー dict, センチメント結果 dict) のタプルのリスト。
+        """
+        if not self.db_pool or not analyzed:
+            return
+        analyzed_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {
+                'place_id': place_id,
+                'review_hash': review_hash(review),
+                'author_name': review.get('author_name'),
+                'review_time': review.get('time'),
+                'positive_score': result.get('positive_score'),
+                'negative_score': result.get('negative_score'),
+                'smoking_signal': detect_smoking_signal(review.get('text', '')),
+                'analyzed_at': analyzed_at,
+            }
+            for review, result in analyzed
+        ]
+        try:
+            await self.db_pool.upsert("reviews.save", TABLE_NAME, rows)
+            logger.debug("Saved %s analyzed reviews for %s.", len(rows), place_id)
+        except Exception as e:
+            logger.error("Error saving analyzed reviews for %s: %s", place_id, e, exc_info=True)
@@ -1,104 +1,168 @@
+import asyncio
 import logging
 import openai
+from .review_preprocessor import find_duplicates, prepare_reviews, truncate_to_tokens
+from .lexicon import lexicon_sentiment, lexicon_smoking
+from .model_cascade import ModelCascade
+from .llm_gateway import LLMGateway, get_gateway
+from .circuit_breaker import CircuitOpenError
+from .shared_cache import TieredCache, make_key
 
 logger = logging.getLogger(__name__)
 
+MAX_TEXT_TOKENS = 300 # センチメント分析で1レビューあたりに送る最大トークン数
+REVIEW_TOKEN_BUDGET = 1200 # 喫煙判定・要約のプロンプトに含めるレビューの合計最大トークン数
+DEFAULT_SUMMARY_MODEL = "gpt-3.5-turbo"
+SMOKING_STATUSES = ("喫煙可", "禁煙", "分煙", "不明")
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 3600 # 同じプロンプトの分析結果を共有キャッシュに置く秒数
+
+
+def _parse_sentiment_score(content):
+    """モデルの応答から 0〜10 のスコアを取り出す。解釈できなければ None"""
+    try:
+        # 小数点を含む場合も考慮し、0から10の範囲に収める
+        return max(0, min(10, round(float(content))))
+    except ValueError:
+        logger.warning("Failed to parse sentiment score from OpenAI response: '%s'.", content)
+        return None
+
+
+def _parse_smoking_status(content):
+    """モデルの応答を喫煙状況の区分に正規化する。想定外の応答は None"""
+    for status in SMOKING_STATUSES:
+        if status in content:
+            return status
+    logger.warning("Unexpected smoking status response from OpenAI: '%s'.", content)
+    return None
+
+
 class SentimentAnalysisService:
     """テキストのセンチメント分析と要約を行うサービスクラス"""
-    def __init__(self, api_key: str | None = None):
-        if not api_key:
+    def __init__(self, api_key: str | None = None, cascade_models: list[str] | None = None,
+                 confidence_threshold: float | None = None, summary_model: str | None = None,
+                 gateway: LLMGateway | None = None, cache: TieredCache | None = None):
+        self.summary_model = summary_model or DEFAULT_SUMMARY_MODEL
+        if gateway is not None:
+            self.gateway = gateway
+        elif not api_key:
             logger.warning("OpenAI API Key is not provided. Summarization feature will be disabled.")
-            self.client = None
+            self.gateway = None
         else:
             try:
-                self.client = openai.OpenAI(api_key=api_key)
-                logger.info("OpenAI client initialized successfully for SentimentAnalysisService.")
+                # 他の分析クラスとコネクションプールを共有する
+                self.gateway = get_gateway(api_key)
+                logger.info("OpenAI gateway initialized successfully for SentimentAnalysisService.")
             except Exception as e:
-                logger.error(f"Failed to initialize OpenAI client: {e}", exc_info=True)
-                self.client = None
+                logger.error("Failed to initialize OpenAI gateway: %s", e, exc_info=True)
+                self.gateway = None
+        # 語彙ベース → 小さいモデル → 大きいモデル の順に、確信度が足りない場合だけ次の段へ回す
+        self.cascade = ModelCascade(self.gateway, cascade_models, confidence_threshold)
+        # 同じプロンプトの結果はインスタンス間で共有するキャッシュから返す (判定できなかった結果・エラーはキャッシュしない)
+        self.llm_cache = cache.namespace("llm", LLM_CACHE_TTL_SECONDS) if cache else None
+
+    async def _cached_llm(self, task: str, messages: list, call):
+        """call (カスケードを呼ぶコルーチン関数) の結果を、タスク・プロンプト・モデル構成ごとにキャッシュする"""
+        if self.llm_cache is None:
+            return await call()
+        key = make_key(task, messages, self.cascade.models, self.summary_model)
+        return await self.llm_cache.aget_or_compute(key, call, cache_if=lambda result: result is not None)
 
     def _check_client(self):
         """OpenAIクライアントが初期化されているかチェック"""
-        if not self.client:
+        if not self.gateway:
             logger.warning("OpenAI client is not initialized. Cannot perform operation.")
             return False
         return True
 
-    def analyze_text_list(self, text_list):
-        """複数のテキストのセンチメントスコアを OpenAI を使って計算する"""
+    async def analyze_text_list(self, text_list):
+        """
+        複数のテキストのセンチメントスコアを OpenAI を使って計算する。
+        各結果の analyzed は、スコアが実際に評価されたものか (False はエラー等による既定値) を示す。
+        OpenAI のブレーカーが open の場合は CircuitOpenError を送出する (呼び出し元で縮退モードとして扱う)。
+        """
         if not self._check_client():
             logger.warning("OpenAI client not available, returning dummy sentiment scores.")
             # クライアントがない場合は、以前のダミーロジックを簡易的に返すか、デフォルト値を返す
-            return [{'text': text, 'positive_score': 5, 'negative_score': 5} for text in text_list]
+            return [{'text': text, 'positive_score': 5, 'negative_score': 5, 'analyzed': False} for text in text_list]
+
+        logger.info("Analyzing sentiment for %s texts using OpenAI.", len(text_list))
+        # ほぼ同一のレビューは最初の1件だけ分析し、同じスコアを使う
+        duplicate_of = find_duplicates(text_list)
+        unique_indices = [i for i in range(len(text_list)) if duplicate_of[i] == i]
+        unique_results = await asyncio.gather(*(self._analyze_text(text_list[i]) for i in unique_indices), return_exceptions=True)
+        for result in unique_results:
+            if isinstance(result, BaseException):
+                # 他のテキストの分析を待ってから送出する (途中で open になった場合、既定値のスコアを返さない)
+                raise result
+        results_by_index = dict(zip(unique_indices, unique_results))
 
-        logger.info(f"Analyzing sentiment for {len(text_list)} texts using OpenAI.")
         results = []
-        for text in text_list:
-            if not text or len(text.strip()) < 10: # 短すぎるテキストは分析スキップ
-                logger.debug(f"Skipping sentiment analysis for short/empty text: '{text[:20]}...'")
-                results.append({'text': text, 'positive_score': 5, 'negative_score': 5})
-                continue
-
-            # トークン数削減のため、長すぎるレビューは切り詰める
-            MAX_TEXT_LENGTH = 500 # センチメント分析対象の最大文字数 (調整可能)
-            truncated_text = text[:MAX_TEXT_LENGTH]
-            if len(text) > MAX_TEXT_LENGTH:
-                logger.debug(f"Truncating long text for sentiment analysis: '{truncated_text[:20]}...'")
+        for i, text in enumerate(text_list):
+            if duplicate_of[i] != i:
+                logger.debug("Reusing sentiment score for near-duplicate text: '%s...'", text[:20])
+                results.append(dict(results_by_index[duplicate_of[i]], text=text))
+            else:
+                results.append(results_by_index[i])
+        return results
 
-            prompt = f"以下のレビュー文のセンチメントを分析し、ポジティブ度を0から10の数値で評価してください。0が非常にネガティブ、10が非常にポジティブです。数値のみを回答してください。\n\nレビュー: {truncated_text}"
+    async def _analyze_text(self, text):
+        """1件のテキストのセンチメントスコアを計算する"""
+        if not text or len(text.strip()) < 10: # 短すぎるテキストは分析スキップ
+            logger.debug("Skipping sentiment analysis for short/empty text: '%s...'", text[:20])
+            return {'text': text, 'positive_score': 5, 'negative_score': 5, 'analyzed': True}
 
-            positive_score = 5 # デフォルトは中立
-            negative_score = 5
+        # トークン数削減のため、長すぎるレビューは喫煙・雰囲気に関する文を優先して文単位で削る
+        truncated_text = truncate_to_tokens(text, MAX_TEXT_TOKENS)
+        if truncated_text != text:
+            logger.debug("Truncating long text for sentiment analysis: '%s...'", truncated_text[:20])
 
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "あなたはテキストのセンチメントを0から10の数値で評価するAIです。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.2, # 低めの温度で安定した評価を促す
-                    max_tokens=10 # 数値だけを期待
-                )
-
-                content = response.choices[0].message.content.strip()
-                # 数値のみを抽出する試み (より頑健なパースが必要な場合もある)
-                extracted_score = None
-                try:
-                    # 小数点を含む場合も考慮
-                    score_float = float(content)
-                    # 0から10の範囲に収める (可読性のため段階的に処理)
-                    score_rounded = round(score_float)
-                    extracted_score = max(0, min(10, score_rounded))
-                except ValueError:
-                     # f-string を使わない形式に変更
-                     log_message = "Failed to parse sentiment score from OpenAI response: '{}'. Using default score.".format(content)
-                     logger.warning(log_message)
-
-                if extracted_score is not None:
-                    positive_score = extracted_score
-                    negative_score = 10 - positive_score # ポジティブ度からネガティブ度を算出
-                    logger.debug(f"OpenAI sentiment score for '{truncated_text[:20]}...': {positive_score}/10")
-                else:
-                    logger.warning(f"Could not extract a valid score (0-10) from response: '{content}'. Using default 5/10.")
-
-            except openai.APIError as e:
-                logger.error(f"OpenAI API error during sentiment analysis for '{truncated_text[:20]}...': {e}")
-                # エラー時はデフォルト値を使用
-            except Exception as e:
-                logger.error(f"Unexpected error during sentiment analysis for '{truncated_text[:20]}...': {e}", exc_info=True)
-                # エラー時はデフォルト値を使用
+        prompt = f"以下のレビュー文のセンチメントを分析し、ポジティブ度を0から10の数値で評価してください。0が非常にネガティブ、10が非常にポジティブです。数値のみを回答してください。\n\nレビュー: {truncated_text}"
 
-            results.append({
-                'text': text, # 元のテキストを返す
-                'positive_score': positive_score,
-                'negative_score': negative_score
-            })
+        positive_score = 5 # デフォルトは中立
+        negative_score = 5
+        analyzed = False
 
-        return results
+        try:
+            messages = [
+                {"role": "system", "content": "あなたはテキストのセンチメントを0から10の数値で評価するAIです。"},
+                {"role": "user", "content": prompt}
+            ]
+            extracted_score = await self._cached_llm("sentiment", messages, lambda: self.cascade.classify(
+                "sentiment",
+                messages=messages,
+                parse=_parse_sentiment_score,
+                max_tokens=10, # 数値だけを期待
+                temperature=0.2, # 低めの温度で安定した評価を促す
+                local_result=lexicon_sentiment(text)
+            ))
+
+            if extracted_score is not None:
+                positive_score = extracted_score
+                negative_score = 10 - positive_score # ポジティブ度からネガティブ度を算出
+                analyzed = True
+                logger.debug("Sentiment score for '%s...': %s/10", truncated_text[:20], positive_score)
+            else:
+                logger.warning("Could not extract a valid score (0-10) for '%s...'. Using default 5/10.", truncated_text[:20])
 
-    def get_smoking_status_from_reviews(self, reviews):
-        """レビューリストから OpenAI を使って喫煙情報を判定する"""
+        except CircuitOpenError:
+            # 既定値のスコアを返すと分析済みとして保存されるため、呼び出し元に縮退モードとして扱わせる
+            raise
+        except openai.APIError as e:
+            logger.error("OpenAI API error during sentiment analysis for '%s...': %s", truncated_text[:20], e)
+            # エラー時はデフォルト値を使用
+        except Exception as e:
+            logger.error("Unexpected error during sentiment analysis for '%s...': %s", truncated_text[:20], e, exc_info=True)
+            # エラー時はデフォルト値を使用
+
+        return {
+            'text': text, # 元のテキストを返す
+            'positive_score': positive_score,
+            'negative_score': negative_score,
+            'analyzed': analyzed
+        }
+
+    async def get_smoking_status_from_reviews(self, reviews):
+        """レビューリストから OpenAI を使って喫煙情報を判定する (ブレーカーが open の場合は CircuitOpenError)"""
         if not self._check_client():
             logger.warning("OpenAI client not available, cannot determine smoking status.")
             return "不明" # クライアントがない場合は不明を返す
@@ -106,21 +170,16 @@ class SentimentAnalysisService:
             logger.debug("No reviews provided to determine smoking status.")
             return "不明"
 
-        logger.info(f"Determining smoking status from {len(reviews)} reviews using OpenAI.")
+        logger.info("Determining smoking status from %s reviews using OpenAI.", len(reviews))
 
-        # プロンプト用にレビューテキストを結合・整形
-        MAX_REVIEW_LENGTH = 300 # 1レビューあたりの最大文字数
-        review_texts = "\n".join([f"- {r.get('text', '')[:MAX_REVIEW_LENGTH]}" for r in reviews if r.get('text')])
+        # プロンプト用にレビューテキストを重複除去し、喫煙に関する文を優先してトークン予算内に詰める
+        packed_reviews = prepare_reviews([r.get('text', '') for r in reviews], REVIEW_TOKEN_BUDGET)
+        review_texts = "\n".join(f"- {text}" for text in packed_reviews)
 
         if not review_texts:
              logger.warning("No valid review texts found to determine smoking status.")
              return "不明"
 
-        MAX_TOTAL_LENGTH = 3000 # プロンプトに含めるレビューの合計最大文字数
-        if len(review_texts) > MAX_TOTAL_LENGTH:
-            logger.warning(f"Review texts length ({len(review_texts)}) exceeds limit ({MAX_TOTAL_LENGTH}) for smoking status check, truncating.")
-            review_texts = review_texts[:MAX_TOTAL_LENGTH] + "... (一部省略)"
-
         prompt = f"""以下の麻雀店に関する複数のレビューを読み、喫煙情報を判定してください。
 レビュー内容から判断できる場合、「喫煙可」「禁煙」「分煙」のいずれか該当するものを、最も可能性が高いもの一つだけ選んでください。
 判断できない場合は「不明」と回答してください。回答は「喫煙可」「禁煙」「分煙」「不明」のいずれかのみとしてください。
@@ -130,80 +189,74 @@ class SentimentAnalysisService:
 """
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini", # 喫煙情報判定に適したモデルを選択
-                messages=[
-                    {"role": "system", "content": "あなたはユーザーレビューから麻雀店の喫煙情報を「喫煙可」「禁煙」「分煙」「不明」のいずれかで判定するAIアシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
+            messages = [
+                {"role": "system", "content": "あなたはユーザーレビューから麻雀店の喫煙情報を「喫煙可」「禁煙」「分煙」「不明」のいずれかで判定するAIアシスタントです。"},
+                {"role": "user", "content": prompt}
+            ]
+            smoking_status = await self._cached_llm("smoking", messages, lambda: self.cascade.classify(
+                "smoking",
+                messages=messages,
+                parse=_parse_smoking_status,
+                max_tokens=10, # 「喫煙可」「禁煙」「分煙」「不明」のいずれかの単語のみを期待
                 temperature=0.1, # 低めの温度で安定した判定を促す
-                max_tokens=10 # 「喫煙可」「禁煙」「分煙」「不明」のいずれかの単語のみを期待
-            )
-
-            smoking_status_raw = response.choices[0].message.content.strip()
-            # 判定結果を正規化
-            if "喫煙可" in smoking_status_raw:
-                smoking_status = "喫煙可"
-            elif "禁煙" in smoking_status_raw:
-                smoking_status = "禁煙"
-            elif "分煙" in smoking_status_raw:
-                smoking_status = "分煙"
-            else:
-                smoking_status = "不明" # 想定外の応答や判定不能の場合
+                local_result=lexicon_smoking([r.get('text', '') for r in reviews])
+            )) or "不明" # 想定外の応答や判定不能の場合
 
-            logger.info(f"Determined smoking status using OpenAI: {smoking_status} (Raw: '{smoking_status_raw}')")
+            logger.info("Determined smoking status: %s", smoking_status)
             return smoking_status
+        except CircuitOpenError:
+            raise
         except openai.APIError as e:
-            logger.error(f"OpenAI API returned an API Error during smoking status check: {e}")
+            logger.error("OpenAI API returned an API Error during smoking status check: %s", e)
             return "不明" # エラー時は不明
         except Exception as e:
-            logger.error(f"An unexpected error occurred during OpenAI smoking status check: {e}", exc_info=True)
+            logger.error("An unexpected error occurred during OpenAI smoking status check: %s", e, exc_info=True)
             return "不明" # エラー時は不明
 
-    def get_summary_from_reviews(self, reviews):
-        """レビューリストから OpenAI を使って要約を生成する"""
+    async def get_summary_from_reviews(self, reviews, previous_summary=None):
+        """
+        レビューリストから OpenAI を使って要約を生成する。
+        previous_summary を渡すと、以前の要約を新しいレビューで更新する形で要約する。
+        ブレーカーが open の場合は CircuitOpenError を送出する。
+        """
         if not self._check_client():
             return "要約機能は利用できません (APIキー未設定)"
         if not reviews:
             return "レビューがありません。"
 
-        logger.info(f"Generating summary from {len(reviews)} reviews using OpenAI.")
+        logger.info("Generating summary from %s reviews using OpenAI.", len(reviews))
 
-        # プロンプト用にレビューテキストを結合・整形
-        # 長すぎるレビューは切り詰めるなど、トークン数制限への配慮が必要
-        MAX_REVIEW_LENGTH = 300 # 1レビューあたりの最大文字数 (調整可能)
-        review_texts = "\n".join([f"- {r.get('text', '')[:MAX_REVIEW_LENGTH]}" for r in reviews if r.get('text')])
+        # プロンプト用にレビューテキストを重複除去し、喫煙・雰囲気に関する文を優先してトークン予算内に詰める
+        packed_reviews = prepare_reviews([r.get('text', '') for r in reviews], REVIEW_TOKEN_BUDGET)
+        review_texts = "\n".join(f"- {text}" for text in packed_reviews)
 
         if not review_texts:
              logger.warning("No valid review texts found to generate summary.")
              return "要約対象のレビューが見つかりません。"
 
-        # トークン数を考慮してレビュー数を制限する方が安全
-        # ここでは簡易的に文字数で制限
-        MAX_TOTAL_LENGTH = 3000 # プロンプトに含めるレビューの合計最大文字数 (調整可能)
-        if len(review_texts) > MAX_TOTAL_LENGTH:
-            logger.warning(f"Review texts length ({len(review_texts)}) exceeds limit ({MAX_TOTAL_LENGTH}), truncating.")
-            review_texts = review_texts[:MAX_TOTAL_LENGTH] + "... (一部省略)"
-
         prompt = f"以下の麻雀店に関する複数のレビューを読み、ポジティブな点とネガティブな点を簡潔に1〜2文で要約してください。箇条書きではなく、自然な文章でお願いします。:\n\n{review_texts}"
+        if previous_summary:
+            prompt = f"以下は麻雀店の以前のレビュー要約と、その後に投稿された新しいレビューです。新しいレビューの内容を反映して、ポジティブな点とネガティブな点を簡潔に1〜2文で要約し直してください。箇条書きではなく、自然な文章でお願いします。\n\n以前の要約:\n{previous_summary}\n\n新しいレビュー:\n{review_texts}"
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo", # または他の適切なモデル
-                messages=[
-                    {"role": "system", "content": "あなたはユーザーレビューを要約するAIアシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
+            messages = [
+                {"role": "system", "content": "あなたはユーザーレビューを要約するAIアシスタントです。"},
+                {"role": "user", "content": prompt}
+            ]
+            summary = await self._cached_llm("summary", messages, lambda: self.cascade.generate(
+                "summary",
+                messages=messages,
+                max_tokens=150, # 要約の最大長 (調整可能)
                 temperature=0.5, # 低めの温度で事実に基づいた要約を促す
-                max_tokens=150 # 要約の最大長 (調整可能)
-            )
-
-            summary = response.choices[0].message.content.strip()
-            logger.info(f"Successfully generated summary using OpenAI: {summary[:50]}...")
+                model=self.summary_model
+            ))
+            logger.debug("Successfully generated summary using OpenAI: %s...", summary[:50])
             return summary
+        except CircuitOpenError:
+            raise
         except openai.APIError as e:
-            logger.error(f"OpenAI API returned an API Error: {e}")
+            logger.error("OpenAI API returned an API Error: %s", e)
             return "レビューの要約中にAPIエラーが発生しました。"
         except Exception as e:
-            logger.error(f"An unexpected error occurred during OpenAI summarization: {e}", exc_info=True)
+            logger.error("An unexpected error occurred during OpenAI summarization: %s", e, exc_info=True)
             return "レビューの要約中に予期せぬエラーが発生しました。"
\ No newline at end of file
@@ -0,0 +1,496 @@
+"""
+インスタンス間で共有できる2段のキャッシュ。
+
+- 前段: プロセス内の LRU (LocalTier)。TTL 付きで件数を制限する
+- 中段: ディスク上の SQLite (services/disk_cache.py の DiskTier、オプション)。Vercel の /tmp などに置き、
+  プロセスが入れ替わってもウォームなインスタンスで使い回す
+- 後段: Redis プロトコルを話す共有ストア (RedisTier、オプション)。uvicorn のワーカー間・Vercel のインスタンス間で
+  ジオコーディング・周辺検索・Place Details・LLM の結果を共有する
+- 値は services/fast_json.py で JSON 化して保存する (dict / list / 数値 / 文字列 / None と、to_dict を持つ値)。
+  取り出すたびに新しいオブジェクトになるため、呼び出し元が結果を書き換えてもキャッシュには影響しない
+- 同じキーの計算は、プロセス内では1つにまとめ (シングルフライト)、インスタンス間では Redis のロック (SET NX PX) を
+  取れたインスタンスだけが上流を呼び、他は結果が書き込まれるのを LOCK_WAIT_SECONDS まで待つ (キャッシュスタンピード対策)
+- TTL は ±TTL_JITTER_RATIO の範囲でずらし、同時に期限切れになるのを避ける
+- 名前空間 (geocode / place_details / llm など) ごとにヒット・ミス・合流・待機の回数を記録する
+
+後段でエラーが起きても呼び出しは失敗させず、REMOTE_COOLDOWN_SECONDS の間は前段だけで動く。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from .disk_cache import DiskTier, DEFAULT_MAX_BYTES as DEFAULT_DISK_MAX_BYTES
+from .executors import get_executor, DB_EXECUTOR
+from .fast_json import dumps, loads
+
+try:
+    import redis
+except ImportError:  # redis はオプション (REDIS_URL を設定する場合だけ必要)
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 3600
+LOCAL_MAX_TTL_SECONDS = 300 # 前段に置く最大秒数 (他インスタンスの delete が遅くともこの秒数で反映される)
+TTL_JITTER_RATIO = 0.1
+LOCK_TTL_SECONDS = 10.0 # インスタンス間ロックの保持上限 (計算中にプロセスが落ちてもこの秒数で解放される)
+LOCK_WAIT_SECONDS = 2.0 # 他のインスタンスの計算結果を待つ最大秒数 (過ぎたら自分で計算する)
+LOCK_POLL_SECONDS = 0.05
+DEFAULT_REMOTE_TIMEOUT_SECONDS = 0.2
+REMOTE_COOLDOWN_SECONDS = 30.0
+
+_MISSING = object()
+
+
+def make_key(*parts) -> str:
+    """引数 (JSON 化できる値) から固定長のキーを作る"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _jittered(ttl: float) -> float:
+    return ttl * random.uniform(1 - TTL_JITTER_RATIO, 1 + TTL_JITTER_RATIO)
+
+
+class LocalTier:
+    """プロセス内の LRU。キー -> (期限, JSON 化したバイト列)"""
+
+    def __init__(self, max_entries: int = DEFAULT_LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisTier:
+    """Redis (または Redis プロトコル互換のサーバー) を使う共有の後段"""
+
+    def __init__(self, url: str, prefix: str = "jongso:", timeout: float = DEFAULT_REMOTE_TIMEOUT_SECONDS):
+        if redis is None:
+            raise RuntimeError("redis パッケージがインストールされていません。")
+        self.prefix = prefix
+        # 使うコマンドは RESP2 で足りるため、互換サーバーでも動くよう RESP2 で接続する
+        self.client = redis.Redis.from_url(url, protocol=2, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        self.client.set(self.prefix + key, data, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def try_lock(self, key: str, ttl: float) -> str | None:
+        """ロックを取れたらトークンを返す"""
+        token = secrets.token_hex(8)
+        if self.client.set(f"{self.prefix}lock:{key}", token, nx=True, px=max(1, int(ttl * 1000))):
+            return token
+        return None
+
+    def unlock(self, key: str, token: str) -> None:
+        """自分が取ったロックだけを外す (期限切れ後に他のインスタンスが取ったロックは残す)"""
+        lock_key = f"{self.prefix}lock:{key}"
+        if self.client.get(lock_key) == token.encode():
+            self.client.delete(lock_key)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class TieredCache:
+    """各段をまとめ、名前空間ごとのビュー (CacheNamespace) を提供する"""
+
+    def __init__(self, local: LocalTier | None = None, remote: RedisTier | None = None,
+                 lock_wait: float = LOCK_WAIT_SECONDS, lock_ttl: float = LOCK_TTL_SECONDS, disk: DiskTier | None = None):
+        self.local = local or LocalTier()
+        self.disk = disk
+        self.remote = remote
+        # 中段・後段の同期の読み書きは、Google の呼び出しと分けた db のプールで行う (services/executors.py)
+        self.executor = get_executor(DB_EXECUTOR)
+        self.lock_wait = lock_wait
+        self.lock_ttl = lock_ttl
+        self._namespaces: dict[str, CacheNamespace] = {}
+        self._lock = threading.Lock()
+        self._remote_disabled_until = 0.0
+        self.remote_errors = 0
+
+    def namespace(self, name: str, ttl: float = DEFAULT_TTL_SECONDS) -> "CacheNamespace":
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = self._namespaces[name] = CacheNamespace(self, name, ttl)
+            return namespace
+
+    def near_get(self, full_key: str, ttl: float) -> tuple[bytes | None, str | None]:
+        """前段・中段 (同じマシン上の段) から探し、(データ, 見つかった段) を返す。中段で見つかれば前段に置く"""
+        data = self.local.get(full_key)
+        if data is not None:
+            return data, "local"
+        if self.disk is not None:
+            data = self.disk.get(full_key)
+            if data is not None:
+                self.local.set(full_key, data, min(ttl, LOCAL_MAX_TTL_SECONDS))
+                return data, "disk"
+        return None, None
+
+    def near_set(self, full_key: str, data: bytes, ttl: float) -> None:
+        """前段・中段に置く (中段には TTL いっぱいまで置く)"""
+        self.local.set(full_key, data, min(ttl, LOCAL_MAX_TTL_SECONDS))
+        if self.disk is not None:
+            self.disk.set(full_key, data, ttl)
+
+    def near_delete(self, full_key: str) -> None:
+        self.local.delete(full_key)
+        if self.disk is not None:
+            self.disk.delete(full_key)
+
+    async def anear_get(self, full_key: str, ttl: float) -> tuple[bytes | None, str | None]:
+        """near_get の非同期版。前段で見つからず中段がある場合だけスレッドで読む"""
+        data = self.local.get(full_key)
+        if data is not None:
+            return data, "local"
+        if self.disk is None:
+            return None, None
+        return await self.executor.run(self.near_get, full_key, ttl)
+
+    async def anear_set(self, full_key: str, data: bytes, ttl: float) -> None:
+        if self.disk is None:
+            self.near_set(full_key, data, ttl)
+        else:
+            await self.executor.run(self.near_set, full_key, data, ttl)
+
+    async def anear_delete(self, full_key: str) -> None:
+        if self.disk is None:
+            self.near_delete(full_key)
+        else:
+            await self.executor.run(self.near_delete, full_key)
+
+    def remote_available(self) -> bool:
+        return self.remote is not None and time.monotonic() >= self._remote_disabled_until
+
+    def remote_call(self, operation: str, *args, default=None):
+        """後段を呼ぶ。失敗したらしばらく後段を使わない"""
+        if not self.remote_available():
+            return default
+        try:
+            return getattr(self.remote, operation)(*args)
+        except Exception as e:
+            with self._lock:
+                self.remote_errors += 1
+                self._remote_disabled_until = time.monotonic() + REMOTE_COOLDOWN_SECONDS
+            logger.warning("Shared cache %s failed, using local tier only for %.0fs: %s", operation, REMOTE_COOLDOWN_SECONDS, e)
+            return default
+
+    async def aremote_call(self, operation: str, *args, default=None):
+        """remote_call をスレッドで実行する (イベントループを止めない)"""
+        if not self.remote_available():
+            return default
+        return await self.executor.run(self.remote_call, operation, *args, default=default)
+
+    def snapshot(self) -> dict:
+        return {
+            "local_entries": len(self.local),
+            "local_evictions": self.local.evictions,
+            "disk": self.disk.snapshot() if self.disk is not None else None,
+            "remote": type(self.remote).__name__ if self.remote is not None else None,
+            "remote_available": self.remote_available(),
+            "remote_errors": self.remote_errors,
+            "namespaces": {name: namespace.snapshot() for name, namespace in self._namespaces.items()},
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+        if self.remote is not None:
+            self.remote.close()
+
+
+class CacheNamespace:
+    """
+    1つの名前空間のキャッシュ。同期版 (get / set / get_or_compute) と、
+    イベントループ上で使う非同期版 (aget / aset / aget_or_compute) がある。
+    """
+
+    def __init__(self, cache: TieredCache, name: str, ttl: float):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._inflight: dict[str, threading.Event] = {}
+        self._ainflight: dict[str, asyncio.Task] = {}
+        self._stats = {"local_hits": 0, "disk_hits": 0, "remote_hits": 0, "misses": 0, "stores": 0, "coalesced": 0, "lock_waits": 0}
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _full_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _encode(self, value: Any, ttl: float | None) -> tuple[bytes, float]:
+        return dumps(value), _jittered(ttl if ttl is not None else self.ttl)
+
+    # --- 同期版 ---
+
+    def _lookup(self, full_key: str) -> Any:
+        data, tier = self.cache.near_get(full_key, self.ttl)
+        if data is not None:
+            self._count(f"{tier}_hits")
+            return loads(data)
+        data = self.cache.remote_call("get", full_key)
+        if data is not None:
+            self._count("remote_hits")
+            self.cache.near_set(full_key, data, self.ttl)
+            return loads(data)
+        return _MISSING
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._lookup(self._full_key(key))
+        if value is _MISSING:
+            self._count("misses")
+            return default
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        full_key = self._full_key(key)
+        data, ttl = self._encode(value, ttl)
+        self.cache.near_set(full_key, data, ttl)
+        self.cache.remote_call("set", full_key, data, ttl)
+        self._count("stores")
+
+    def delete(self, key: str) -> None:
+        full_key = self._full_key(key)
+        self.cache.near_delete(full_key)
+        self.cache.remote_call("delete", full_key)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: float | None = None,
+                       cache_if: Callable[[Any], bool] | None = None) -> Any:
+        """
+        キャッシュにあればそれを、無ければ compute() の結果を返して保存する。
+        cache_if が False を返す結果 (エラー時の既定値など) は保存しない。compute の例外はそのまま伝える。
+        """
+        full_key = self._full_key(key)
+        value = self._lookup(full_key)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            event = self._inflight.get(full_key)
+            leader = event is None
+            if leader:
+                event = self._inflight[full_key] = threading.Event()
+        if not leader:
+            # 同じキーを計算中のスレッドを待ち、その結果を使う
+            event.wait(self.cache.lock_ttl)
+            value = self._lookup(full_key)
+            if value is not _MISSING:
+                self._count("coalesced")
+                return value
+            self._count("misses")
+            return compute()
+
+        try:
+            self._count("misses")
+            token = self.cache.remote_call("try_lock", full_key, self.cache.lock_ttl)
+            if token is None and self.cache.remote_available():
+                # 他のインスタンスが計算中。結果が書き込まれるのを待つ
+                self._count("lock_waits")
+                deadline = time.monotonic() + self.cache.lock_wait
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL_SECONDS)
+                    value = self._lookup(full_key)
+                    if value is not _MISSING:
+                        return value
+            try:
+                value = compute()
+                if cache_if is None or cache_if(value):
+                    self.set(key, value, ttl)
+                return value
+            finally:
+                if token is not None:
+                    self.cache.remote_call("unlock", full_key, token)
+        finally:
+            with self._lock:
+                self._inflight.pop(full_key, None)
+            event.set()
+
+    # --- 非同期版 ---
+
+    async def _alookup(self, full_key: str) -> Any:
+        data, tier = await self.cache.anear_get(full_key, self.ttl)
+        if data is not None:
+            self._count(f"{tier}_hits")
+            return loads(data)
+        data = await self.cache.aremote_call("get", full_key)
+        if data is not None:
+            self._count("remote_hits")
+            await self.cache.anear_set(full_key, data, self.ttl)
+            return loads(data)
+        return _MISSING
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        value = await self._alookup(self._full_key(key))
+        if value is _MISSING:
+            self._count("misses")
+            return default
+        return value
+
+    async def aset(self, key: str, value: Any, ttl: float | None = None) -> None:
+        full_key = self._full_key(key)
+        data, ttl = self._encode(value, ttl)
+        await self.cache.anear_set(full_key, data, ttl)
+        await self.cache.aremote_call("set", full_key, data, ttl)
+        self._count("stores")
+
+    async def adelete(self, key: str) -> None:
+        full_key = self._full_key(key)
+        await self.cache.anear_delete(full_key)
+        await self.cache.aremote_call("delete", full_key)
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float | None = None,
+                              cache_if: Callable[[Any], bool] | None = None,
+                              is_fresh: Callable[[Any], Awaitable[bool]] | None = None) -> Any:
+        """
+        get_or_compute の非同期版。compute はコルーチンを返す関数。
+        is_fresh を渡すと、キャッシュの値を使う前に確かめ、False なら無いものとして計算し直す
+        (結果が依存するセルのデータバージョンの確認などに使う)。
+        """
+        full_key = self._full_key(key)
+
+        async def lookup() -> Any:
+            value = await self._alookup(full_key)
+            if value is not _MISSING and is_fresh is not None and not await is_fresh(value):
+                return _MISSING
+            return value
+
+        value = await lookup()
+        if value is not _MISSING:
+            return value
+
+        task = self._ainflight.get(full_key)
+        if task is not None:
+            # 同じキーを計算中のタスクの結果を使う (例外もそのまま受け取る)
+            self._count("coalesced")
+            result = await asyncio.shield(task)
+            value = await lookup()
+            return result if value is _MISSING else value
+
+        # 計算は呼び出し元から切り離したタスクで行う。呼び出し元 (クライアントの切断など) が取り消されても
+        # 計算は続き、待っている他のリクエストは結果を受け取れる
+        self._count("misses")
+        task = self._ainflight[full_key] = asyncio.ensure_future(self._acompute(key, full_key, compute, ttl, cache_if, lookup))
+        task.add_done_callback(lambda done: self._acompute_done(full_key, done))
+        return await asyncio.shield(task)
+
+    async def _acompute(self, key: str, full_key: str, compute: Callable[[], Awaitable[Any]], ttl: float | None,
+                        cache_if: Callable[[Any], bool] | None, lookup: Callable[[], Awaitable[Any]]) -> Any:
+        """aget_or_compute の計算の本体。他インスタンスが計算中なら、その結果が書き込まれるのを待つ"""
+        token = await self.cache.aremote_call("try_lock", full_key, self.cache.lock_ttl)
+        if token is None and self.cache.remote_available():
+            self._count("lock_waits")
+            deadline = time.monotonic() + self.cache.lock_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                value = await lookup()
+                if value is not _MISSING:
+                    return value
+        try:
+            value = await compute()
+            if cache_if is None or cache_if(value):
+                await self.aset(key, value, ttl)
+            return value
+        finally:
+            if token is not None:
+                await self.cache.aremote_call("unlock", full_key, token)
+
+    def _acompute_done(self, full_key: str, task: asyncio.Task) -> None:
+        if self._ainflight.get(full_key) is task:
+            del self._ainflight[full_key]
+        if not task.cancelled():
+            # 待っているタスクが無い場合に "exception was never retrieved" を出さない
+            task.exception()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["local_hits"] + stats["disk_hits"] + stats["remote_hits"]
+        lookups = hits + stats["misses"]
+        return {**stats, "ttl": self.ttl, "hit_rate": hits / lookups if lookups else 0.0}
+
+
+_caches: dict[tuple, TieredCache] = {}
+
+
+def _open_disk(path: str | None, max_bytes: int) -> DiskTier | None:
+    if not path:
+        return None
+    try:
+        return DiskTier(path, max_bytes)
+    except (OSError, sqlite3.Error) as e:
+        # /tmp が書き込めない環境などでは中段なしで動く
+        logger.warning("Could not open disk cache at %s, continuing without it: %s", path, e)
+        return None
+
+
+def get_cache(redis_url: str | None = None, local_max_entries: int = DEFAULT_LOCAL_MAX_ENTRIES,
+              prefix: str = "jongso:", timeout: float = DEFAULT_REMOTE_TIMEOUT_SECONDS,
+              disk_path: str | None = None, disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES) -> TieredCache:
+    """
+    同じ設定のキャッシュをプロセス内で共有する。
+    redis_url が無い (または redis 未インストール) 場合は後段なし、disk_path が無い場合は中段なしで動く。
+    """
+    cache = _caches.get((redis_url, prefix))
+    if cache is None:
+        remote = None
+        if redis_url:
+            if redis is None:
+                logger.warning("REDIS_URL is set but the redis package is not installed. Using the local cache tier only.")
+            else:
+                remote = RedisTier(redis_url, prefix=prefix, timeout=timeout)
+        disk = _open_disk(disk_path, disk_max_bytes)
+        cache = _caches[(redis_url, prefix)] = TieredCache(LocalTier(local_max_entries), remote, disk=disk)
+        logger.info("Shared cache initialized (remote=%s, disk=%s, local_max_entries=%s).",
+                    'redis' if remote else 'none', disk_path if disk else 'none', local_max_entries)
+    return cache
+
+
+def close_caches() -> None:
+    for cache in list(_caches.values()):
+        cache.close()
+    _caches.clear()
@@ -0,0 +1,168 @@
+"""
+検索パイプラインを流れる店舗のレコード。
+
+Google Places の結果・DBの行から1回だけ組み立て、ランキング・DBへの upsert・レスポンスまで同じインスタンスを使う。
+__slots__ で属性を固定しているため、15キーの dict より小さく、コピーや id/place_id の付け替えも不要になる。
+"""
+from typing import Any
+
+# ランキングのスコアラーや既存コードが dict のキーで参照する名前 -> 属性名
+_ALIASES = {"id": "place_id", "distanceKm": "distance_km", "walkMinutes": "walk_minutes"}
+
+# jongso_shops のカラム (last_fetched_at は保存時に指定する)
+DB_COLUMNS = (
+    "place_id", "name", "address", "lat", "lng", "rating", "user_ratings_total",
+    "smoking_status", "positive_score", "negative_score", "summary",
+)
+
+
+class ShopRecord:
+    """1店舗分の情報。レスポンスでは to_dict() の形 (id と place_id の両方を持つ) になる"""
+    __slots__ = (
+        "place_id", "name", "address", "lat", "lng", "rating", "user_ratings_total",
+        "smoking_status", "positive_score", "negative_score", "summary", "last_fetched_at",
+        "distance_km", "walk_minutes",
+    )
+
+    def __init__(
+        self,
+        place_id: str,
+        name: str | None = None,
+        address: str | None = None,
+        lat: float | None = None,
+        lng: float | None = None,
+        rating: float | None = None,
+        user_ratings_total: int | None = None,
+        smoking_status: str | None = None,
+        positive_score: int | None = None,
+        negative_score: int | None = None,
+        summary: str | None = None,
+        last_fetched_at: str | None = None,
+        distance_km: float | None = None,
+        walk_minutes: int | None = None,
+    ):
+        self.place_id = place_id
+        self.name = name
+        self.address = address
+        self.lat = lat
+        self.lng = lng
+        self.rating = rating
+        self.user_ratings_total = user_ratings_total
+        self.smoking_status = smoking_status
+        self.positive_score = positive_score
+        self.negative_score = negative_score
+        self.summary = summary
+        self.last_fetched_at = last_fetched_at
+        self.distance_km = distance_km
+        self.walk_minutes = walk_minutes
+
+    @classmethod
+    def from_place(
+        cls,
+        place: dict,
+        smoking_status: str | None = None,
+        positive_score: int | None = None,
+        negative_score: int | None = None,
+        summary: str | None = None,
+        last_fetched_at: str | None = None,
+        distance_km: float | None = None,
+        walk_minutes: int | None = None,
+    ) -> "ShopRecord":
+        """Google Places の結果 (nearbysearch / textsearch / details) に分析結果・距離を合わせて作る"""
+        location = place.get('geometry', {}).get('location', {})
+        return cls(
+            place.get('place_id'),
+            place.get('name'),
+            place.get('formatted_address') or place.get('vicinity'),
+            location.get('lat'),
+            location.get('lng'),
+            place.get('rating'),
+            place.get('user_ratings_total'),
+            smoking_status,
+            positive_score,
+            negative_score,
+            summary,
+            last_fetched_at,
+            distance_km,
+            walk_minutes,
+        )
+
+    @classmethod
+    def from_db_row(cls, row: dict) -> "ShopRecord":
+        """jongso_shops の行から作る (存在しないカラムは None)"""
+        return cls(
+            place_id=row['place_id'],
+            name=row.get('name'),
+            address=row.get('address'),
+            lat=row.get('lat'),
+            lng=row.get('lng'),
+            rating=row.get('rating'),
+            user_ratings_total=row.get('user_ratings_total'),
+            smoking_status=row.get('smoking_status'),
+            positive_score=row.get('positive_score'),
+            negative_score=row.get('negative_score'),
+            summary=row.get('summary'),
+            last_fetched_at=row.get('last_fetched_at'),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ShopRecord":
+        """to_dict() の形 (キャッシュから戻した結果など) から作る"""
+        return cls(
+            data.get('place_id') or data.get('id'),
+            data.get('name'),
+            data.get('address'),
+            data.get('lat'),
+            data.get('lng'),
+            data.get('rating'),
+            data.get('user_ratings_total'),
+            data.get('smoking_status'),
+            data.get('positive_score'),
+            data.get('negative_score'),
+            data.get('summary'),
+            data.get('last_fetched_at'),
+            data.get('distanceKm'),
+            data.get('walkMinutes'),
+        )
+
+    def with_distance(self, distance_km: float | None, walk_minutes: int | None) -> "ShopRecord":
+        """地点ごとに距離だけが異なるレコード (バッチ検索で同じ店舗を複数の地点に返す場合) を作る"""
+        record = ShopRecord.__new__(ShopRecord)
+        for name in self.__slots__:
+            setattr(record, name, getattr(self, name))
+        record.distance_km = distance_km
+        record.walk_minutes = walk_minutes
+        return record
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """dict と同じ名前で属性を読む (dict とレコードの両方を受け取る services/ranking.py などのため)"""
+        return getattr(self, _ALIASES.get(field, field), default)
+
+    def to_db_row(self, last_fetched_at: str) -> dict:
+        """jongso_shops に upsert する行"""
+        row = {column: getattr(self, column) for column in DB_COLUMNS}
+        row['last_fetched_at'] = last_fetched_at
+        return row
+
+    def to_dict(self) -> dict:
+        """レスポンスの形 (services/fast_json.py が JSON 化の際に呼ぶ)"""
+        return {
+            "id": self.place_id,
+            "name": self.name,
+            "address": self.address,
+            "lat": self.lat,
+            "lng": self.lng,
+            "rating": self.rating,
+            "user_ratings_total": self.user_ratings_total,
+            "smoking_status": self.smoking_status,
+            "positive_score": self.positive_score,
+            "negative_score": self.negative_score,
+            "summary": self.summary,
+            "last_fetched_at": self.last_fetched_at,
+            "distanceKm": self.distance_km,
+            "walkMinutes": self.walk_minutes,
+            "place_id": self.place_id,
+        }
+
+    def __repr__(self) -> str:
+        return f"ShopRecord(place_id={self.place_id!r}, name={self.name!r})"
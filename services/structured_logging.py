@@ -0,0 +1,186 @@
+"""
+リクエストのホットパス向けの構造化ログ。
+
+- ロガーの呼び出しは QueueHandler でレコードをキューに積むだけにし、メッセージの書式化・JSON 化・書き込みは
+  QueueListener のスレッドで行う (イベントループやスレッドプールが標準出力への書き込みを待たない)
+- メッセージは logger.info("... %s", value) の形で渡す。出力されないログは書式化されず、
+  出力されるログも書式化はリスナーのスレッドで行われる
+- リクエストごとの相関 ID (X-Request-ID。無ければ生成する) を ContextVar で持ち、全レコードに request_id として付ける。
+  services/executors.py のプールで実行した処理のログにも引き継がれる
+- 詳細なログ (DEBUG: LLM の応答全文・店舗ごとの DB ヒット・応答のパース過程など) は、
+  verbose_sample_rate の割合でサンプリングしたリクエストでだけ出す
+
+    configure_logging("INFO", "json", verbose_sample_rate=0.01)
+    app.add_middleware(RequestIdMiddleware)
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import secrets
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+REQUEST_ID_HEADER = "x-request-id"
+MAX_REQUEST_ID_LENGTH = 64 # クライアントから受け取る ID の最大長 (超えた場合は生成し直す)
+APP_LOGGERS = ("services", "api") # 詳細なログをサンプリングする (DEBUG まで有効にする) アプリのロガー
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+_request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+_verbose: ContextVar[bool | None] = ContextVar("verbose_logging", default=None)
+
+_listener: QueueListener | None = None
+_queue_handler: QueueHandler | None = None
+_sample_rate = 0.0
+
+
+def current_request_id() -> str | None:
+    """処理中のリクエストの相関 ID (リクエスト外では None)"""
+    return _request_id.get()
+
+
+def verbose_enabled() -> bool:
+    """処理中のリクエストで詳細なログを出すか (ループ内のログなど、呼び出し自体を省きたい場合の判定用)"""
+    if _listener is None:
+        # configure_logging を使っていない場合 (スクリプトなど) は、通常のレベルの判定に任せる
+        return True
+    sampled = _verbose.get()
+    return sampled if sampled is not None else _sample_rate >= 1.0
+
+
+def begin_request(request_id: str | None = None) -> tuple:
+    """相関 ID を設定し、詳細なログを出すかをサンプリングする。戻り値は end_request に渡す"""
+    if not request_id or len(request_id) > MAX_REQUEST_ID_LENGTH:
+        request_id = secrets.token_hex(8)
+    return _request_id.set(request_id), _verbose.set(random.random() < _sample_rate)
+
+
+def end_request(tokens: tuple) -> None:
+    request_token, verbose_token = tokens
+    _request_id.reset(request_token)
+    _verbose.reset(verbose_token)
+
+
+class RequestContextFilter(logging.Filter):
+    """レコードに request_id を付け、サンプリングされていないリクエストの詳細なログを捨てる"""
+
+    def __init__(self, level: int):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level and not verbose_enabled():
+            return False
+        record.request_id = _request_id.get() or "-"
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler は積む前に呼び出し元のスレッドでメッセージを書式化するため、これを省いてレコードをそのまま積む。
+    書式化はリスナーのスレッドで行う (ログの引数は、ログの呼び出し後に書き換えないものを渡す)
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行の JSON にする"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO", fmt: str = "json", verbose_sample_rate: float = 0.0,
+                      app_loggers: tuple[str, ...] = APP_LOGGERS) -> None:
+    """
+    ルートロガーの出力をキュー経由にする (logging.basicConfig の代わり)。
+    verbose_sample_rate が 0 より大きければ、app_loggers 配下の level 未満 (DEBUG) のログも、
+    サンプリングしたリクエストでだけ出す (ライブラリのロガーは level のまま)
+    """
+    global _listener, _queue_handler, _sample_rate
+    shutdown_logging()
+    base_level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if not isinstance(base_level, int):
+        base_level = logging.INFO
+    _sample_rate = 1.0 if base_level <= logging.DEBUG else max(0.0, min(1.0, verbose_sample_rate))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    _queue_handler = DeferredQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestContextFilter(base_level))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(base_level)
+    # サンプリングする場合はアプリのロガーだけ DEBUG まで有効にする。httpcore・openai などのライブラリの DEBUG は
+    # ルートのレベルで止まり、LogRecord も作られない (0 ならアプリの DEBUG もレベルの判定だけで終わる)
+    for name in app_loggers:
+        logging.getLogger(name).setLevel(logging.DEBUG if _sample_rate > 0 else logging.NOTSET)
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """キューに残ったレコードを書き出してリスナーを止める。以降のログは呼び出し元のスレッドで直接書き込む"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        for log_filter in _queue_handler.filters:
+            handler.addFilter(log_filter)
+        root.addHandler(handler)
+    _listener = None
+    _queue_handler = None
+
+
+atexit.register(shutdown_logging)
+
+
+class RequestIdMiddleware:
+    """
+    リクエストごとに相関 ID を設定する ASGI ミドルウェア。
+    X-Request-ID があればそれを使い、レスポンスのヘッダーにも同じ値を返す
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = next((value for name, value in scope["headers"] if name == REQUEST_ID_HEADER.encode()), None)
+        tokens = begin_request(header.decode("latin-1") if header else None)
+        request_id = _request_id.get().encode("latin-1")
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            end_request(tokens)
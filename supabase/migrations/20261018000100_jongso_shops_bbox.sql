@@ -0,0 +1,37 @@
+-- ビューポート検索 (/api/search_bbox) 用のインデックスと集約関数
+
+create index if not exists jongso_shops_lat_lng_idx
+    on public.jongso_shops (lat, lng);
+
+-- 指定範囲の店舗をグリッドセル単位で集約する。
+-- 返却行数はセル数で上限が決まるため、店舗数が多くてもペイロードは増えない。
+create or replace function public.jongso_shops_bbox_clusters(
+    south double precision,
+    west double precision,
+    north double precision,
+    east double precision,
+    cell_size double precision
+)
+returns table (
+    cell_row bigint,
+    cell_col bigint,
+    count bigint,
+    lat double precision,
+    lng double precision,
+    best_rating double precision
+)
+language sql
+stable
+as $$
+    select
+        floor(s.lat / cell_size)::bigint as cell_row,
+        floor(s.lng / cell_size)::bigint as cell_col,
+        count(*) as count,
+        avg(s.lat)::double precision as lat,
+        avg(s.lng)::double precision as lng,
+        max(s.rating)::double precision as best_rating
+    from public.jongso_shops s
+    where s.lat between south and north
+      and s.lng between west and east
+    group by 1, 2;
+$$;
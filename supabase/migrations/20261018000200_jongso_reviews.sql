@@ -0,0 +1,13 @@
+-- レビュー単位の分析結果。再取得時に未分析のレビューだけを LLM に送るために使う。
+
+create table if not exists public.jongso_reviews (
+    place_id text not null,
+    review_hash text not null,
+    author_name text,
+    review_time bigint,
+    positive_score smallint,
+    negative_score smallint,
+    smoking_signal text,
+    analyzed_at timestamptz not null default now(),
+    primary key (place_id, review_hash)
+);
@@ -0,0 +1,191 @@
+-- 駅ごとの近傍店舗 (駅名キーワード検索・駅周辺の周辺検索を1回のインデックス読み取りで返すため)
+--
+-- station_nearest_shops には駅から半径 3000m 以内の店舗を近い順に最大 20 件保持する
+-- (services/location_service.py の STATION_NEAREST_K / DEFAULT_RADIUS_M と合わせる)。
+-- jongso_shops の追加・座標の変更・削除、stations の取り込み・座標の変更のたびに、影響する駅の分だけ作り直す。
+
+create index if not exists stations_latitude_longitude_idx
+    on public.stations (latitude, longitude);
+
+create table if not exists public.station_nearest_shops (
+    station_name text not null references public.stations (name) on update cascade on delete cascade,
+    station_lat double precision not null,
+    station_lng double precision not null,
+    rank smallint not null,
+    place_id text not null references public.jongso_shops (place_id) on delete cascade,
+    distance_m real not null,
+    primary key (station_name, rank)
+);
+
+create index if not exists station_nearest_shops_station_lat_lng_idx
+    on public.station_nearest_shops (station_lat, station_lng);
+
+create index if not exists station_nearest_shops_place_id_idx
+    on public.station_nearest_shops (place_id);
+
+create or replace function public.haversine_m(
+    lat1 double precision,
+    lng1 double precision,
+    lat2 double precision,
+    lng2 double precision
+)
+returns double precision
+language sql
+immutable
+as $$
+    select 2 * 6371008.8 * asin(sqrt(
+        power(sin(radians(lat2 - lat1) / 2), 2)
+        + cos(radians(lat1)) * cos(radians(lat2)) * power(sin(radians(lng2 - lng1) / 2), 2)
+    ));
+$$;
+
+-- 指定した駅の近傍店舗を作り直す。
+-- 同じ駅に影響する書き込みが並行すると、READ COMMITTED では両方の delete が互いの行を見ないまま通り、
+-- 後の insert が (station_name, rank) の主キー違反になる。駅ごとのトランザクションロックを
+-- 名前の順に取ってから作り直し、同じ駅の作り直しを直列にする (順序を揃えてデッドロックを避ける)
+create or replace function public.refresh_station_nearest_shops(station_names text[])
+returns integer
+language plpgsql
+as $$
+declare
+    k constant integer := 20;
+    radius_m constant double precision := 3000;
+    inserted integer;
+    locked_name text;
+begin
+    for locked_name in select distinct name from unnest(station_names) as t(name) where name is not null order by name loop
+        perform pg_advisory_xact_lock(hashtext('station_nearest_shops:' || locked_name));
+    end loop;
+
+    -- ロックを待った場合も、この文以降は先に確定したトランザクションの行・店舗を見て作り直す
+    delete from public.station_nearest_shops where station_name = any(station_names);
+
+    insert into public.station_nearest_shops (station_name, station_lat, station_lng, rank, place_id, distance_m)
+    select st.name, st.latitude, st.longitude, nearest.rank, nearest.place_id, nearest.distance_m
+    from public.stations st
+    cross join lateral (
+        select
+            candidates.place_id,
+            (row_number() over (order by candidates.distance_m, candidates.place_id))::smallint as rank,
+            candidates.distance_m::real as distance_m
+        from (
+            select s.place_id, public.haversine_m(st.latitude, st.longitude, s.lat, s.lng) as distance_m
+            from public.jongso_shops s
+            where s.lat between st.latitude - radius_m / 111320.0 and st.latitude + radius_m / 111320.0
+              and s.lng between st.longitude - radius_m / 111320.0 / greatest(cos(radians(st.latitude)), 0.01)
+                            and st.longitude + radius_m / 111320.0 / greatest(cos(radians(st.latitude)), 0.01)
+        ) candidates
+        where candidates.distance_m <= radius_m
+        order by candidates.distance_m, candidates.place_id
+        limit k
+    ) nearest
+    where st.name = any(station_names)
+      and st.latitude is not null
+      and st.longitude is not null;
+
+    get diagnostics inserted = row_count;
+    return inserted;
+end;
+$$;
+
+-- 座標の集まりから半径 3000m 以内にある駅の名前
+create or replace function public.stations_near_points(lats double precision[], lngs double precision[])
+returns text[]
+language sql
+stable
+as $$
+    select coalesce(array_agg(distinct st.name), '{}')
+    from unnest(lats, lngs) as p(lat, lng)
+    join public.stations st
+      on st.latitude between p.lat - 3000 / 111320.0 and p.lat + 3000 / 111320.0
+     and st.longitude between p.lng - 3000 / 111320.0 / greatest(cos(radians(p.lat)), 0.01)
+                          and p.lng + 3000 / 111320.0 / greatest(cos(radians(p.lat)), 0.01)
+    where p.lat is not null and p.lng is not null
+      and public.haversine_m(p.lat, p.lng, st.latitude, st.longitude) <= 3000;
+$$;
+
+-- jongso_shops の変更 (文単位)。座標が変わらない更新 (分析結果の書き戻しなど) では作り直さない
+create or replace function public.station_nearest_shops_on_shops_change()
+returns trigger
+language plpgsql
+as $$
+declare
+    affected text[];
+begin
+    if tg_op = 'INSERT' then
+        select public.stations_near_points(array_agg(lat), array_agg(lng)) into affected from new_shops;
+    elsif tg_op = 'UPDATE' then
+        select public.stations_near_points(array_agg(p.lat), array_agg(p.lng)) into affected
+        from (
+            select n.lat, n.lng from new_shops n join old_shops o using (place_id)
+            where n.lat is distinct from o.lat or n.lng is distinct from o.lng
+            union all
+            select o.lat, o.lng from new_shops n join old_shops o using (place_id)
+            where n.lat is distinct from o.lat or n.lng is distinct from o.lng
+        ) p;
+    else
+        select public.stations_near_points(array_agg(lat), array_agg(lng)) into affected from old_shops;
+    end if;
+
+    if cardinality(affected) > 0 then
+        perform public.refresh_station_nearest_shops(affected);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists station_nearest_shops_shops_insert on public.jongso_shops;
+create trigger station_nearest_shops_shops_insert
+    after insert on public.jongso_shops
+    referencing new table as new_shops
+    for each statement execute function public.station_nearest_shops_on_shops_change();
+
+drop trigger if exists station_nearest_shops_shops_update on public.jongso_shops;
+create trigger station_nearest_shops_shops_update
+    after update on public.jongso_shops
+    referencing old table as old_shops new table as new_shops
+    for each statement execute function public.station_nearest_shops_on_shops_change();
+
+drop trigger if exists station_nearest_shops_shops_delete on public.jongso_shops;
+create trigger station_nearest_shops_shops_delete
+    after delete on public.jongso_shops
+    referencing old table as old_shops
+    for each statement execute function public.station_nearest_shops_on_shops_change();
+
+-- stations の取り込み (scripts/import_stations.py の upsert)。座標が変わった駅だけ作り直す
+create or replace function public.station_nearest_shops_on_stations_change()
+returns trigger
+language plpgsql
+as $$
+declare
+    affected text[];
+begin
+    if tg_op = 'INSERT' then
+        select array_agg(name) into affected from new_stations;
+    else
+        select array_agg(n.name) into affected
+        from new_stations n join old_stations o using (name)
+        where n.latitude is distinct from o.latitude or n.longitude is distinct from o.longitude;
+    end if;
+
+    if cardinality(affected) > 0 then
+        perform public.refresh_station_nearest_shops(affected);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists station_nearest_shops_stations_insert on public.stations;
+create trigger station_nearest_shops_stations_insert
+    after insert on public.stations
+    referencing new table as new_stations
+    for each statement execute function public.station_nearest_shops_on_stations_change();
+
+drop trigger if exists station_nearest_shops_stations_update on public.stations;
+create trigger station_nearest_shops_stations_update
+    after update on public.stations
+    referencing old table as old_stations new table as new_stations
+    for each statement execute function public.station_nearest_shops_on_stations_change();
+
+-- 既存の駅・店舗から初期データを作る
+select public.refresh_station_nearest_shops(array(select name from public.stations));
@@ -0,0 +1,94 @@
+-- セルごとのデータバージョン (検索結果のキャッシュ・ETag の無効化用)
+--
+-- 店舗を緯度経度のグリッドセル (services/geo_grid.py と同じ分割、ズーム 13 = 約1.2km四方) に割り当て、
+-- jongso_shops の行が追加・変更・削除されるたびに、その店舗のセル (移動した場合は移動前のセルも) の version を上げる。
+-- キャッシュは結果が依存するセルの version を覚えておき、一致しなければ作り直す (services/http_cache.py)。
+
+create table if not exists public.cell_versions (
+    zoom smallint not null,
+    cell_row bigint not null,
+    cell_col bigint not null,
+    version bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (zoom, cell_row, cell_col)
+);
+
+-- services/geo_grid.py の cell_size_for_zoom と同じ (タイル1枚の1/4を1セルとする)
+create or replace function public.grid_cell_size(zoom integer)
+returns double precision
+language sql
+immutable
+as $$
+    select 360.0 / power(2, zoom) / 4;
+$$;
+
+-- 座標の集まりが属するセルの version を1つ上げる
+create or replace function public.bump_cell_versions(zoom integer, lats double precision[], lngs double precision[])
+returns void
+language sql
+as $$
+    insert into public.cell_versions as cv (zoom, cell_row, cell_col, version, updated_at)
+    select distinct
+        bump_cell_versions.zoom,
+        floor(p.lat / public.grid_cell_size(bump_cell_versions.zoom))::bigint,
+        floor(p.lng / public.grid_cell_size(bump_cell_versions.zoom))::bigint,
+        1,
+        now()
+    from unnest(lats, lngs) as p(lat, lng)
+    where p.lat is not null and p.lng is not null
+    on conflict (zoom, cell_row, cell_col)
+    do update set version = cv.version + 1, updated_at = now();
+$$;
+
+-- 変更の判定から除く記録用の列。last_fetched_at は保存のたびに進むため、含めると内容が同じ upsert でも
+-- 毎回バージョンが上がり、キャッシュが効かなくなる
+create or replace function public.shop_content(shop public.jongso_shops)
+returns jsonb
+language sql
+stable
+as $$
+    select to_jsonb(shop) - array['last_fetched_at', 'created_at', 'updated_at'];
+$$;
+
+-- jongso_shops の変更 (文単位)。記録用の列 (shop_content) 以外が変わらない upsert ではバージョンを上げない
+create or replace function public.cell_versions_on_shops_change()
+returns trigger
+language plpgsql
+as $$
+declare
+    version_zoom constant integer := 13;
+begin
+    if tg_op = 'INSERT' then
+        perform public.bump_cell_versions(version_zoom, array_agg(lat), array_agg(lng)) from new_shops;
+    elsif tg_op = 'UPDATE' then
+        perform public.bump_cell_versions(version_zoom, array_agg(p.lat), array_agg(p.lng))
+        from (
+            select n.lat, n.lng from new_shops n join old_shops o using (place_id) where public.shop_content(n) is distinct from public.shop_content(o)
+            union all
+            select o.lat, o.lng from new_shops n join old_shops o using (place_id)
+            where n.lat is distinct from o.lat or n.lng is distinct from o.lng
+        ) p;
+    else
+        perform public.bump_cell_versions(version_zoom, array_agg(lat), array_agg(lng)) from old_shops;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists cell_versions_shops_insert on public.jongso_shops;
+create trigger cell_versions_shops_insert
+    after insert on public.jongso_shops
+    referencing new table as new_shops
+    for each statement execute function public.cell_versions_on_shops_change();
+
+drop trigger if exists cell_versions_shops_update on public.jongso_shops;
+create trigger cell_versions_shops_update
+    after update on public.jongso_shops
+    referencing old table as old_shops new table as new_shops
+    for each statement execute function public.cell_versions_on_shops_change();
+
+drop trigger if exists cell_versions_shops_delete on public.jongso_shops;
+create trigger cell_versions_shops_delete
+    after delete on public.jongso_shops
+    referencing old table as old_shops
+    for each statement execute function public.cell_versions_on_shops_change();
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+# 代替サーバーに向けたアプリのフィクスチャ (fake_upstreams・api_app・backend_app)
+from benchmarks.harness.fixtures import *  # noqa: E402,F401,F403
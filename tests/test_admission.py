@@ -0,0 +1,51 @@
+import sys
+
+from fastapi.testclient import TestClient
+
+from services.admission import AdmissionController, AdmissionRejected, MODE_DB_ONLY, MODE_FULL
+
+
+def test_weighted_acquire_uses_one_slot_per_search():
+    controller = AdmissionController(max_in_flight=4, max_db_only_in_flight=4)
+    batch = controller.acquire(weight=3)
+    assert batch.mode == MODE_FULL
+    assert controller.snapshot()["in_flight"][MODE_FULL] == 3
+
+    # 残りの補完の枠は1つなので、2件分のバッチは DB のみになる
+    assert controller.acquire(weight=2).mode == MODE_DB_ONLY
+    assert controller.acquire().mode == MODE_FULL
+
+    batch.release()
+    assert controller.snapshot()["in_flight"][MODE_FULL] == 1
+
+
+def test_weight_larger_than_capacity_is_clamped():
+    controller = AdmissionController(max_in_flight=2, max_db_only_in_flight=2)
+    admission = controller.acquire(weight=10)
+    assert admission.mode == MODE_FULL
+    assert controller.acquire(weight=10).mode == MODE_DB_ONLY
+    try:
+        controller.acquire()
+    except AdmissionRejected:
+        pass
+    else:
+        raise AssertionError("満杯なら拒否する")
+
+
+def test_batch_search_over_capacity_stays_off_upstream(fake_upstreams, api_app):
+    controller = sys.modules["api.index"].admission_controller
+    held = controller.acquire(weight=controller.max_in_flight)
+    try:
+        with TestClient(api_app) as client:
+            fake_upstreams.reset_calls()
+            response = client.post("/api/search_batch", json={
+                "locations": [{"latitude": 35.6812, "longitude": 139.7671}],
+                "keywords": ["新宿"],
+            })
+        assert response.status_code == 200
+        assert response.json()["degraded"] is True
+        assert fake_upstreams.total_calls("google") == 0
+        assert fake_upstreams.total_calls("openai") == 0
+    finally:
+        held.release()
+    assert controller.snapshot()["in_flight"] == {MODE_FULL: 0, MODE_DB_ONLY: 0}
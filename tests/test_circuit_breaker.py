@@ -0,0 +1,55 @@
+import asyncio
+
+from services.circuit_breaker import CircuitBreaker, HALF_OPEN, CLOSED
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", min_calls=1, open_seconds=0.0, half_open_max_calls=1)
+    breaker.record_failure()
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def test_cancelled_half_open_trial_releases_its_slot():
+    breaker = half_open_breaker()
+
+    async def run():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.Event().wait()
+
+        trial = asyncio.create_task(breaker.acall(slow))
+        await started.wait()
+        assert not breaker.allow_request()
+        trial.cancel()
+        try:
+            await trial
+        except asyncio.CancelledError:
+            pass
+
+        # 取り消しは失敗として数えず、次の試行を受け付ける
+        assert breaker.state == HALF_OPEN
+        assert breaker.snapshot()["failures"] == 1
+
+        async def ok():
+            return "ok"
+        assert await breaker.acall(ok) == "ok"
+
+    asyncio.run(run())
+    assert breaker.state == CLOSED
+
+
+def test_interrupted_sync_trial_releases_its_slot():
+    breaker = half_open_breaker()
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    try:
+        breaker.call(interrupted)
+    except KeyboardInterrupt:
+        pass
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
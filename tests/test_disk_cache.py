@@ -0,0 +1,42 @@
+import sqlite3
+import threading
+
+import pytest
+
+from services import disk_cache
+from services.disk_cache import DiskTier
+
+
+def test_close_closes_connections_from_every_thread(tmp_path):
+    tier = DiskTier(str(tmp_path / "cache.sqlite3"))
+    worker = threading.Thread(target=lambda: tier.set("worker", b"x", ttl=60))
+    worker.start()
+    worker.join()
+    connections = list(tier._connections)
+    assert len(connections) == 2
+
+    tier.close()
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("select 1")
+    # 閉じた後に呼ばれても開き直して動く
+    tier.set("main", b"y", ttl=60)
+    assert tier.get("main") == b"y"
+    tier.close()
+
+
+def test_limit_counts_writes_from_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "SIZE_REFRESH_SECONDS", 0.0)
+    path = str(tmp_path / "cache.sqlite3")
+    # 同じファイルを使う別のプロセスの代わり
+    other, tier = DiskTier(path, max_bytes=1000), DiskTier(path, max_bytes=1000)
+    for index in range(9):
+        other.set(f"other-{index}", b"o" * 100, ttl=60)
+    assert tier.snapshot()["bytes"] == 0
+
+    tier.set("mine", b"m" * 200, ttl=60)
+    assert tier.evictions > 0
+    assert tier.snapshot()["bytes"] <= 900
+    assert tier.get("mine") == b"m" * 200
+    other.close()
+    tier.close()
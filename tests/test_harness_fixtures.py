@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.harness.cassette import Cassette
+from benchmarks.harness.fixtures import make_api_app, make_backend_app, start_fake_upstreams
+from benchmarks.harness.servers import FakeUpstreams, GOOGLE, OPENAI
+
+FAKE_KEYS = {
+    "GOOGLE_MAPS_API_KEY": "AIzaFAKE-harness-key-000000000000000",
+    "SERPER_API_KEY": "fake-serper-key",
+    "OPENAI_API_KEY": "sk-fake-harness",
+}
+SEARCH = {"latitude": 35.6812, "longitude": 139.7671}
+
+
+def make_app(kind: str, upstreams, tmp_path, name: str):
+    if kind == "api":
+        return make_api_app(upstreams, CACHE_DISK_PATH=tmp_path / f"{name}-cache.sqlite3", **FAKE_KEYS), "/api/search"
+    return make_backend_app(upstreams, tmp_path / f"{name}.sqlite3", **FAKE_KEYS), "/search"
+
+
+@pytest.mark.parametrize("kind", ["api", "backend"])
+def test_record_then_replay_one_search(kind, fake_upstreams, tmp_path):
+    # 実際の API の代わりに fake_upstreams へ転送して記録する
+    cassette_path = tmp_path / "cassette.json"
+    forward_urls = {GOOGLE: fake_upstreams.google_url, "serper": fake_upstreams.google_url,
+                    OPENAI: fake_upstreams.servers[OPENAI].url}
+    with FakeUpstreams(cassette=Cassette(path=cassette_path), record=True, forward_urls=forward_urls) as recorder:
+        app, path = make_app(kind, recorder, tmp_path, "record")
+        with TestClient(app) as client:
+            recorded = client.post(path, json=SEARCH)
+        recorder.cassette.save()
+    assert recorded.status_code == 200
+    assert recorder.total_calls(GOOGLE) > 0
+    forwarded = fake_upstreams.total_calls()
+
+    replayer = start_fake_upstreams(cassette=cassette_path)
+    try:
+        app, path = make_app(kind, replayer, tmp_path, "replay")
+        with TestClient(app) as client:
+            replayed = client.post(path, json=SEARCH)
+        assert replayer.total_calls(GOOGLE) > 0
+    finally:
+        replayer.stop()
+    assert replayed.status_code == 200
+    assert replayed.json() == recorded.json()
+    # 再生中は記録時の転送先を呼ばない
+    assert fake_upstreams.total_calls() == forwarded
@@ -0,0 +1,67 @@
+import asyncio
+import gc
+import threading
+import time
+
+import pytest
+
+from services.hedging import Hedger
+
+
+def warmed_hedger() -> Hedger:
+    """すぐにヘッジするよう、短いレイテンシを観測済みにした Hedger"""
+    hedger = Hedger("test", budget_ratio=1.0, min_samples=1, min_delay=0.01)
+    hedger.latencies.observe(0.01)
+    with hedger._lock:
+        hedger._stats["calls"] = 10
+    return hedger
+
+
+def slow_then_fast(release: threading.Event):
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) == 1:
+            # 1回目 (primary) は hedge が返った後に失敗する
+            release.wait(5)
+            raise RuntimeError("late primary failure")
+        return "hedge"
+    return func
+
+
+def test_acall_retrieves_the_losing_primary_error():
+    hedger = warmed_hedger()
+    release = threading.Event()
+    unhandled = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        assert await hedger.acall(slow_then_fast(release)) == "hedge"
+        release.set()
+        await asyncio.sleep(0.05)
+        gc.collect()
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert unhandled == []
+    assert hedger.snapshot()["hedge_wins"] == 1
+
+
+def test_call_returns_the_hedge_result():
+    hedger = warmed_hedger()
+    release = threading.Event()
+    assert hedger.call(slow_then_fast(release)) == "hedge"
+    release.set()
+    time.sleep(0.05)
+    assert hedger.snapshot()["hedge_wins"] == 1
+
+
+def test_call_refuses_to_block_the_event_loop():
+    hedger = warmed_hedger()
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            hedger.call(lambda: None)
+
+    asyncio.run(run())
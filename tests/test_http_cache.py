@@ -0,0 +1,53 @@
+import asyncio
+
+from services.http_cache import DataVersionRegistry, ETagIndex, MAX_TRACKED_CELLS
+
+TOKYO, OSAKA, FUKUOKA = (35.681, 139.767), (34.702, 135.495), (33.590, 130.420)
+
+
+class RecordingStore:
+    """CellVersionRepository の代わり。問い合わせたセルを記録する"""
+
+    def __init__(self, versions=None):
+        self.versions = versions or {}
+        self.requested = []
+
+    async def for_cells(self, zoom, cells):
+        self.requested.append(set(cells))
+        return {cell: version for cell, version in self.versions.items() if cell in set(cells)}
+
+
+def test_widely_separated_points_track_only_their_own_cells():
+    store = RecordingStore()
+    registry = DataVersionRegistry(store=store)
+
+    versions = asyncio.run(registry.versions_for_points([TOKYO, OSAKA, FUKUOKA, TOKYO]))
+
+    assert len(versions) == 3
+    assert store.requested == [set(versions)]
+
+
+def test_etag_index_skips_results_spanning_too_many_cells():
+    index = ETagIndex(DataVersionRegistry())
+    step = 0.05 # ズーム 13 のセル (約0.011度) より大きい間隔
+    points = [(35.0 + step * i, 139.0) for i in range(MAX_TRACKED_CELLS + 1)]
+
+    async def scenario():
+        await index.store("keyword:全国", "etag-1", points)
+        return await index.current_etag("keyword:全国")
+
+    assert asyncio.run(scenario()) is None
+    assert index.snapshot()["untracked"] == 1
+
+
+def test_bump_invalidates_only_dependent_entries():
+    registry = DataVersionRegistry()
+    index = ETagIndex(registry)
+
+    async def scenario():
+        await index.store("tokyo", "etag-tokyo", [TOKYO])
+        await index.store("osaka", "etag-osaka", [OSAKA])
+        registry.bump_points([OSAKA])
+        return await index.current_etag("tokyo"), await index.current_etag("osaka")
+
+    assert asyncio.run(scenario()) == ("etag-tokyo", None)
@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.lexicon import lexicon_sentiment, lexicon_smoking, MIXED_MAX_CONFIDENCE
+from services.model_cascade import ModelCascade, DEFAULT_CONFIDENCE_THRESHOLD
+
+
+class CountingGateway:
+    """常に確信度の高い "2" を返す LLM の代わり"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat(self, **kwargs):
+        self.calls += 1
+        token = SimpleNamespace(logprob=0.0)
+        choice = SimpleNamespace(message=SimpleNamespace(content="2"), logprobs=SimpleNamespace(content=[token]))
+        return SimpleNamespace(choices=[choice], usage=None)
+
+
+def classify(text: str) -> tuple[int, int]:
+    gateway = CountingGateway()
+    cascade = ModelCascade(gateway, models=["small"])
+    value = asyncio.run(cascade.classify("sentiment", [], int, max_tokens=1, temperature=0.0,
+                                         local_result=lexicon_sentiment(text)))
+    return value, gateway.calls
+
+
+def test_unanimous_hits_can_skip_the_llm():
+    score, confidence = lexicon_sentiment("店員が親切で丁寧、卓も綺麗")
+    assert score == 10 and confidence >= DEFAULT_CONFIDENCE_THRESHOLD
+    assert classify("店員が親切で丁寧、卓も綺麗") == (10, 0)
+
+
+def test_negated_hits_stay_below_the_threshold():
+    # 3語ヒットしても、否定されていれば語の数だけで閾値に届かない
+    score, confidence = lexicon_sentiment("親切でもなく、丁寧でもなく、綺麗ではない")
+    assert confidence <= MIXED_MAX_CONFIDENCE < DEFAULT_CONFIDENCE_THRESHOLD
+    assert score < 5
+    assert classify("親切でもなく、丁寧でもなく、綺麗ではない") == (2, 1)
+
+
+def test_mixed_hits_stay_below_the_threshold_regardless_of_count():
+    text = "良い" * 20 + "最悪"
+    assert lexicon_sentiment(text)[1] <= MIXED_MAX_CONFIDENCE
+    assert classify(text) == (2, 1)
+
+
+def test_reviews_without_smoking_terms_are_confidently_unknown():
+    status, confidence = lexicon_smoking(["店員さんが親切でした", "卓が綺麗で快適"])
+    assert status == "不明" and confidence >= DEFAULT_CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize("text", ["店内でタバコが吸えます。喫煙OKです", "煙草を吸いながら打てる"])
+def test_unclassifiable_smoking_mentions_go_to_the_llm(text):
+    # 喫煙に触れているが区分を判断できない記述は、確信度を下げて LLM に回す
+    status, confidence = lexicon_smoking(["店員さんが親切でした", text])
+    assert status == "不明" and confidence < DEFAULT_CONFIDENCE_THRESHOLD
+
+
+def test_classified_smoking_mentions_use_the_signal():
+    assert lexicon_smoking(["全席禁煙でした"])[0] == "禁煙"
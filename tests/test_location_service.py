@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from services.circuit_breaker import CircuitOpenError
+from services.data_access import DataAccessError
+from services.http_cache import DataVersionRegistry
+from services.location_service import LocationService, BBOX_FALLBACK_MAX_ROWS, response_degraded, _degraded
+from services.sentiment_analysis_service import SentimentAnalysisService
+from services.shared_cache import TieredCache
+from services.shop_record import ShopRecord
+
+
+class SlowSentimentService:
+    """要約・喫煙判定は終わらず、スコアの分析だけ失敗する"""
+
+    def __init__(self):
+        self.cancelled = []
+
+    async def _never(self, name):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+
+    async def get_summary_from_reviews(self, reviews, previous_summary=None):
+        return await self._never("summary")
+
+    async def get_smoking_status_from_reviews(self, reviews):
+        return await self._never("smoking")
+
+    async def analyze_text_list(self, texts):
+        await asyncio.sleep(0)
+        raise RuntimeError("analysis failed")
+
+
+def test_failed_analysis_cancels_concurrent_requests():
+    sentiment = SlowSentimentService()
+    service = LocationService(None, sentiment, None)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await service._analyze_reviews_incremental("place", [{"text": "禁煙で快適"}], None, None)
+        # 取り消した問い合わせが残っていない
+        assert [task for task in asyncio.all_tasks() if task is not asyncio.current_task()] == []
+
+    asyncio.run(run())
+    assert sorted(sentiment.cancelled) == ["smoking", "summary"]
+
+
+class NoClusterRpcShops:
+    """集約関数が未作成の jongso_shops"""
+
+    def __init__(self):
+        self.limits = []
+
+    async def bbox_clusters(self, *args):
+        raise DataAccessError("shops.bbox_clusters", "function not found", 404)
+
+    async def in_bbox(self, south, west, north, east, columns="*", limit=None):
+        self.limits.append(limit)
+        return [{"lat": 35.68, "lng": 139.76, "rating": 4.0}] * (limit or 10)
+
+
+def test_cluster_fallback_fetches_a_bounded_number_of_rows():
+    service = LocationService(None, None, None)
+    service.shops = NoClusterRpcShops()
+    result = asyncio.run(service.search_in_bounds(35.0, 139.0, 36.0, 140.0, zoom=8))
+    assert result["mode"] == "clusters"
+    assert service.shops.limits == [BBOX_FALLBACK_MAX_ROWS]
+    assert sum(cluster["count"] for cluster in result["clusters"]) == BBOX_FALLBACK_MAX_ROWS
+
+
+class OpenCircuitGateway:
+    async def chat(self, **kwargs):
+        raise CircuitOpenError("openai", 30.0)
+
+
+class ReviewMapsService:
+    def place_details(self, place_id, fields, language="ja", reviews_sort="newest"):
+        return {"result": {"reviews": [{"text": "店員さんの対応が普通で、卓の状態もそれなりでした。", "time": 1}]}}
+
+
+def test_open_llm_circuit_marks_the_result_degraded():
+    sentiment = SentimentAnalysisService(gateway=OpenCircuitGateway())
+    service = LocationService(ReviewMapsService(), sentiment, None)
+
+    async def run():
+        shop = await service._process_place_details({"place_id": "place", "name": "雀荘"})
+        return shop, response_degraded()
+
+    shop, degraded = asyncio.run(run())
+    # 既定値のスコア・エラーの要約を分析結果として返さず、縮退モードとして扱う (保存されない)
+    assert degraded
+    assert shop.summary == "レビュー情報取得中..."
+
+
+def test_db_only_nearby_search_uses_the_search_cache():
+    service = LocationService(None, None, None, data_versions=DataVersionRegistry(), cache=TieredCache())
+    calls = []
+
+    async def db_only_results(latitude, longitude, target_count, allow_upstream):
+        calls.append(allow_upstream)
+        _degraded.set(not allow_upstream) # 分析待ちの店舗を含むDBだけの結果
+        return [ShopRecord("place", name="雀荘", lat=latitude, lng=longitude)]
+
+    service._nearby_results = db_only_results
+
+    async def search(allow_upstream):
+        results = await service.search_nearby_jongso(35.68, 139.76, use_station_index=False, allow_upstream=allow_upstream)
+        return [shop.place_id for shop in results], response_degraded()
+
+    async def run():
+        first = await asyncio.create_task(search(False))
+        second = await asyncio.create_task(search(False))
+        upstream = await asyncio.create_task(search(True))
+        return first, second, upstream
+
+    first, second, upstream = asyncio.run(run())
+    # DBだけの検索は2回目をキャッシュから返し (縮退の印も再現する)、上流を使う検索とはキーを分ける
+    assert first == second == (["place"], True)
+    assert upstream == (["place"], False)
+    assert calls == [False, True]
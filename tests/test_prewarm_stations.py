@@ -0,0 +1,47 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+from services.adaptive_radius import DEFAULT_RADIUS_M
+from services.geo_grid import haversine_km
+from services import location_service
+
+spec = importlib.util.spec_from_file_location(
+    "prewarm_stations", Path(__file__).resolve().parents[1] / "scripts" / "prewarm_stations.py"
+)
+prewarm_stations = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(prewarm_stations)
+
+
+def test_sweep_cells_are_covered_by_one_search_radius():
+    cells = prewarm_stations.sweep_cells(35.6812, 139.7671, rings=1)
+    _, lat, lng = cells[0]
+    _, next_lat, next_lng = cells[1]
+    # 隣のセルの中心は検索半径より遠く、セルの角は検索半径の内側
+    assert haversine_km(lat, lng, next_lat, next_lng) * 1000 > DEFAULT_RADIUS_M
+    half = prewarm_stations.SWEEP_CELL_SIZE / 2
+    assert haversine_km(lat, lng, lat + half, lng + half) * 1000 <= DEFAULT_RADIUS_M
+
+
+class FlakyLocationService:
+    """1セル目だけ縮退モードで応答する"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def search_nearby_jongso(self, latitude, longitude, use_station_index=True):
+        self.calls += 1
+        if self.calls == 1:
+            location_service._degraded.set(True)
+        return [object()]
+
+
+def test_degraded_flag_does_not_leak_into_later_cells():
+    service = FlakyLocationService()
+
+    async def run():
+        first = await asyncio.create_task(prewarm_stations.crawl_cell(service, 35.0, 139.0))
+        second = await asyncio.create_task(prewarm_stations.crawl_cell(service, 35.1, 139.1))
+        return first[1], second[1]
+
+    assert asyncio.run(run()) == (True, False)
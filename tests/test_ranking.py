@@ -0,0 +1,45 @@
+import pytest
+
+from benchmarks.bench_ranking import (
+    legacy_api_services, legacy_backend, legacy_location_service, make_candidates,
+)
+from services.ranking import rank_results
+
+
+@pytest.fixture(scope="module")
+def candidates():
+    return make_candidates(2000, seed=7)
+
+
+def ids(results):
+    return [shop["id"] for shop in results]
+
+
+def test_rating_matches_legacy_location_service(candidates):
+    numeric = [dict(c, rating=float(c["rating"]) if c["rating"] is not None else None) for c in candidates]
+    assert ids(rank_results(numeric, "rating")) == ids(legacy_location_service(numeric))
+
+
+def test_rating_reviews_matches_legacy_api_services(candidates):
+    assert ids(rank_results(candidates, "rating_reviews")) == ids(legacy_api_services(candidates))
+
+
+def test_adjusted_rating_matches_legacy_backend(candidates):
+    assert ids(rank_results(candidates, "adjusted_rating")) == ids(legacy_backend(candidates))
+
+
+def test_missing_rating_ranks_as_zero():
+    shops = [
+        {"id": "unrated", "rating": None, "user_ratings_total": 500, "positive_score": 90},
+        {"id": "zero", "rating": 0, "user_ratings_total": 10},
+    ]
+    # 評価が無い店舗も 0 として扱い、レビュー数で並ぶ (ポジティブ度は加えない)
+    assert ids(rank_results(shops, "rating_reviews")) == ["unrated", "zero"]
+    assert ids(rank_results(shops, "adjusted_rating")) == ["unrated", "zero"]
+
+
+def test_backend_sort_matches_legacy_backend(backend_app, candidates):
+    # backend/app/utils/ranking.py (backend 用の複製) を使う JongsoService の並び順
+    from app.services.jongso_service import JongsoService
+
+    assert ids(JongsoService._sort_results(None, candidates)) == ids(legacy_backend(candidates))
@@ -0,0 +1,25 @@
+from fastapi.testclient import TestClient
+
+from services.http_cache import snap_to_cell
+
+
+def test_non_canonical_coordinates_redirect_to_snapped_url(api_app):
+    latitude, longitude = snap_to_cell(35.6812, 139.7671)
+    with TestClient(api_app) as client:
+        response = client.get("/api/search", params={"latitude": 35.6812, "longitude": 139.7671, "ranking": "rating"},
+                              follow_redirects=False)
+    assert response.status_code == 308
+    assert "public" in response.headers["cache-control"]
+    location = response.headers["location"]
+    assert f"latitude={latitude}" in location
+    assert f"longitude={longitude}" in location
+    assert "ranking=rating" in location
+
+
+def test_snapped_coordinates_are_served_without_redirect(api_app):
+    latitude, longitude = snap_to_cell(35.6812, 139.7671)
+    assert snap_to_cell(latitude, longitude) == (latitude, longitude)
+    with TestClient(api_app) as client:
+        response = client.get("/api/search", params={"latitude": latitude, "longitude": longitude},
+                              follow_redirects=False)
+    assert response.status_code == 200
@@ -0,0 +1,52 @@
+import asyncio
+
+from services.shared_cache import TieredCache
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        namespace = TieredCache().namespace("test", ttl=60)
+        started, release = asyncio.Event(), asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            started.set()
+            await release.wait()
+            return {"value": 1}
+
+        leader = asyncio.create_task(namespace.aget_or_compute("key", compute))
+        await started.wait()
+        follower = asyncio.create_task(namespace.aget_or_compute("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await follower == {"value": 1}
+        assert leader.cancelled()
+        assert len(calls) == 1
+        # 取り消された呼び出し元の計算結果もキャッシュされている
+        assert await namespace.aget("key") == {"value": 1}
+
+    asyncio.run(scenario())
+
+
+def test_compute_error_reaches_followers_and_is_not_cached():
+    async def scenario():
+        namespace = TieredCache().namespace("test", ttl=60)
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            raise ValueError("upstream failed")
+
+        tasks = [asyncio.create_task(namespace.aget_or_compute("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert await namespace.aget("key") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,51 @@
+import io
+import json
+import logging
+
+import pytest
+
+from services import structured_logging
+
+
+@pytest.fixture
+def log_stream():
+    stream = io.StringIO()
+    structured_logging.configure_logging("INFO", "json", verbose_sample_rate=1.0)
+    structured_logging._listener.handlers[0].setStream(stream)
+    yield stream
+    structured_logging.shutdown_logging()
+    logging.getLogger().handlers.clear()
+    for name in structured_logging.APP_LOGGERS:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+
+def _records(stream):
+    structured_logging.shutdown_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_library_debug_stays_disabled_while_app_debug_is_sampled(log_stream):
+    assert not logging.getLogger("httpcore.http2").isEnabledFor(logging.DEBUG)
+    assert logging.getLogger("services.location_service").isEnabledFor(logging.DEBUG)
+
+    tokens = structured_logging.begin_request("req-1")
+    try:
+        logging.getLogger("httpcore.http2").debug("frame %s", 1)
+        logging.getLogger("services.location_service").debug("DBヒット: %s", "place-1")
+    finally:
+        structured_logging.end_request(tokens)
+
+    records = _records(log_stream)
+    assert [(record["logger"], record["request_id"]) for record in records] == [("services.location_service", "req-1")]
+
+
+def test_unsampled_request_drops_app_debug(log_stream):
+    structured_logging._sample_rate = 0.0
+    tokens = structured_logging.begin_request()
+    try:
+        logging.getLogger("services.location_service").debug("dropped")
+        logging.getLogger("services.location_service").info("kept")
+    finally:
+        structured_logging.end_request(tokens)
+
+    assert [record["message"] for record in _records(log_stream)] == ["kept"]